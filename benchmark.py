@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Command line benchmarks used to compare the different code paths of the map
+stylizer on real OSM files. Each measurement that reports peak memory runs in
+its own process so the figures don't bleed into one another.
+
+    python benchmark.py load data/city.osm
+    python benchmark.py frame data/city.osm
+    python benchmark.py export data/city.osm --size 20000
+    python benchmark.py poster data/city.osm --size 40000
+    python benchmark.py query data/city.osm
+    python benchmark.py decompress data/city.osm.gz data/city.osm.xz
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+# Simplify our imports from other files
+sourcePath = 'src'
+sys.path.append(sourcePath)
+
+# Gather all of the python source files and add them to the system path
+for subdir, dirs, files in os.walk(os.path.join(os.getcwd(), sourcePath)):
+    for directory in dirs:
+        if directory != '__pycache__':
+            sys.path.append(os.path.join(subdir, directory))
+
+# Rendering benchmarks don't need a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory simply won't be reported
+    resource = None
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QPainter, QTransform
+from PyQt5.QtCore import QRectF
+
+from Map import Map
+from GeometryCache import GeometryCache
+import OSMFile
+from configuration import Configuration
+import constants as c
+
+
+# Canvas dimensions used whenever a benchmark needs a map
+WIDTH = 1000
+HEIGHT = 1000
+
+
+def peakRSS():
+    """
+    Function used to get the peak resident set size of this process
+
+    Parameters:
+    -----------
+    Returns:
+    --------
+    <value> : float | None
+        Peak RSS in MB, or None if the platform can't tell us
+    """
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == 'darwin':
+        return rss/1024/1024
+    return rss/1024
+
+
+def residentRSS():
+    """
+    Function used to get the current resident set size of this process
+
+    Parameters:
+    -----------
+    Returns:
+    --------
+    <value> : float | None
+        RSS in MB, or None if the platform can't tell us
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages*os.sysconf('SC_PAGE_SIZE')/1024/1024
+
+
+def _loadJob(queue, fname, kwargs):
+    """
+    Process target used to load a single map and report back on the queue
+    """
+    t0 = time.perf_counter()
+    _map = Map(WIDTH, HEIGHT, fname, None, **kwargs)
+    queue.put((time.perf_counter() - t0, peakRSS(), residentRSS()))
+
+
+def _posterJob(queue, fname, size, streamed):
+    """
+    Process target used to save a single poster and report back on the queue
+    """
+    app = QApplication(sys.argv[:1])
+    _map = Map(WIDTH, HEIGHT, fname, Configuration(persist=False))
+    out = os.path.join(c.FOLDER_OUTPUT, 'benchmark.png')
+
+    t0 = time.perf_counter()
+    if streamed:
+        _map.exportStrips(size, out)
+    else:
+        _map.export(size).save(out)
+    queue.put((time.perf_counter() - t0, peakRSS()))
+
+    os.remove(out)
+    del app
+
+
+def _isolated(target, *args):
+    """
+    Function used to run a job in a fresh process and collect its result
+
+    Parameters:
+    -----------
+    target : function
+        The job, taking a queue as its first argument
+    args : tuple
+        The remaining arguments to the job
+
+    Returns:
+    --------
+    <value> : Object
+        Whatever the job put on the queue
+    """
+    queue = mp.Queue()
+    proc = mp.Process(target=target, args=(queue,) + args)
+    proc.start()
+    result = queue.get()
+    proc.join()
+
+    return result
+
+
+def _report(label, seconds, rss, resident=None):
+    """
+    Function used to print a single benchmark line
+    """
+    rss = 'n/a' if rss is None else '%.1f MB' % rss
+    line = '%-24s %10.3f s   peak RSS %s' % (label, seconds, rss)
+    if resident is not None:
+        line += '   resident %.1f MB' % resident
+
+    print(line)
+
+
+def benchLoad(args):
+    """
+    Compare the ingestion paths of Map by load time, peak memory and the
+    memory still resident once the map is loaded
+    """
+    loaders = [('dom (ET.parse)', {'streaming': False, 'cache': False}),
+               ('streaming (iterparse)', {'streaming': True, 'cache': False,
+                                          'processes': 1}),
+               ('parallel (%d processes)' % os.cpu_count(),
+                {'streaming': True, 'cache': False, 'ranges': True}),
+               ('scanner (mmap)', {'cache': False, 'scan': True,
+                                   'processes': 1}),
+               ('pruned', {'cache': False, 'prune': True}),
+               ('cache (write)', {'cache': True}),
+               ('cache (read)', {'cache': True})]
+
+    for fname in args.files:
+        print('%s (%.1f MB)' % (fname, os.path.getsize(fname)/1024/1024))
+
+        # Ensure the first cached load has to parse and write the snapshot
+        GeometryCache().remove(fname)
+
+        for label, kwargs in loaders:
+            _report(label, *_isolated(_loadJob, fname, kwargs))
+
+
+def _frame(_map, width, height, zoom=1):
+    """
+    Function used to time the rendering of a single frame, zoomed into the
+    middle of the canvas like the map widget's view
+
+    Returns:
+    --------
+    <value> : float
+        The frame time in seconds
+    """
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    p = QPainter(image)
+    p.setTransform(QTransform(zoom, 0, 0, zoom, width*(1 - zoom)/2,
+                              height*(1 - zoom)/2))
+
+    t0 = time.perf_counter()
+    _map.draw(p)
+    p.end()
+
+    return time.perf_counter() - t0
+
+
+def benchFrame(args):
+    """
+    Compare the frame times of the per-Way, batched and layered rendering
+    modes. The first frame includes building the cached geometry; later
+    frames are what every repaint costs. For the layered mode, a restyle is a
+    frame after toggling a highway style, which re-renders only that layer.
+    Zoomed frames draw the middle of the canvas through a view transform,
+    only painting the features in view. Every Node of every feature is drawn
+    unless --detail asks for simplified geometry, such as --detail 0.25 0.25
+    """
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    config = Configuration(persist=False)
+    modes = [('per way', False, False), ('batched', True, False),
+             ('layered', True, True)]
+
+    for fname in args.files:
+        print('%s (%d x %d)' % (fname, args.width, args.height))
+        _map = Map(args.width, args.height, fname, config)
+        if args.detail:
+            _map.setDetail(*args.detail)
+
+        for label, batching, layered in modes:
+            # Start from empty caches so every mode builds its geometry
+            _map.setBatching(batching)
+            _map.setLayered(layered)
+            _map.setTransform(_map.getTransform())
+
+            first = _frame(_map, args.width, args.height)
+            frames = [_frame(_map, args.width, args.height)
+                      for i in range(args.frames)]
+
+            line = '%-24s first %8.1f ms   repaint %8.1f ms' % (
+                   label, 1000*first, 1000*sum(frames)/len(frames))
+
+            if layered:
+                style = c.CONFIG_STYLE_RESIDENTIAL
+                state = config.getItemState(style)
+                restyle = []
+                for i in range(args.frames):
+                    config.setItemState(style, not config.getItemState(style))
+                    restyle.append(_frame(_map, args.width, args.height))
+                config.setItemState(style, state)
+
+                line += '   restyle %8.1f ms' % (
+                        1000*sum(restyle)/len(restyle))
+
+            print(line)
+
+        # Layers aren't used once zoomed
+        _map.setLayered(False)
+        for zoom in args.zoom:
+            frames = [_frame(_map, args.width, args.height, zoom)
+                      for i in range(args.frames)]
+            print('%-24s                     repaint %8.1f ms' % (
+                  'zoomed %gx' % zoom, 1000*sum(frames)/len(frames)))
+
+    del app
+
+
+def benchExport(args):
+    """
+    Compare the export times for different numbers of painting threads
+    """
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    config = Configuration(persist=False)
+    cores = os.cpu_count() or 1
+    threads = args.threads or sorted({n for n in (1, 2, 4, 8, 16, 32)
+                                      if n < cores} | {cores})
+
+    for fname in args.files:
+        print('%s (longest side %d px)' % (fname, args.size))
+        _map = Map(WIDTH, HEIGHT, fname, config)
+
+        base = None
+        for n in threads:
+            t0 = time.perf_counter()
+            _map.export(args.size, n)
+            seconds = time.perf_counter() - t0
+
+            base = base or seconds
+            print('%-24s %10.3f s   speedup %5.2fx' % (
+                  '%d thread(s)' % n, seconds, base/seconds))
+
+    del app
+
+
+def benchPoster(args):
+    """
+    Compare saving a PNG poster from an image held in memory to streaming it
+    strip by strip, by time and peak memory
+    """
+    if not os.path.exists(c.FOLDER_OUTPUT):
+        os.mkdir(c.FOLDER_OUTPUT)
+
+    for fname in args.files:
+        print('%s (longest side %d px)' % (fname, args.size))
+
+        for label, streamed in [('in memory', False), ('streamed', True)]:
+            seconds, rss = _isolated(_posterJob, fname, args.size, streamed)
+            _report(label, seconds, rss)
+
+
+def benchQuery(args):
+    """
+    Compare finding the features in view through the spatial indexes to
+    testing every feature's bounding box, for views zoomed into random parts
+    of the canvas
+    """
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    config = Configuration(persist=False)
+    rng = np.random.default_rng(0)
+
+    for fname in args.files:
+        print('%s (%d queries per zoom)' % (fname, args.queries))
+        _map = Map(WIDTH, HEIGHT, fname, config)
+        t = _map.getTransform()
+        indexes = (_map._relationIndex, _map._wayIndex)
+        boxes = _map._featureExtents()
+
+        for zoom in args.zoom:
+            w, h = WIDTH/zoom, HEIGHT/zoom
+            corners = rng.uniform(0, 1, (args.queries, 2))*(WIDTH - w,
+                                                            HEIGHT - h)
+            rects = [QRectF(x, y, w, h) for x, y in corners.tolist()]
+
+            # Both are timed from the canvas rectangle to the sorted indices
+            # of the features in it
+            t0 = time.perf_counter()
+            found = 0
+            for rect in rects:
+                x0, y1 = t.canvasToMercator(rect.left(), rect.top())
+                x1, y0 = t.canvasToMercator(rect.right(), rect.bottom())
+                for index in indexes:
+                    found += len(index.query(x0, y0, x1, y1))
+            indexed = (time.perf_counter() - t0)/len(rects)
+
+            t0 = time.perf_counter()
+            for rect in rects:
+                x0, y0 = rect.left(), rect.top()
+                x1, y1 = rect.right(), rect.bottom()
+                for box in boxes:
+                    np.flatnonzero((box[:, 0] <= x1) & (box[:, 2] >= x0) &
+                                   (box[:, 1] <= y1) & (box[:, 3] >= y0))
+            scanned = (time.perf_counter() - t0)/len(rects)
+
+            print('%-24s %10d features   index %9.1f us   scan %9.1f us' % (
+                  'zoom %gx' % zoom, found//len(rects), 1e6*indexed,
+                  1e6*scanned))
+
+    del app
+
+
+def benchDecompress(args):
+    """
+    Measure the throughput of compressed OSM files: decompressing alone,
+    then loading them, where decompression overlaps with parsing
+    """
+    for fname in args.files:
+        with OSMFile.open(fname, readAhead=False) as f:
+            t0 = time.perf_counter()
+            size = 0
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                size += len(chunk)
+            decompress = time.perf_counter() - t0
+
+        mb = size/1024/1024
+        print('%s (%s, %.1f MB on disk, %.1f MB of XML)' % (
+              fname, OSMFile.codec(fname) or 'uncompressed',
+              os.path.getsize(fname)/1024/1024, mb))
+
+        seconds, rss, resident = _isolated(_loadJob, fname,
+                                           {'cache': False})
+        for label, t in [('decompress', decompress), ('load', seconds)]:
+            print('%-24s %10.3f s   %8.1f MB/s of XML' % (label, t, mb/t))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('load', help='OSM ingestion time and memory')
+    cmd.add_argument('files', nargs='+', help='OSM files to load')
+    cmd.set_defaults(func=benchLoad)
+
+    cmd = commands.add_parser('frame', help='Frame time per rendering mode')
+    cmd.add_argument('files', nargs='+', help='OSM files to render')
+    cmd.add_argument('--width', type=int, default=WIDTH)
+    cmd.add_argument('--height', type=int, default=HEIGHT)
+    cmd.add_argument('--frames', type=int, default=3,
+                     help='Repaints averaged per mode')
+    cmd.add_argument('--zoom', type=float, nargs='+', default=[4, 16, 64],
+                     help='Zoom factors of the zoomed frames')
+    cmd.add_argument('--detail', type=float, nargs=2,
+                     metavar=('TOLERANCE', 'SMALLEST'),
+                     help='Simplification tolerance and smallest feature '
+                          'drawn, in pixels; defaults to 0 0, drawing '
+                          'everything')
+    cmd.set_defaults(func=benchFrame)
+
+    cmd = commands.add_parser('export', help='Export time per thread count')
+    cmd.add_argument('files', nargs='+', help='OSM files to export')
+    cmd.add_argument('--size', type=int, default=6000,
+                     help="Size of the image's longest side in pixels")
+    cmd.add_argument('--threads', type=int, nargs='+',
+                     help='Thread counts compared; defaults to powers of two '
+                          'up to the number of cores')
+    cmd.set_defaults(func=benchExport)
+
+    cmd = commands.add_parser('poster', help='Poster export memory')
+    cmd.add_argument('files', nargs='+', help='OSM files to export')
+    cmd.add_argument('--size', type=int, default=20000,
+                     help="Size of the image's longest side in pixels")
+    cmd.set_defaults(func=benchPoster)
+
+    cmd = commands.add_parser('query', help='Viewport query latency')
+    cmd.add_argument('files', nargs='+', help='OSM files to query')
+    cmd.add_argument('--zoom', type=float, nargs='+',
+                     default=[1, 4, 16, 64, 256],
+                     help='Zoom factors of the views queried')
+    cmd.add_argument('--queries', type=int, default=200,
+                     help='Random views queried per zoom factor')
+    cmd.set_defaults(func=benchQuery)
+
+    cmd = commands.add_parser('decompress',
+                              help='Compressed OSM file throughput')
+    cmd.add_argument('files', nargs='+', help='OSM files to load')
+    cmd.set_defaults(func=benchDecompress)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -38,6 +38,8 @@ if __name__ == '__main__':
         os.mkdir(c.FOLDER_CONFIGS)
     if not os.path.exists(c.FOLDER_USER_CONFIGS):
         os.mkdir(c.FOLDER_USER_CONFIGS)
+    if not os.path.exists(c.FOLDER_CACHE):
+        os.mkdir(c.FOLDER_CACHE)
 
     # Start the program
     window = MainWindowHandlers()
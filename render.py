@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch renderer. Every OSM file given is styled with a configuration
+file and saved as an image, without opening any windows. Files can be
+rendered in parallel, one process per core.
+
+    python render.py data/city.osm --config configs/night.config --size 8000
+    python render.py data/*.osm --format png --jobs 0
+    python render.py data/city.osm --tiles 10 16 --jobs 0
+    python render.py data/city.osm --tiles 10 18 --mbtiles
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import traceback
+import multiprocessing as mp
+
+# Simplify our imports from other files
+sourcePath = 'src'
+sys.path.append(sourcePath)
+
+# Gather all of the python source files and add them to the system path
+for subdir, dirs, files in os.walk(os.path.join(os.getcwd(), sourcePath)):
+    for directory in dirs:
+        if directory != '__pycache__':
+            sys.path.append(os.path.join(subdir, directory))
+
+# Rendering doesn't need a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtGui import QGuiApplication
+
+from Map import Map
+from TilePyramid import TilePyramid, encode
+from MBTiles import MBTiles
+from configuration import Configuration
+import constants as c
+
+
+# Size of the canvas the styles' pen widths are tuned for; exports scale the
+# pens relative to it, like an export from the GUI scales them relative to
+# the map widget
+WIDTH = 1000
+HEIGHT = 1000
+
+# Tiles rendered by a tile job
+_TILES_PER_JOB = 64
+
+# The application of a worker process
+_app = None
+
+# The tile pyramid of the OSM file a worker process is rendering tiles of
+_pyramids = {}
+
+
+def _initWorker():
+    """
+    Function used to prepare a process for rendering. Painting on the images
+    requires a (headless) GUI application
+    """
+    global _app
+    _app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+
+
+def _renderJob(job):
+    """
+    Function used to render a single OSM file
+
+    Parameters:
+    -----------
+    job : tuple
+        The OSM file name and the parsed command line arguments
+
+    Returns:
+    --------
+    result : dict
+        The file, its output image and the time taken by each step, or the
+        error that stopped it
+    """
+    fname, args = job
+    base = os.path.splitext(os.path.basename(fname))[0]
+    out = os.path.join(args.output, '%s.%s' % (base, args.format))
+    result = {'file': fname, 'output': out}
+
+    try:
+        # Every job reads the same file, so none of them may write it back
+        config = Configuration(args.config, persist=False)
+
+        t0 = time.perf_counter()
+        _map = Map(args.canvas[0], args.canvas[1], fname, config,
+                   cache=not args.no_cache, prune=args.prune,
+                   scan=args.scan, ranges=True)
+        t1 = time.perf_counter()
+        if args.stream:
+            # Drawing and writing are interleaved strip by strip
+            _map.exportStrips(args.size, out, args.strip, args.threads)
+            t2 = t3 = time.perf_counter()
+        else:
+            image = _map.export(args.size, args.threads)
+            t2 = time.perf_counter()
+            if not image.save(out, args.format, args.quality):
+                raise IOError('Could not write %s' % out)
+            t3 = time.perf_counter()
+
+        result.update(load=t1 - t0, draw=t2 - t1, save=t3 - t2)
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    return result
+
+
+def _report(result):
+    """
+    Function used to print the summary line of a single job
+    """
+    if 'error' in result:
+        print('%-40s FAILED\n%s' % (result['file'], result['error']))
+        return
+
+    total = result['load'] + result['draw'] + result['save']
+    print('%-40s load %7.2f s   draw %7.2f s   save %7.2f s   total %7.2f s'
+          % (result['file'], result['load'], result['draw'], result['save'],
+             total))
+
+
+def _pyramid(fname, args):
+    """
+    Function used to get the tile pyramid of an OSM file; the file is only
+    loaded by the first job of each process that needs it
+    """
+    if fname not in _pyramids:
+        config = Configuration(args.config, persist=False)
+        _map = Map(args.canvas[0], args.canvas[1], fname, config,
+                   cache=not args.no_cache, prune=args.prune,
+                   scan=args.scan, ranges=True)
+
+        _pyramids.clear()
+        _pyramids[fname] = TilePyramid(_map)
+
+    return _pyramids[fname]
+
+
+def _tileJob(job):
+    """
+    Function used to render a batch of tiles of a zoom level into the
+    z/x/y.png layout, or to encode them for the MBTiles file
+
+    Parameters:
+    -----------
+    job : tuple
+        The OSM file name, zoom level, list of (x, y) tiles and the parsed
+        command line arguments
+
+    Returns:
+    --------
+    count : int
+        The number of tiles rendered
+    encoded : list of tuples
+        The (z, x, y, PNG bytes) of the tiles when writing MBTiles; the file
+        is only written by the parent process
+    """
+    fname, z, tiles, args = job
+    pyramid = _pyramid(fname, args)
+    base = os.path.splitext(os.path.basename(fname))[0]
+
+    if args.mbtiles:
+        return len(tiles), [(z, x, y, encode(pyramid.render(z, x, y)))
+                            for x, y in tiles]
+
+    for x, y in tiles:
+        folder = os.path.join(args.output, base, str(z), str(x))
+        os.makedirs(folder, exist_ok=True)
+
+        out = os.path.join(folder, '%d.png' % y)
+        if not pyramid.render(z, x, y).save(out, 'png'):
+            raise IOError('Could not write %s' % out)
+
+    return len(tiles), []
+
+
+def _batches(tiles):
+    """
+    Function used to split the tiles of a zoom level into the batches of a
+    tile job as they are found
+    """
+    tiles = iter(tiles)
+    while True:
+        batch = list(itertools.islice(tiles, _TILES_PER_JOB))
+        if not batch:
+            return
+        yield batch
+
+
+def _mbtiles(fname, pyramid, args):
+    """
+    Function used to start a fresh MBTiles file for an OSM file's tiles
+    """
+    base = os.path.splitext(os.path.basename(fname))[0]
+    out = os.path.join(args.output, base + '.mbtiles')
+    if os.path.exists(out):
+        os.remove(out)
+
+    minLat, maxLat, minLong, maxLong = pyramid.bounds
+    zoom = args.tiles[0]
+    metadata = {'name': base, 'format': 'png', 'type': 'baselayer',
+                'version': '1.0', 'minzoom': zoom, 'maxzoom': args.tiles[1],
+                'bounds': '%f,%f,%f,%f' % (minLong, minLat, maxLong, maxLat),
+                'center': '%f,%f,%d' % ((minLong + maxLong)/2,
+                                        (minLat + maxLat)/2, zoom)}
+
+    return MBTiles(out, metadata)
+
+
+def renderTiles(args):
+    """
+    Function used to render the tile pyramid of every file and print the
+    tiles per second of every zoom level. Tiles that would only show the
+    background are skipped
+
+    Returns:
+    --------
+    <value> : int
+        The exit code; 1 if any file failed
+    """
+    processes = args.jobs or os.cpu_count()
+    pool = None
+    if processes > 1:
+        pool = mp.Pool(processes, initializer=_initWorker)
+    else:
+        _initWorker()
+
+    failed, rendered = 0, 0
+    t0 = time.perf_counter()
+
+    for fname in args.files:
+        db = None
+        try:
+            pyramid = _pyramid(fname, args)
+            if args.mbtiles:
+                db = _mbtiles(fname, pyramid, args)
+
+            for z in range(args.tiles[0], args.tiles[1] + 1):
+                jobs = ((fname, z, tiles, args)
+                        for tiles in _batches(pyramid.tiles(z)))
+
+                t1 = time.perf_counter()
+                if pool is None:
+                    results = map(_tileJob, jobs)
+                else:
+                    results = pool.imap_unordered(_tileJob, jobs)
+
+                count = 0
+                for n, encoded in results:
+                    count += n
+                    for tile in encoded:
+                        db.write(*tile)
+                if db is not None:
+                    db.flush()
+                seconds = time.perf_counter() - t1
+                rendered += count
+
+                print('%-40s z%-3d %8d tiles %8d skipped %8.2f s %9.1f '
+                      'tiles/s' % (fname, z, count,
+                                   pyramid.tileCount(z) - count, seconds,
+                                   count/seconds if seconds else 0))
+
+            if db is not None:
+                print('%-40s %d tiles stored as %d distinct images' % (
+                      fname, db.tiles, db.images))
+        except Exception:
+            print('%-40s FAILED\n%s' % (fname, traceback.format_exc()))
+            failed += 1
+        finally:
+            if db is not None:
+                db.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    wall = time.perf_counter() - t0
+    print('%d tiles of %d of %d files rendered in %.2f s (%.1f tiles/s) with '
+          '%d process(es)' % (rendered, len(args.files) - failed,
+                              len(args.files), wall, rendered/wall,
+                              max(processes, 1)))
+
+    return 1 if failed else 0
+
+
+def main(args):
+    """
+    Function used to render every file and print the timing summary
+
+    Returns:
+    --------
+    <value> : int
+        The exit code; 1 if any file failed
+    """
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    if args.tiles:
+        return renderTiles(args)
+
+    jobs = [(fname, args) for fname in args.files]
+    processes = args.jobs or os.cpu_count()
+    processes = min(processes, len(jobs))
+
+    # Share the cores between the processes painting at the same time
+    if not args.threads:
+        args.threads = max(1, os.cpu_count()//max(processes, 1))
+
+    t0 = time.perf_counter()
+
+    # Each file is reported as soon as it is done
+    results = []
+    if processes <= 1:
+        _initWorker()
+        for result in map(_renderJob, jobs):
+            _report(result)
+            results.append(result)
+    else:
+        with mp.Pool(processes, initializer=_initWorker) as pool:
+            for result in pool.imap_unordered(_renderJob, jobs):
+                _report(result)
+                results.append(result)
+
+    wall = time.perf_counter() - t0
+    failed = sum('error' in result for result in results)
+
+    print('%d of %d files rendered in %.2f s with %d process(es)' % (
+          len(results) - failed, len(results), wall, max(processes, 1)))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='+', help='OSM files to render')
+    parser.add_argument('--config', default=c.FILE_CONFIG,
+                        help='Configuration file styling the maps')
+    parser.add_argument('--size', type=float, default=6000,
+                        help="Size of the images' longest side in pixels")
+    parser.add_argument('--format', default='jpg',
+                        help='Image format, such as jpg, png or tiff')
+    parser.add_argument('--quality', type=int, default=100,
+                        help='Image quality, 0 to 100')
+    parser.add_argument('--output', default=c.FOLDER_OUTPUT,
+                        help='Folder receiving the images')
+    parser.add_argument('--canvas', type=int, nargs=2, default=(WIDTH, HEIGHT),
+                        metavar=('WIDTH', 'HEIGHT'),
+                        help='Canvas size the pen widths are relative to')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Files rendered in parallel; 0 uses every core')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Painting threads per file; 0 shares every core '
+                             'between the parallel files')
+    parser.add_argument('--stream', action='store_true',
+                        help='Render strip by strip, writing each strip '
+                             'straight to the file (png or tiff only); the '
+                             'draw time then includes writing')
+    parser.add_argument('--strip', type=int, default=1024,
+                        help='Rows per strip when streaming')
+    parser.add_argument('--tiles', type=int, nargs=2,
+                        metavar=('MINZOOM', 'MAXZOOM'),
+                        help='Render z/x/y.png slippy map tiles of this zoom '
+                             'range instead of a single image per file')
+    parser.add_argument('--mbtiles', action='store_true',
+                        help='Store the tiles in one MBTiles file per OSM '
+                             'file, identical tiles only once, instead of '
+                             'z/x/y.png files')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't read or write the geometry cache, the "
+                             'snapshots of parsed files kept in %s/ under '
+                             'the working directory' % c.FOLDER_CACHE)
+    parser.add_argument('--prune', action='store_true',
+                        help='Keep only the features that can be drawn and '
+                             'the nodes they use, to save memory')
+    parser.add_argument('--scan', action='store_true',
+                        help='Read uncompressed XML with the fast memory '
+                             'mapped scanner, falling back to the XML parser '
+                             'for files it cannot read')
+
+    args = parser.parse_args()
+    if not os.path.exists(args.config):
+        parser.error('configuration file %s not found' % args.config)
+    if args.mbtiles and not args.tiles:
+        parser.error('--mbtiles requires --tiles')
+    if args.stream and args.format.lower() not in ('png', 'tif', 'tiff'):
+        parser.error('streamed images must be png or tiff')
+
+    sys.exit(main(args))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Local tile server. The slippy map tiles of an OSM file are rendered when
+first requested and served at http://127.0.0.1:8000/z/x/y.png, which any
+tile viewer can point at. Editing the configuration file, such as from the
+GUI, is picked up on the next request.
+
+    python serve.py data/city.osm
+    python serve.py data/city.osm --config configs/night.config --disk
+"""
+
+import os
+import sys
+import argparse
+
+# Simplify our imports from other files
+sourcePath = 'src'
+sys.path.append(sourcePath)
+
+# Gather all of the python source files and add them to the system path
+for subdir, dirs, files in os.walk(os.path.join(os.getcwd(), sourcePath)):
+    for directory in dirs:
+        if directory != '__pycache__':
+            sys.path.append(os.path.join(subdir, directory))
+
+# Rendering doesn't need a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtGui import QGuiApplication
+
+from Map import Map
+from TileServer import TileServer
+from configuration import Configuration
+import constants as c
+
+
+# Size of the canvas the styles' pen widths are tuned for (see render.py)
+WIDTH = 1000
+HEIGHT = 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('file', help='OSM file to serve')
+    parser.add_argument('--config', default=c.FILE_CONFIG,
+                        help='Configuration file styling the tiles; watched '
+                             'for changes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                        help='Tiles rendered at the same time')
+    parser.add_argument('--cache', type=int, default=4096,
+                        help='Tiles kept in memory')
+    parser.add_argument('--disk', action='store_true',
+                        help='Also cache the tiles on disk, in %s/tiles/ '
+                             'under the working directory' % c.FOLDER_CACHE)
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't read or write the geometry cache, the "
+                             'snapshots of parsed files kept in %s/ under '
+                             'the working directory' % c.FOLDER_CACHE)
+    parser.add_argument('--canvas', type=int, nargs=2, default=(WIDTH, HEIGHT),
+                        metavar=('WIDTH', 'HEIGHT'),
+                        help='Canvas size the pen widths are relative to')
+
+    args = parser.parse_args()
+    if not os.path.exists(args.config):
+        parser.error('configuration file %s not found' % args.config)
+
+    app = QGuiApplication(sys.argv[:1])
+
+    _map = Map(args.canvas[0], args.canvas[1], args.file,
+               Configuration(args.config, persist=False),
+               cache=not args.no_cache)
+
+    folder = None
+    if args.disk:
+        base = os.path.splitext(os.path.basename(args.file))[0]
+        folder = os.path.join(c.FOLDER_CACHE, 'tiles', base)
+
+    server = TileServer((args.host, args.port), _map, args.config,
+                        args.threads, args.cache, folder)
+
+    print('Serving %s at http://%s:%d/{z}/{x}/{y}.png' % (
+          args.file, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
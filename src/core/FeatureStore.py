@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage of the OSM Ways and Relations. Each feature's members are a
+slice of one flat array (the offsets array marks where each feature starts),
+and the members are resolved to indices of the store they reference once the
+file has been ingested.
+
+Only the tags we know how to render (the keys of DATA_GROUPS) are kept. Their
+values are classified into integer codes of a shared value table, so a feature
+costs a handful of array entries rather than a Python object and a dict.
+"""
+
+from array import array
+
+import numpy as np
+
+from NodeStore import among, compact
+
+import constants as c
+
+
+class Way:
+    def __init__(self, store, i):
+        """
+        Constructor
+
+        A lightweight view of a single entry of a FeatureStore of Ways
+        """
+        self._store = store
+        self._i = i
+        self._tags = None
+
+    """
+    ###########################################################################
+                                    Properties
+    ###########################################################################
+    """
+    @property
+    def ID(self):
+        return int(self._store.IDs[self._i])
+
+    @property
+    def NIDs(self):
+        return self._store.memberIDs(self._i)
+
+    @property
+    def indices(self):
+        return self._store.members(self._i)
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            self._tags = self._store.tags(self._i)
+        return self._tags
+
+
+class Relation:
+    def __init__(self, store, i):
+        """
+        Constructor
+
+        A lightweight view of a single entry of a FeatureStore of Relations
+        """
+        self._store = store
+        self._i = i
+        self._tags = None
+
+    """
+    ###########################################################################
+                                    Properties
+    ###########################################################################
+    """
+    @property
+    def ID(self):
+        return int(self._store.IDs[self._i])
+
+    @property
+    def WIDs(self):
+        return self._store.memberIDs(self._i)
+
+    @property
+    def indices(self):
+        return self._store.members(self._i)
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            self._tags = self._store.tags(self._i)
+        return self._tags
+
+
+class FeatureStore:
+    def __init__(self, view, keys=None):
+        """
+        Constructor
+
+        The store is filled by append while the file is ingested, then freeze
+        must be called before the store is used
+
+        Parameters:
+        -----------
+        view : Way | Relation
+            The class used to present a single feature
+        keys : list of Strings
+            The tag keys that are kept; defaults to the keys of DATA_GROUPS
+        """
+        self._view = view
+        self._keys = list(c.DATA_GROUPS.keys()) if keys is None else keys
+        self._values = []
+        self._codeOf = {}
+
+        # Growable buffers used during ingestion
+        self._bIDs = array('q')
+        self._bOffsets = array('q', [0])
+        self._bRefs = array('q')
+        self._bCodes = array('i')
+
+        # Arrays used once frozen
+        self._ids = None
+        self._offsets = None
+        self._refs = None
+        self._codes = None
+        self._order = None
+        self._target = None
+
+    """
+    ###########################################################################
+                                Built-In Functions
+    ###########################################################################
+    """
+    def __len__(self):
+        return len(self._ids) if self._ids is not None else len(self._bIDs)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._view(self, i)
+
+    """
+    ###########################################################################
+                                    Properties
+    ###########################################################################
+    """
+    @property
+    def IDs(self):
+        return self._ids
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def refs(self):
+        return self._refs
+
+    @property
+    def codes(self):
+        return self._codes
+
+    @property
+    def keys(self):
+        return self._keys
+
+    @property
+    def values(self):
+        return self._values
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def append(self, fid, refs, tags):
+        """
+        Function used to add a feature during ingestion
+
+        Parameters:
+        -----------
+        fid : int
+            The feature's ID
+        refs : list of ints
+            The IDs of the feature's members (Nodes for Ways, Ways for
+            Relations)
+        tags : dict
+            The feature's tags; keys we don't render are discarded
+
+        Returns:
+        --------
+        """
+        self._bIDs.append(fid)
+        self._bRefs.extend(refs)
+        self._bOffsets.append(len(self._bRefs))
+        self._encode(tags)
+
+    def extend(self, fids, counts, refs, tags):
+        """
+        Function used to add many features at once during ingestion
+
+        Parameters:
+        -----------
+        fids : ndarray
+            The features' IDs
+        counts : ndarray
+            The number of members of each feature
+        refs : ndarray
+            The IDs of the features' members, feature after feature
+        tags : list of dicts
+            Each feature's tags; see append
+
+        Returns:
+        --------
+        """
+        ends = len(self._bRefs) + np.cumsum(counts, dtype=np.int64)
+
+        self._bIDs.frombytes(np.asarray(fids, dtype=np.int64).tobytes())
+        self._bRefs.frombytes(np.asarray(refs, dtype=np.int64).tobytes())
+        self._bOffsets.frombytes(ends.tobytes())
+
+        # Tags are visited rather than keys, as most features have few or
+        # none of the kept keys
+        columns = {key: j for j, key in enumerate(self._keys)}
+        codes = np.full((len(tags), len(self._keys)), -1, dtype=np.int32)
+        for i, t in enumerate(tags):
+            for key, value in t.items():
+                j = columns.get(key)
+                if j is not None:
+                    codes[i, j] = self._code(value)
+
+        self._bCodes.frombytes(codes.tobytes())
+
+    def merge(self, store):
+        """
+        Function used to add the features of another store that is still
+        being ingested, such as one filled from another part of the file. Its
+        value codes are translated to this store's in a single lookup
+
+        Parameters:
+        -----------
+        store : FeatureStore
+            The unfrozen store, keeping the same keys
+
+        Returns:
+        --------
+        """
+        offsets = np.frombuffer(store._bOffsets, dtype=np.int64)[1:]
+        codes = np.frombuffer(store._bCodes, dtype=np.int32)
+
+        # The extra trailing entry is hit by the -1 code of missing tags
+        lut = np.array([self._code(value) for value in store._values] + [-1],
+                       dtype=np.int32)
+
+        self._bOffsets.frombytes((offsets + len(self._bRefs)).tobytes())
+        self._bIDs.extend(store._bIDs)
+        self._bRefs.extend(store._bRefs)
+        self._bCodes.frombytes(lut[codes].tobytes())
+
+    def clear(self):
+        """
+        Function used to drop every feature ingested so far, such as when a
+        reader gives up on a file part way through
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        self._values = []
+        self._codeOf = {}
+        self._bIDs = array('q')
+        self._bOffsets = array('q', [0])
+        self._bRefs = array('q')
+        self._bCodes = array('i')
+
+    def freeze(self, target):
+        """
+        Function used to convert the ingestion buffers into arrays and resolve
+        the member IDs against the store they reference. The buffers are
+        released afterwards
+
+        Parameters:
+        -----------
+        target : NodeStore | FeatureStore
+            The store holding this store's members
+
+        Returns:
+        --------
+        """
+        self._ids = np.frombuffer(self._bIDs, dtype=np.int64).copy()
+        self._offsets = np.frombuffer(self._bOffsets, dtype=np.int64).copy()
+        self._refs = target.index(np.frombuffer(self._bRefs, dtype=np.int64))
+        self._codes = np.frombuffer(self._bCodes, dtype=np.int32).reshape(
+                                                       -1, len(self._keys))
+        self._codes = self._codes.copy()
+        self._order = np.argsort(self._ids, kind='stable')
+        self._target = target
+
+        self._bIDs, self._bOffsets = array('q'), array('q', [0])
+        self._bRefs, self._bCodes = array('q'), array('i')
+        self._codeOf = {}
+
+    def getState(self):
+        """
+        Function used to get the arrays and tables that fully describe a
+        frozen store, such as for writing to the geometry cache
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        arrays : dict
+            The numpy arrays keyed by name
+        tables : dict
+            The JSON serializable tag keys and values
+        """
+        arrays = {'ids': self._ids, 'offsets': self._offsets,
+                  'refs': self._refs, 'codes': self._codes,
+                  'order': self._order}
+        tables = {'keys': self._keys, 'values': self._values}
+
+        return arrays, tables
+
+    def setState(self, arrays, tables, target):
+        """
+        Function used to restore a frozen store from getState's output
+
+        Parameters:
+        -----------
+        arrays : dict
+            The numpy arrays keyed by name; these may be memory mapped
+        tables : dict
+            The tag keys and values
+        target : NodeStore | FeatureStore
+            The store holding this store's members
+
+        Returns:
+        --------
+        """
+        self._ids = arrays['ids']
+        self._offsets = arrays['offsets']
+        self._refs = arrays['refs']
+        self._codes = arrays['codes']
+        self._order = arrays['order']
+        self._keys = tables['keys']
+        self._values = tables['values']
+        self._target = target
+
+    def tagged(self, groups):
+        """
+        Function used to find the features being ingested that have one of
+        some values for a key
+
+        Parameters:
+        -----------
+        groups : dict
+            The values looked for, keyed by tag key
+
+        Returns:
+        --------
+        found : ndarray
+            A boolean per feature, True for the features with such a tag
+        """
+        codes = np.frombuffer(self._bCodes, dtype=np.int32).reshape(
+                                                       -1, len(self._keys))
+
+        found = np.zeros(len(codes), dtype=bool)
+        for key, values in groups.items():
+            # The extra trailing entry is hit by the -1 code of features
+            # without the tag
+            lut = np.array([value in values for value in self._values] +
+                           [False])
+            found |= lut[codes[:, self._keys.index(key)]]
+
+        return found
+
+    def isin(self, fids):
+        """
+        Function used to find the features being ingested whose IDs are
+        among some IDs
+
+        Parameters:
+        -----------
+        fids : ndarray
+            The feature IDs looked for
+
+        Returns:
+        --------
+        <value> : ndarray
+            A boolean per feature, True for the features found
+        """
+        return among(np.frombuffer(self._bIDs, dtype=np.int64), fids)
+
+    def select(self, keep):
+        """
+        Function used to drop features during ingestion, before the store is
+        frozen, so the dropped features are never copied or resolved. The
+        buffers are compacted in place
+
+        Parameters:
+        -----------
+        keep : ndarray
+            A boolean per feature, True for the features kept
+
+        Returns:
+        --------
+        refs : ndarray
+            The IDs of the kept features' members
+        """
+        offsets = np.frombuffer(self._bOffsets, dtype=np.int64)
+        counts = np.diff(offsets)
+        n = int(np.count_nonzero(keep))
+        offsets[1:n + 1] = np.cumsum(counts[keep])
+        del offsets
+
+        compact(self._bRefs, np.repeat(keep, counts))
+        compact(self._bCodes, np.repeat(keep, len(self._keys)))
+        compact(self._bIDs, keep)
+        del self._bOffsets[n + 1:]
+
+        return np.frombuffer(self._bRefs, dtype=np.int64).copy()
+
+    def view(self, i):
+        """
+        Function used to get the view of the i-th feature
+        """
+        return self._view(self, i)
+
+    def index(self, fids):
+        """
+        Function used to convert feature IDs into positions in this store
+
+        Parameters:
+        -----------
+        fids : list of ints | ndarray
+            The feature IDs being looked up
+
+        Returns:
+        --------
+        idx : ndarray
+            The int64 position of each ID, or -1 where it isn't in the store
+        """
+        fids = np.asarray(fids, dtype=np.int64)
+        if len(self._ids) == 0:
+            return np.full(len(fids), -1, dtype=np.int64)
+
+        ids = self._ids[self._order]
+        idx = np.searchsorted(ids, fids)
+        idx[idx == len(ids)] = 0
+        found = ids[idx] == fids
+
+        return np.where(found, self._order[idx], -1)
+
+    def members(self, i):
+        """
+        Function used to get the resolved members of the i-th feature
+
+        Returns:
+        --------
+        <value> : ndarray
+            Member positions in the target store; -1 marks a member missing
+            from the file
+        """
+        return self._refs[self._offsets[i]:self._offsets[i+1]]
+
+    def memberIDs(self, i):
+        """
+        Function used to get the IDs of the i-th feature's members that are
+        present in the file
+        """
+        idx = self.members(i)
+        return self._target.IDs[idx[idx >= 0]].tolist()
+
+    def tags(self, i):
+        """
+        Function used to get the kept tags of the i-th feature as a dict
+        """
+        return {key: self._values[code] for key, code in
+                zip(self._keys, self._codes[i].tolist()) if code >= 0}
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _encode(self, tags):
+        """
+        Private function used to add the value codes of a feature's tags,
+        one per kept key; -1 marks a key the feature doesn't have
+        """
+        for key in self._keys:
+            value = tags.get(key)
+            self._bCodes.append(-1 if value is None else self._code(value))
+
+    def _code(self, value):
+        """
+        Private function used to get the code of a tag value, adding the
+        value to the value table if it's new
+        """
+        code = self._codeOf.get(value)
+        if code is None:
+            code = self._codeOf[value] = len(self._values)
+            self._values.append(value)
+
+        return code
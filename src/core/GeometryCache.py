@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent binary snapshots of parsed OSM files. Each snapshot is a folder of
+.npy arrays (the NodeStore and FeatureStore arrays) plus a small JSON file with
+the bounds, tag tables and the stamp of the source file. Snapshots are memory
+mapped on load, so reopening a file costs little more than reading the stamp.
+
+A snapshot is only used if the source file's path, size and modification time,
+the parser's CACHE_VERSION and the parts of DATA_GROUPS the snapshot depends
+on all match the stamp it was written with.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+from NodeStore import NodeStore
+from FeatureStore import FeatureStore, Way, Relation
+
+import constants as c
+
+
+# The name of the JSON file describing each snapshot
+_META = 'meta.json'
+
+
+class GeometryCache:
+    def __init__(self, folder=c.FOLDER_CACHE, pruned=False):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        folder : String
+            The folder in which the snapshots are stored
+        pruned : boolean
+            True for the snapshots of files loaded with only what can be
+            drawn; these are kept apart from the complete snapshots
+        """
+        self._folder = folder
+        self._pruned = pruned
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def load(self, fname):
+        """
+        Function used to load the snapshot of an OSM file
+
+        Parameters:
+        -----------
+        fname : String
+            The OSM file name
+
+        Returns:
+        --------
+        <value> : tuple | None
+            The bounds, NodeStore, Way FeatureStore and Relation FeatureStore
+            of the file, or None if there is no valid snapshot
+        """
+        entry = self._entry(fname)
+
+        try:
+            with open(os.path.join(entry, _META)) as f:
+                meta = json.load(f)
+
+            if meta['stamp'] != self._stamp(fname):
+                return None
+
+            nodes = NodeStore()
+            nodes.setState(self._readArrays(entry, 'nodes'))
+
+            ways = FeatureStore(Way)
+            ways.setState(self._readArrays(entry, 'ways'), meta['ways'],
+                          nodes)
+
+            relations = FeatureStore(Relation)
+            relations.setState(self._readArrays(entry, 'relations'),
+                               meta['relations'], ways)
+        except (OSError, ValueError, KeyError):
+            # Missing, partially written or otherwise unreadable snapshot
+            return None
+
+        return tuple(meta['bounds']), nodes, ways, relations
+
+    def save(self, fname, bounds, nodes, ways, relations):
+        """
+        Function used to write the snapshot of an OSM file, replacing any
+        stale snapshot of the same file. Failing to write the cache is not
+        fatal; the map was parsed either way
+
+        Parameters:
+        -----------
+        fname : String
+            The OSM file name
+        bounds : tuple of floats
+            The minimum & maximum latitude and minimum & maximum longitude
+        nodes : NodeStore
+            The frozen Nodes
+        ways, relations : FeatureStore
+            The frozen Ways and Relations
+
+        Returns:
+        --------
+        """
+        entry = self._entry(fname)
+        temp = '%s.%s.tmp' % (entry, os.getpid())
+
+        try:
+            os.makedirs(temp, exist_ok=True)
+
+            self._writeArrays(temp, 'nodes', nodes.getState())
+            wArrays, wTables = ways.getState()
+            self._writeArrays(temp, 'ways', wArrays)
+            rArrays, rTables = relations.getState()
+            self._writeArrays(temp, 'relations', rArrays)
+
+            # The meta file is written last, so a snapshot without one is
+            # never considered valid
+            meta = {'stamp': self._stamp(fname), 'bounds': list(bounds),
+                    'ways': wTables, 'relations': rTables}
+            with open(os.path.join(temp, _META), 'w') as f:
+                json.dump(meta, f)
+
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(temp, entry)
+        except OSError as e:
+            shutil.rmtree(temp, ignore_errors=True)
+            print('* WARNING: could not write the geometry cache: %s' % e)
+
+    def remove(self, fname):
+        """
+        Function used to delete the snapshot of an OSM file, if there is one,
+        so that the next load has to parse the file
+
+        Parameters:
+        -----------
+        fname : String
+            The OSM file name
+
+        Returns:
+        --------
+        """
+        shutil.rmtree(self._entry(fname), ignore_errors=True)
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _entry(self, fname):
+        """
+        Private function used to get the snapshot folder of an OSM file
+        """
+        path = os.path.abspath(fname).encode('utf-8')
+        digest = hashlib.sha1(path).hexdigest()
+
+        return os.path.join(self._folder, digest + ('-pruned' if self._pruned
+                                                    else ''))
+
+    def _stamp(self, fname):
+        """
+        Private function used to describe the version of an OSM file (and of
+        the parser) a snapshot corresponds to
+        """
+        stat = os.stat(fname)
+        return {'version': c.CACHE_VERSION, 'path': os.path.abspath(fname),
+                'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'pruned': self._pruned, 'groups': self._groups()}
+
+    def _groups(self):
+        """
+        Private function used to digest the parts of DATA_GROUPS a snapshot
+        depends on. Only the tags of its keys are stored, and a pruned
+        snapshot only keeps the features whose values are styled, so adding
+        a key or, when pruned, a value makes older snapshots stale
+        """
+        if self._pruned:
+            groups = {key: sorted(values) for key, values
+                      in c.DATA_GROUPS.items()}
+        else:
+            groups = sorted(c.DATA_GROUPS)
+
+        text = json.dumps(groups, sort_keys=True).encode('utf-8')
+
+        return hashlib.sha1(text).hexdigest()
+
+    def _readArrays(self, entry, prefix):
+        """
+        Private function used to memory map every array of a store
+        """
+        arrays = {}
+        for name in os.listdir(entry):
+            parts = name.split('.')
+            if parts[0] == prefix and parts[-1] == 'npy':
+                arrays[parts[1]] = np.load(os.path.join(entry, name),
+                                           mmap_mode='r')
+        return arrays
+
+    def _writeArrays(self, entry, prefix, arrays):
+        """
+        Private function used to write every array of a store
+        """
+        for name, array in arrays.items():
+            np.save(os.path.join(entry, '%s.%s.npy' % (prefix, name)), array)
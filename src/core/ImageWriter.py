@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Image files written a strip of rows at a time, so an image never has to be
+held in memory as a whole. Rows are 8 bit RGB, given as uint8 arrays of shape
+(rows, width, 3).
+
+PNG rows are filtered and fed through a single zlib stream as they arrive.
+TIFF strips are each deflate compressed and the directory describing them is
+written once the last one is in; images that could outgrow 4 GB are written
+as BigTIFF.
+"""
+
+import os
+import zlib
+import struct
+
+import numpy as np
+
+
+# Compressed bytes gathered before a PNG IDAT chunk is written
+_CHUNK_BYTES = 1 << 20
+
+
+def create(fname, width, height):
+    """
+    Function used to create the writer matching the file extension
+
+    Parameters:
+    -----------
+    fname : String
+        The image file name; .png, .tif or .tiff
+    width : int
+        The image width in pixels
+    height : int
+        The image height in pixels
+
+    Returns:
+    --------
+    writer : PNGWriter | TIFFWriter
+        The writer
+    """
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.png':
+        return PNGWriter(fname, width, height)
+    elif ext in ('.tif', '.tiff'):
+        return TIFFWriter(fname, width, height)
+
+    raise ValueError('Streamed images must be PNG or TIFF, not "%s"' % ext)
+
+
+class PNGWriter:
+    def __init__(self, fname, width, height, level=6):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        fname : String
+            The image file name
+        width : int
+            The image width in pixels
+        height : int
+            The image height in pixels
+        level : int
+            The zlib compression level
+        """
+        self._file = open(fname, 'wb')
+        self._width = width
+        self._height = height
+        self._rows = 0
+        self._previous = np.zeros(3*width, dtype=np.uint8)
+        self._zlib = zlib.compressobj(level)
+        self._pending = []
+        self._size = 0
+
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0,
+                                         0, 0))
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def write(self, rows):
+        """
+        Function used to append the next rows of the image
+
+        Parameters:
+        -----------
+        rows : ndarray
+            The uint8 RGB rows, of shape (n, width, 3)
+
+        Returns:
+        --------
+        """
+        rows = rows.reshape(len(rows), -1)
+        self._rows += len(rows)
+
+        # The Up filter (2) stores each row as its difference to the previous
+        # row, which compresses the flat areas of a map very well
+        above = np.vstack((self._previous[None], rows[:-1]))
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        np.subtract(rows, above, out=filtered[:, 1:])
+        self._previous = rows[-1].copy()
+
+        self._compressed(self._zlib.compress(filtered.tobytes()))
+
+    def close(self):
+        """
+        Function used to finish the file once every row has been written
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        if self._rows != self._height:
+            raise ValueError('%d of %d rows were written' % (self._rows,
+                                                            self._height))
+
+        self._compressed(self._zlib.flush(), force=True)
+        self._chunk(b'IEND', b'')
+        self._file.close()
+
+    def abort(self):
+        """
+        Function used to give up on the image, such as when drawing it failed;
+        the file is closed and the partial image deleted
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _compressed(self, data, force=False):
+        """
+        Private function used to collect compressed data into IDAT chunks
+        """
+        self._pending.append(data)
+        self._size += len(data)
+
+        if self._size >= _CHUNK_BYTES or (force and self._size):
+            self._chunk(b'IDAT', b''.join(self._pending))
+            self._pending, self._size = [], 0
+
+    def _chunk(self, kind, data):
+        """
+        Private function used to write a single PNG chunk
+        """
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+class TIFFWriter:
+    def __init__(self, fname, width, height, level=6):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        See PNGWriter
+        """
+        self._file = open(fname, 'wb')
+        self._width = width
+        self._height = height
+        self._level = level
+        self._rows = 0
+        self._offsets = []
+        self._counts = []
+        self._rowsPerStrip = None
+
+        # Deflate rarely grows data by more than a fraction of a percent, but
+        # the format has to be chosen before any of it is written
+        self._big = 3*width*height*1.01 + 65536 >= 2**32
+
+        if self._big:
+            self._file.write(struct.pack('<2sHHHQ', b'II', 43, 8, 0, 0))
+        else:
+            self._file.write(struct.pack('<2sHI', b'II', 42, 0))
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def write(self, rows):
+        """
+        Function used to append the next rows of the image as a strip. Every
+        strip but the last must have the same number of rows
+
+        Parameters:
+        -----------
+        rows : ndarray
+            The uint8 RGB rows, of shape (n, width, 3)
+
+        Returns:
+        --------
+        """
+        if self._rowsPerStrip is None:
+            self._rowsPerStrip = len(rows)
+        self._rows += len(rows)
+
+        data = zlib.compress(np.ascontiguousarray(rows).tobytes(), self._level)
+        self._offsets.append(self._file.tell())
+        self._counts.append(len(data))
+        self._file.write(data)
+
+    def close(self):
+        """
+        Function used to write the image directory once every strip has been
+        written, and finish the file
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        if self._rows != self._height:
+            raise ValueError('%d of %d rows were written' % (self._rows,
+                                                            self._height))
+
+        # Word align the directory and the arrays it points to
+        if self._file.tell() % 2:
+            self._file.write(b'\0')
+
+        offsetType = 16 if self._big else 4
+        arrays = self._file.tell()
+        pack = '<%dQ' if self._big else '<%dI'
+        n = len(self._offsets)
+        self._file.write(struct.pack(pack % n, *self._offsets))
+        self._file.write(struct.pack(pack % n, *self._counts))
+        self._file.write(struct.pack('<3H', 8, 8, 8))
+
+        size = 8 if self._big else 4
+        counts, bits = arrays + n*size, arrays + 2*n*size
+
+        # (tag, type, count, value); type 3 is SHORT and 4 is LONG
+        entries = [(256, 4, 1, self._width),
+                   (257, 4, 1, self._height),
+                   (258, 3, 3, bits),
+                   (259, 3, 1, 8),
+                   (262, 3, 1, 2),
+                   (273, offsetType, n, arrays),
+                   (277, 3, 1, 3),
+                   (278, 4, 1, self._rowsPerStrip),
+                   (279, offsetType, n, counts),
+                   (284, 3, 1, 1)]
+
+        # Arrays that fit in the value field are stored in place
+        inline = {258: [8, 8, 8], 273: self._offsets, 279: self._counts}
+
+        directory = self._file.tell()
+        if self._big:
+            self._file.write(struct.pack('<Q', len(entries)))
+        else:
+            self._file.write(struct.pack('<H', len(entries)))
+
+        for tag, kind, count, value in entries:
+            self._file.write(self._entry(tag, kind, count, value,
+                                         inline.get(tag)))
+
+        if self._big:
+            self._file.write(struct.pack('<Q', 0))
+            self._file.seek(8)
+            self._file.write(struct.pack('<Q', directory))
+        else:
+            self._file.write(struct.pack('<I', 0))
+            self._file.seek(4)
+            self._file.write(struct.pack('<I', directory))
+
+        self._file.close()
+
+    def abort(self):
+        """
+        Function used to give up on the image, such as when drawing it failed;
+        the file is closed and the partial image deleted
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _entry(self, tag, kind, count, value, values=None):
+        """
+        Private function used to pack a single directory entry
+
+        Parameters:
+        -----------
+        tag, kind, count : int
+            The entry's tag, field type and number of values
+        value : int
+            The value, or the offset of the values if they don't fit
+        values : list of ints | None
+            The values of an array entry, stored in place if they fit
+
+        Returns:
+        --------
+        <value> : bytes
+            The packed entry
+        """
+        size = 8 if self._big else 4
+        fmt = {3: 'H', 4: 'I', 16: 'Q'}[kind]
+
+        if values is None:
+            values = [value]
+
+        if count*struct.calcsize(fmt) <= size:
+            field = struct.pack('<%d%s' % (count, fmt), *values)
+            field = field.ljust(size, b'\0')
+        else:
+            field = struct.pack('<Q' if self._big else '<I', value)
+
+        if self._big:
+            return struct.pack('<HHQ', tag, kind, count) + field
+        return struct.pack('<HHI', tag, kind, count) + field
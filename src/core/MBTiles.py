@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Tile pyramids stored in a single SQLite file in the MBTiles layout. Most
+tiles of a map are repeats (open water, a landuse interior, bare background),
+so the tile images are stored once per distinct content in an images table
+and the map table only points at them; the tiles view presents the standard
+MBTiles schema to readers.
+
+MBTiles number rows from the south (TMS), so the row of slippy map tile
+z/x/y is stored as 2**z - 1 - y.
+"""
+
+import hashlib
+import sqlite3
+
+
+# Tiles written per transaction
+_BATCH = 10000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY,
+                                   tile_data BLOB);
+CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER,
+                                tile_row INTEGER, tile_id TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS map_index
+                    ON map (zoom_level, tile_column, tile_row);
+CREATE VIEW IF NOT EXISTS tiles AS
+       SELECT map.zoom_level AS zoom_level,
+              map.tile_column AS tile_column,
+              map.tile_row AS tile_row,
+              images.tile_data AS tile_data
+       FROM map JOIN images ON images.tile_id = map.tile_id;
+'''
+
+
+class MBTiles:
+    def __init__(self, fname, metadata=None):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        fname : String
+            The MBTiles file; tiles already in it are kept unless rewritten
+        metadata : dict | None
+            The metadata entries to set, such as name, format, bounds,
+            minzoom and maxzoom
+        """
+        self._db = sqlite3.connect(fname)
+        self._db.executescript(_SCHEMA)
+
+        # A tile set is rebuilt rather than recovered if a run is interrupted
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('PRAGMA journal_mode=MEMORY')
+
+        self._known = set(row[0] for row in
+                          self._db.execute('SELECT tile_id FROM images'))
+        self._images = []
+        self._map = []
+        self._tiles = 0
+
+        if metadata:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                [(str(k), str(v)) for k, v in metadata.items()])
+            self._db.commit()
+
+    """
+    ###########################################################################
+                                Properties
+    ###########################################################################
+    """
+    @property
+    def tiles(self):
+        return self._tiles
+
+    @property
+    def images(self):
+        return len(self._known)
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def write(self, z, x, y, data):
+        """
+        Function used to add a tile. Tiles are written in bulk, once enough of
+        them have been gathered and when the file is closed
+
+        Parameters:
+        -----------
+        z, x, y : int
+            The slippy map tile
+        data : bytes
+            The encoded tile
+
+        Returns:
+        --------
+        """
+        tileID = hashlib.sha1(data).hexdigest()
+        if tileID not in self._known:
+            self._known.add(tileID)
+            self._images.append((tileID, data))
+
+        self._map.append((z, x, 2**z - 1 - y, tileID))
+        self._tiles += 1
+
+        if len(self._map) >= _BATCH:
+            self.flush()
+
+    def flush(self):
+        """
+        Function used to write the gathered tiles in a single transaction
+        """
+        with self._db:
+            self._db.executemany('INSERT OR IGNORE INTO images VALUES (?, ?)',
+                                 self._images)
+            self._db.executemany('INSERT OR REPLACE INTO map VALUES '
+                                 '(?, ?, ?, ?)', self._map)
+        self._images, self._map = [], []
+
+    def close(self):
+        """
+        Function used to write the remaining tiles and close the file
+        """
+        self.flush()
+        self._db.close()
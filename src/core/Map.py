@@ -6,116 +6,79 @@ Created on Sun Jun 21 16:18:49 2020
 
 This class is used to ingest an Open Source Map (osm extension) file. Map will
 render lines (represented by QPen type) and fills (represented by QColor type)
-but not points. Relations consist of Ways, which consist of Nodes.
+but not points. Relations consist of Ways, which consist of Nodes. Nodes are
+kept in a columnar NodeStore and Ways and Relations in columnar FeatureStores
+rather than as individual objects.
 """
 
+import os
+import copy
+import math
+import threading
+import multiprocessing as mp
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
-from PyQt5.QtGui import QPen, QColor, QPainterPath
-from PyQt5.QtCore import QPointF
+import numpy as np
+
+from PyQt5.QtGui import QPen, QColor, QPainterPath, QPolygonF, QImage
+from PyQt5.QtGui import QPainter, QPainterPathStroker
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5 import sip
 
 from Transform import Transform
+from NodeStore import NodeStore
+from FeatureStore import FeatureStore, Way, Relation
+from GeometryCache import GeometryCache
+from SpatialIndex import SpatialIndex
+import ImageWriter
+import PBFReader
+import OSMFile
+import XMLReader
+import XMLScanner
 
 import constants as c
 
 
-class Node:
-    def __init__(self, attrib, transform):
-        """
-        Constructor
-        """
-        self._id = int(attrib['id'])
-        self._x = transform.convertLong(float(attrib['lon']))
-        self._y = transform.convertLat(float(attrib['lat']))
-
-    """
-    ###########################################################################
-                                    Properties
-    ###########################################################################
-    """
-    @property
-    def ID(self):
-        return self._id
-
-    @property
-    def x(self):
-        return self._x
-
-    @property
-    def y(self):
-        return self._y
-
-
-class Way:
-    def __init__(self, parent):
-        """
-        Constructor
-        """
-        self._id = int(parent.attrib['id'])
-        self._nids = []
-        self._tags = {}
-
-        for child in parent:
-            if child.tag == 'nd':
-                self._nids.append(int(child.attrib['ref']))
-            elif child.tag == 'tag':
-                key, value = child.attrib['k'], child.attrib['v']
-                self._tags[key] = value
-
-    """
-    ###########################################################################
-                                    Properties
-    ###########################################################################
-    """
-    @property
-    def ID(self):
-        return self._id
-
-    @property
-    def NIDs(self):
-        return self._nids
+# The tag keys drawn for Relations and Ways, in paint order
+_RELATION_ORDER = [c.KEY_NATURAL]
+_WAY_ORDER = [c.KEY_LANDUSE, c.KEY_WATERWAY, c.KEY_NATURAL, c.KEY_HIGHWAY,
+              c.KEY_BUILDING]
 
-    @property
-    def tags(self):
-        return self._tags
+# How many features are drawn between polls of a draw's cancelled function
+_CHECK_EVERY = 256
 
+# Tolerances, in canvas pixels, of the simplified geometry levels; a level's
+# Ways skip every Node that falls in the same tolerance sized grid cell as
+# the Node before it
+_LOD_LEVELS = (0.25, 0.5, 1, 2, 4, 8)
 
-class Relation:
-    def __init__(self, parent):
-        """
-        Constructor
-        """
-        self._id = parent.attrib['id']
-        self._wids = []
-        self._tags = {}
+# Default simplification tolerance and smallest feature drawn, in pixels of
+# the device being drawn on. Both are lossy, so exports, tiles and full
+# quality frames draw every Node and feature unless asked otherwise; drafts
+# pass their own detail
+_DETAIL = 0
+_SMALLEST = 0
 
-        for child in parent:
-            if child.tag == 'member' and child.attrib['type'] == 'way':
-                self._wids.append(int(child.attrib['ref']))
-            elif child.tag == 'tag':
-                key, value = child.attrib['k'], child.attrib['v']
-                self._tags[key] = value
+# Bands per thread of a multi-threaded export; dense and sparse parts of a map
+# take very different times, so extra bands keep every thread busy
+_BANDS_PER_THREAD = 4
 
-    """
-    ###########################################################################
-                                    Properties
-    ###########################################################################
-    """
-    @property
-    def ID(self):
-        return self._id
+# Rows of the strips a streamed export is rendered in
+_STRIP_ROWS = 1024
 
-    @property
-    def WIDs(self):
-        return self._wids
+# Cells of the canvas a band of the coverage grid holds at most
+_COVERAGE_CELLS = 1 << 22
 
-    @property
-    def tags(self):
-        return self._tags
+# Uncompressed XML files at least this large are parsed by several processes
+# when ranges are asked for
+_PARALLEL_SIZE = 32*1024*1024
 
 
 class Map:
-    def __init__(self, width, height, fname, config, scale=1):
+    def __init__(self, width, height, fname, config, scale=1, streaming=True,
+                 cache=True, processes=None, prune=False, scan=False,
+                 ranges=False):
         """
         Constructor
 
@@ -127,37 +90,77 @@ class Map:
         height : int
             The height of the canvas we're displaying to the user; a
         fname : String
-            The OSM file name
+            The OSM file name; .osm.pbf files are read as such, and
+            .osm.gz, .osm.bz2 and .osm.xz files are decompressed as they are
+            parsed
         config : Configuration
             The configuration file we use to get all relevant settings
         scale : float
             This determines how much you scale the pen widths. You want the
             output image to look the same as the GUI, so we scale the pen
             widths accordingly
+        streaming : boolean
+            True to ingest the file element by element, discarding the XML as
+            we go; False to parse the whole document tree up front first
+        cache : boolean
+            True to reuse (or create) the binary snapshot of this file in the
+            geometry cache rather than always parsing the XML
+        processes : int | None
+            The number of processes ingesting .osm.pbf files and, with
+            ranges, large uncompressed XML files; defaults to one per core
+        prune : boolean
+            True to keep only the Ways and Relations that can be drawn and
+            the Nodes they use. .osm.pbf files and uncompressed XML files
+            that are streamed without the scanner are read twice (see
+            _readPruned), so the other Nodes are never held; the rest of the
+            file is dropped once read
+        scan : boolean
+            True to read uncompressed XML files with the memory mapped
+            scanner, which only understands the one element per line layout
+            of OSM exports; other files are parsed as usual
+        ranges : boolean
+            True to parse large uncompressed XML files in byte ranges across
+            processes when streaming, such as from the command line tools;
+            False parses them in this process
         """
         # Initial variables
-        root = ET.parse(fname).getroot()
-        transform = None
-        nodes = {}
-        ways = {}
-        relations = {}
+        data = None
+        if cache:
+            geometry = GeometryCache(pruned=prune)
+            data = geometry.load(fname)
 
-        for child in root:
-            if child.tag == 'node':
-                node = Node(child.attrib, transform)
-                nodes[node.ID] = node
-            elif child.tag == 'way':
-                way = Way(child)
-                ways[way.ID] = way
-            elif child.tag == 'relation':
-                relation = Relation(child)
-                relations[relation.ID] = relation
-            elif child.tag == 'bounds':
-                transform = Transform(float(child.attrib['minlat']),
-                                      float(child.attrib['maxlat']),
-                                      float(child.attrib['minlon']),
-                                      float(child.attrib['maxlon']),
-                                      width, height)
+        if data is None:
+            processes = processes or os.cpu_count() or 1
+
+            # Pool workers are daemons, which can't have processes of their own
+            if mp.current_process().daemon:
+                processes = 1
+
+            pbf = PBFReader.isPBF(fname)
+            twice = pbf or (streaming and not scan and
+                            OSMFile.codec(fname) is None)
+
+            if prune and twice:
+                data = self._freeze(*self._readPruned(fname, processes,
+                                                      ranges))
+            else:
+                if pbf:
+                    data = self._readPBF(fname, processes)
+                elif scan and OSMFile.codec(fname) is None:
+                    data = self._scan(fname)
+
+                if data is None:
+                    data = self._readXML(fname, streaming,
+                                         processes if ranges else 1)
+
+                data = self._freeze(*data, prune=prune)
+
+            if cache:
+                geometry.save(fname, *data)
+
+        bounds, nodes, ways, relations = data
+        transform = Transform(*bounds, width, height)
+        nodes.project(transform)
 
         # Bind class variables
         self._copyright = c.COPYRIGHT
@@ -172,6 +175,32 @@ class Map:
         self._scale = scale
         self._config = config
 
+        # Resolve every feature's style once; painting only has to check
+        # which styles are enabled
+        self._styles = list(dict.fromkeys(
+                  style for group in c.DATA_GROUPS.values()
+                  for style in group.values()))
+        self._relationClasses = self._classify(relations, _RELATION_ORDER)
+        self._wayClasses = self._classify(ways, _WAY_ORDER)
+
+        # The styles used by each draw order group (Relation KEYs, then Way
+        # KEYs); a group's raster only depends on these
+        self._layerStyles = [
+               [self._styles[s] for s in np.unique(col[col >= 0]).tolist()]
+               for classes in (self._relationClasses, self._wayClasses)
+               for col in classes.T]
+
+        # Spatial indexes over the features' bounding boxes in Mercator world
+        # coordinates; they don't depend on the canvas, so copies share them
+        self._relationIndex, self._wayIndex = self._buildIndexes()
+
+        # Paths of the features for the current transform, built on demand
+        self._detail = _DETAIL
+        self._smallest = _SMALLEST
+        self._batching = False
+        self._layered = False
+        self._clearPaths()
+
     """
     ###########################################################################
                                     Properties
@@ -193,6 +222,18 @@ class Map:
     def fname(self):
         return self._fname
 
+    @property
+    def batching(self):
+        return self._batching
+
+    @property
+    def layered(self):
+        return self._layered
+
+    @property
+    def detail(self):
+        return self._detail, self._smallest
+
     """
     ###########################################################################
                                 Public Functions
@@ -200,196 +241,1509 @@ class Map:
     """
     def setTransform(self, transform):
         """
+        Function used to change the transform; every Node is re-projected to
+        the new canvas in one batched call
         """
         self._transform = transform
+        self._nodes.project(transform)
+        self._clearPaths()
 
     def getTransform(self):
         """
         """
         return self._transform
 
-    def draw(self, p):
+    def getConfiguration(self):
+        """
+        """
+        return self._config
+
+    def copy(self, width, height, scale=1, bounds=None):
+        """
+        Function used to create a Map of the same geometry on a canvas of a
+        different size, such as for saving an image. Nothing is re-parsed; the
+        copy shares this Map's stores and only re-projects the Nodes
+
+        Parameters:
+        -----------
+        width : int
+            The width of the new canvas
+        height : int
+            The height of the new canvas
+        scale : float
+            The pen width scale of the new Map (see the constructor)
+        bounds : tuple of floats | None
+            The minimum & maximum latitude and minimum & maximum longitude
+            shown by the new canvas, such as a block of map tiles; defaults
+            to this Map's
+
+        Returns:
+        --------
+        _map : Map
+            The new Map
+        """
+        t = self._transform
+        if bounds is None:
+            bounds = (t.minLat, t.maxLat, t.minLong, t.maxLong)
+        transform = Transform(*bounds, width, height)
+
+        _map = copy.copy(self)
+        _map._transform = transform
+        _map._nodes = self._nodes.projected(transform)
+        _map._scale = scale
+        _map._clearPaths()
+
+        # A copy is typically drawn once, where layers would only cost memory
+        _map._layered = False
+
+        return _map
+
+    def export(self, max_dim, threads=None):
+        """
+        Function used to draw the map as an image whose longest side is
+        max_dim pixels. Pen widths are scaled so the image looks like this
+        Map's canvas
+
+        The image is painted in horizontal bands by a pool of threads (see
+        _paintBands)
+
+        Parameters:
+        -----------
+        max_dim : float
+            The size of the image's longest side in pixels
+        threads : int | None
+            The number of painting threads; defaults to one per core
+
+        Returns:
+        --------
+        image : QImage
+            The drawn image
+        """
+        width, height, scale = self._exportSize(max_dim)
+
+        # The independent image on which we will draw
+        image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+        image.fill(QColor(255, 255, 255))
+
+        # Create a new map object from which we'll draw this image; this only
+        # re-projects the geometry we already have
+        _map = self.copy(width, height, scale=scale)
+
+        # Actually draw the map
+        _map._paintBands(image, 0, threads)
+
+        return image
+
+    def exportStrips(self, max_dim, fname, rows=_STRIP_ROWS, threads=None):
+        """
+        Function used to save the map as a PNG or TIFF image too large to be
+        held in memory. The image is rendered a strip of rows at a time and
+        each strip is written to the file before the next one is drawn, so
+        memory is bounded by a strip no matter how large the image is
+
+        Parameters:
+        -----------
+        max_dim : float
+            The size of the image's longest side in pixels
+        fname : String
+            The image file name; .png, .tif or .tiff
+        rows : int
+            The number of rows per strip
+        threads : int | None
+            The number of threads painting each strip (see export)
+
+        Returns:
+        --------
+        """
+        width, height, scale = self._exportSize(max_dim)
+        _map = self.copy(width, height, scale=scale)
+        writer = ImageWriter.create(fname, width, height)
+
+        # A failed export leaves no truncated image behind
+        try:
+            for top in range(0, height, rows):
+                strip = QImage(width, min(rows, height - top),
+                               QImage.Format_ARGB32_Premultiplied)
+                strip.fill(QColor(255, 255, 255))
+                _map._paintBands(strip, top, threads)
+
+                writer.write(_rgb(strip))
+
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def coverage(self, cell):
+        """
+        Function used to find the parts of the canvas that something is drawn
+        on with the current settings, judged from the bounding boxes of the
+        enabled features rather than by drawing them. The grid of cells is
+        built a band of rows at a time, so a deep zoom level's grid is never
+        held whole
+
+        Parameters:
+        -----------
+        cell : int
+            The size of the square cells the canvas is divided into, such as
+            a map tile
+
+        Returns:
+        --------
+        <value> : generator of tuples
+            The first row of each band of cells and a boolean array with a
+            row per row of cells in the band and a column per column of
+            cells; True where a feature may be drawn
+        """
+        t = self._transform
+        nx, ny = -(-int(t.width)//cell), -(-int(t.height)//cell)
+        margin = self._margin()
+
+        relations, ways = self._featureExtents()
+        rel, way = self._drawn()
+        boxes = np.vstack((relations[rel], ways[way]))
+        boxes[:, :2] -= margin
+        boxes[:, 2:] += margin
+
+        # Only boxes on the canvas; NaN boxes of empty features fail too
+        boxes = boxes[(boxes[:, 0] < nx*cell) & (boxes[:, 2] >= 0) &
+                      (boxes[:, 1] < ny*cell) & (boxes[:, 3] >= 0)]
+
+        x0, y0, x1, y1 = (boxes // cell).astype(np.int64).T
+        x0, x1 = np.clip(x0, 0, nx - 1), np.clip(x1, 0, nx - 1)
+        y0, y1 = np.clip(y0, 0, ny - 1), np.clip(y1, 0, ny - 1)
+
+        rows = max(_COVERAGE_CELLS//(nx + 1), 1)
+        for top in range(0, ny, rows):
+            bottom = min(top + rows, ny)
+            inBand = (y0 < bottom) & (y1 >= top)
+            bx0, bx1 = x0[inBand], x1[inBand]
+            by0 = np.maximum(y0[inBand], top) - top
+            by1 = np.minimum(y1[inBand], bottom - 1) - top
+
+            # Mark each box's range of cells in a difference array, which the
+            # cumulative sums turn into the number of boxes covering each cell
+            grid = np.zeros((bottom - top + 1, nx + 1), dtype=np.int32)
+            np.add.at(grid, (by0, bx0), 1)
+            np.add.at(grid, (by0, bx1 + 1), -1)
+            np.add.at(grid, (by1 + 1, bx0), -1)
+            np.add.at(grid, (by1 + 1, bx1 + 1), 1)
+            grid.cumsum(axis=0, out=grid)
+            grid.cumsum(axis=1, out=grid)
+
+            yield top, grid[:-1, :nx] > 0
+
+    def setDetail(self, tolerance, smallest):
+        """
+        Function used to set how much detail is drawn. Ways are drawn from
+        simplified copies whose Nodes stray at most about the tolerance from
+        the original line, and features whose bounding box is smaller than
+        the smallest size are left out. Both are in pixels of the device
+        being drawn on, so zooming in brings the detail back; the simplified
+        levels are built the first time they are needed and kept until the
+        transform changes
+
+        Parameters:
+        -----------
+        tolerance : float
+            The simplification tolerance in pixels; 0 draws every Node
+        smallest : float
+            The size in pixels below which features are skipped; 0 draws every
+            feature
+
+        Returns:
+        --------
+        """
+        self._detail = tolerance
+        self._smallest = smallest
+
+    def setBatching(self, state):
+        """
+        Function used to select the batched rendering mode. When batching,
+        the Ways sharing a style within a KEY are drawn together: the QPen or
+        QColor is built and the painter's state set once per style rather than
+        once per Way. Ways within a KEY are then painted style by style, in
+        the order their styles first appear, instead of in file order
+
+        Merging a style's Ways into a single QPainterPath was measured and
+        rejected: Qt's raster engine strokes and fills one large path far
+        slower than the same geometry as many small ones
+
+        Parameters:
+        -----------
+        state : boolean
+            True to batch Ways by style; False to draw them one by one
+
+        Returns:
+        --------
+        """
+        self._batching = state
+
+    def setLayered(self, state):
+        """
+        Function used to select the layered rendering mode. When layered, each
+        draw order group (natural Relations, then the landuse, waterway,
+        natural, highway and building Ways) is rasterized into its own
+        transparent image, and drawing composites the images in order. A
+        group's image is kept until the transform or the settings of one of
+        the styles it uses change, so editing a highway only re-renders the
+        highway layer. A group with every style disabled is skipped but its
+        image is kept, so switching it back on is just a recomposite
+
+        Each layer costs 4 bytes per canvas pixel
+
+        Parameters:
+        -----------
+        state : boolean
+            True to composite cached layers; False to paint directly
+
+        Returns:
+        --------
+        """
+        self._layered = state
+        self._layers = {}
+
+    def draw(self, p, cancelled=None, rect=None, draft=None):
         """
+        Function used to draw the map
+
+        A painter that scales, such as the zoomed view of the map widget,
+        draws from the same canvas geometry; pen widths scale with it, like
+        they do in an export. Only the features the painter's device shows
+        are drawn, and the layers are bypassed as they would be blurry when
+        scaled up
+
+        Parameters:
+        -----------
         p : QPainter
+            The object with which we're drawing
+        cancelled : function | None
+            Polled between features while drawing, such as from a render
+            thread; drawing stops as soon as it returns True
+        rect : QRectF | None
+            The part of the canvas being drawn, such as a band of an export;
+            features entirely outside of it are skipped. Layers always cover
+            the whole canvas, so this is ignored in the layered mode
+        draft : tuple | None
+            The simplification tolerance and smallest feature drawn (see
+            setDetail) of a quick draft, such as while the settings are being
+            edited. A draft is drawn without antialiasing and bypasses the
+            layers; None draws the map at full quality
+
+        The level of detail follows the painter's scale (see setDetail)
+
+        Returns:
+        --------
+        <value> : boolean
+            True if the whole map was drawn; False if it was cancelled
         """
-        p.setRenderHint(p.Antialiasing)
+        if cancelled is None:
+            cancelled = _never
 
         # Simplification variables
         w, h = self._transform.width, self._transform.height
         xo, yo = self._transform.xOffset, self._transform.yOffset
 
-        # Color the background according to the settings file
-        p.fillRect(0, 0, w, h, self._config.getValue(c.CONFIG_BG_COLOR))
+        # Color the background according to the settings file. It is filled
+        # without antialiasing, which can leave pixels of a band or tile at
+        # a large offset a fraction short of opaque. Drafts are drawn without
+        # it altogether
+        p.setRenderHint(p.Antialiasing, False)
+        p.fillRect(QRectF(0, 0, w, h),
+                   self._config.getValue(c.CONFIG_BG_COLOR))
+        p.setRenderHint(p.Antialiasing, draft is None)
 
-        # Fill all natural relations
-        order = [c.KEY_NATURAL]
-        for ID in self._relations.keys():
-            rel = self._relations[ID]
-            for i, tag in enumerate(order):
-                try:
-                    if(tag in rel.tags.keys() and self._config.getItemState(
-                                      c.DATA_GROUPS[tag][rel.tags[tag]])):
-                        self._renderRelation(p, rel, tag)
-                except KeyError:
-                    # See note in _buildQueue for details
-                    s = '* WARNING: tag="%s"; key="%s"' % (tag, rel.tags[tag])
-                    s += ' will not render unless manually added!'
-                    print(s)
+        # build the drawing queue so we don't have multiple for loops; all
+        # natural relations are filled first, then the ways are drawn
+        zoomed = p.transform().isScaling()
+        if zoomed and rect is None:
+            rect = p.transform().inverted()[0].mapRect(QRectF(p.viewport()))
+        layered = self._layered and not zoomed and draft is None
 
-        # build the drawing queue so we don't have multiple for loops
-        order = [c.KEY_LANDUSE, c.KEY_WATERWAY, c.KEY_NATURAL, c.KEY_HIGHWAY,
-                 c.KEY_BUILDING]
-        queue = self._buildQueue(order)
+        relations, ways = None, None
+        if rect is not None and not layered:
+            relations, ways = self._visible(rect)
 
-        # Draw the ways from the queue
-        for i, tag in enumerate(order):
-            for way in queue[i]:
-                self._render(p, way, tag)
+        # The detail in canvas pixels for the painter's scale
+        tolerance, smallest = draft or (self._detail, self._smallest)
+        zoom = math.sqrt(abs(p.transform().determinant()))
+        level = _level(tolerance/zoom)
+        smallest = smallest/zoom
+        if smallest > 0:
+            relations, ways = self._large(relations, ways, smallest)
+
+        queue = (self._buildQueue(self._relationClasses, relations) +
+                 self._buildQueue(self._wayClasses, ways))
+
+        for layer, items in enumerate(queue):
+            if not layered:
+                if not self._paintLayer(p, layer, items, cancelled, level):
+                    return False
+                continue
+
+            done, image = self._layerImage(layer, items, cancelled, level,
+                                           smallest)
+            if not done:
+                return False
+            if image is not None:
+                p.drawImage(0, 0, image)
 
         # Lastly, color the out of bounds regions white: T, B, L, R
-        p.fillRect(0, 0, w, yo, QColor(255, 255, 255))
-        p.fillRect(0, h-yo, w, yo, QColor(255, 255, 255))
-        p.fillRect(0, 0, xo, h, QColor(255, 255, 255))
-        p.fillRect(w-xo, 0, xo, h, QColor(255, 255, 255))
+        p.fillRect(QRectF(0, 0, w, yo), QColor(255, 255, 255))
+        p.fillRect(QRectF(0, h-yo, w, yo), QColor(255, 255, 255))
+        p.fillRect(QRectF(0, 0, xo, h), QColor(255, 255, 255))
+        p.fillRect(QRectF(w-xo, 0, xo, h), QColor(255, 255, 255))
+
+        return True
 
     """
     ###########################################################################
                                 Private Functions
     ###########################################################################
     """
-    def _buildQueue(self, order):
+    def _readXML(self, fname, streaming, processes, stores=None):
         """
-        Private function used to construct the paint order for elements. This
-        will do very basic ordering, and it's recommended to implement a tool
-        in the GUI to perform ordering in the future.
+        Private function used to ingest an OSM XML file with the XML parser,
+        in parallel ranges when that is worth it. Files whose ranges don't
+        parse on their own are parsed whole
 
         Parameters:
         -----------
-        order : String
-            The KEY strings that determine in which order painting will be
-            completed, with first indices being rendered first
+        fname : String
+            The OSM file name
+        streaming : boolean
+            See __init__
+        processes : int
+            The number of processes parsing ranges of large files; 1 never
+            cuts the file into ranges
+        stores : tuple | None
+            See XMLReader.read; only when streaming
 
         Returns:
         --------
-        queue : List of Way lists
-            This will be a 2d array of Ways for each KEY
+        See _parse
         """
-        queue = [[] for i in range(len(order))]
+        if (streaming and processes > 1 and OSMFile.codec(fname) is None and
+                os.path.getsize(fname) >= _PARALLEL_SIZE):
+            data = self._parseRanges(fname, processes, stores)
+            if data is not None:
+                return data
 
-        for ID in self._ways.keys():
-            way = self._ways[ID]
+            print('* WARNING: "%s" has comments or CDATA between elements; '
+                  'parsing it whole instead' % fname)
+        if streaming:
+            return self._iterparse(fname, stores)
 
-            for i, tag in enumerate(order):
-                try:
-                    if(tag in way.tags.keys() and self._config.getItemState(
-                                           c.DATA_GROUPS[tag][way.tags[tag]])):
-                        queue[i].append(way)
-                except KeyError:
-                    # User will need to add by the following
-                    # 1) Create a unique VAL in constants.py
-                    # 2) Create a unique CONFIG_STYLE in constants.py
-                    # 3) Connect VAL and CONFIG_STYLE in the DATA_GROUPS data
-                    #    (constants.py file)
-                    # 4) Connect the CONFIG_STYLE to a QPen or QColor in
-                    #    configuration.py
-                    s = '* WARNING: tag="%s"; key="%s"' % (tag, way.tags[tag])
-                    s += ' will not render unless manually added!'
-                    print(s)
+        return self._parse(fname)
 
-        return queue
+    def _parse(self, fname):
+        """
+        Private function used to ingest the OSM file by first building the
+        entire XML document tree. Peak memory is the tree plus our own objects
+
+        Parameters:
+        -----------
+        fname : String
+            The OSM file name
 
-    def _render(self, p, way, tag):
+        Returns:
+        --------
+        bounds : tuple of floats | None
+            The minimum & maximum latitude and minimum & maximum longitude, if
+            the file has a bounds element
+        nodes : NodeStore
+            The Node IDs and coordinates
+        ways : FeatureStore
+            The Ways
+        relations : FeatureStore
+            The Relations; the stores are frozen by _freeze
         """
-        Private function used to render the Way object passed in. Ways may be
-        filled or simply drawn, so the below code checks for a QPen (draw) vs.
-        a QColor (fill)
+        with OSMFile.open(fname) as f:
+            root = ET.parse(f).getroot()
+        bounds = None
+        nodes = NodeStore()
+        ways = FeatureStore(Way)
+        relations = FeatureStore(Relation)
+
+        for child in root:
+            bounds = XMLReader.ingest(child, bounds, nodes, ways, relations)
+
+        return bounds, nodes, ways, relations
+
+    def _iterparse(self, fname, stores=None):
+        """
+        Private function used to ingest the OSM file one top level element at
+        a time. Each element is discarded as soon as it has been converted, so
+        memory is bounded by our own objects rather than the XML tree
 
         Parameters:
         -----------
-        p : QPainter
-            The object with which we're drawing
-        way : Way
-            The meta object containing drawing information
-        tag : String
-            The tag string corresponding to 'natural', 'highway', 'waterway',
-            etc.
+        fname : String
+            The OSM file name
+        stores : tuple | None
+            See XMLReader.read
 
         Returns:
         --------
+        See _parse
         """
-        # Select the style
-        styleKey = c.DATA_GROUPS[tag][way.tags[tag]]
-        value = self._config.getValue(styleKey)
+        if stores is None:
+            stores = (NodeStore(), FeatureStore(Way), FeatureStore(Relation))
+        nodes, ways, relations = stores
 
-        points = []
-        for nid in way.NIDs:
-            points.append([self._nodes[nid].x,
-                           self._nodes[nid].y])
+        with OSMFile.open(fname) as f:
+            bounds = XMLReader.stream(f, nodes, ways, relations)
 
-        if type(value) == QPen:
-            value.setWidthF(self._scale*value.widthF())
-            p.setPen(value)
-            path = QPainterPath(QPointF(*points[0]))
-            for x, y in points[1:]:
-                path.lineTo(QPointF(x, y))
-            p.drawPath(path)
-        elif type(value) == QColor:
-            path = QPainterPath(QPointF(*points[0]))
-            for x, y in points[1:-1]:
-                path.lineTo(QPointF(x, y))
-            path.closeSubpath()
-            p.fillPath(path, value)
+        return bounds, nodes, ways, relations
 
-    def _renderRelation(self, p, relation, tag):
+    def _parseRanges(self, fname, processes, stores=None):
         """
-        Private function to render relations. Relations are just different from
-        ways that I constructed a separate function for them. Little bit of
-        code copy-paste, but not much
+        Private function used to ingest a large OSM file in byte ranges parsed
+        by several processes at once
 
         Parameters:
         -----------
-        p : QPainter
-            The object with which we're drawing
-        relation : Relation
-            The meta object containing OSM Relation information
-        tag : String
-            The tag string corresponding to 'natural', 'highway', 'waterway',
-            etc.
+        fname : String
+            The (uncompressed) OSM file name
+        processes : int
+            The number of processes
+        stores : tuple | None
+            See XMLReader.read
 
         Returns:
         --------
+        See _parse, or None if a range doesn't parse on its own
         """
-        ways = []
-        for wid in relation.WIDs:
-            # return if we don't have the data for this relation
-            # Note, some OSM files don't include all of the ways that are in
-            # relations... kinda annoying actually
-            if wid in self._ways.keys():
-                ways.append(self._ways[wid])
-            else:
-                return
+        return XMLReader.read(fname, processes, stores)
 
-        # Select the style
-        styleKey = c.DATA_GROUPS[tag][relation.tags[tag]]
-        value = self._config.getValue(styleKey)
-        path = QPainterPath()
+    def _readPBF(self, fname, processes, stores=None):
+        """
+        Private function used to ingest a .osm.pbf file, whose blocks are
+        decoded in parallel
+
+        Parameters:
+        -----------
+        fname : String
+            The .osm.pbf file name
+        processes : int
+            The number of processes decoding blocks
+        stores : tuple | None
+            See PBFReader.read
 
-        # Trace out the ways using a QPainterPath
-        for way in ways:
-            points = []
-            for nid in way.NIDs:
-                points.append([self._nodes[nid].x,
-                               self._nodes[nid].y])
+        Returns:
+        --------
+        See _parse
+        """
+        return PBFReader.read(fname, processes, stores)
 
-            path.moveTo(*points[0])
-            for x, y in points[1:]:
-                path.lineTo(x, y)
-            path.closeSubpath()
+    def _readPruned(self, fname, processes, ranges):
+        """
+        Private function used to ingest a pruned .osm.pbf or uncompressed XML
+        file in two passes. The first reads only the Ways and Relations and
+        prunes them; the second reads only the Nodes the kept Ways use, the
+        others being dropped in batches as they are read, so the dropped
+        Nodes are never all held at once
+
+        Parameters:
+        -----------
+        fname : String
+            The OSM file name
+        processes : int
+            The number of processes decoding .osm.pbf blocks and, with
+            ranges, parsing XML ranges
+        ranges : boolean
+            See __init__
+
+        Returns:
+        --------
+        See _parse; the stores are not frozen, and the bounds are None if
+        the file has no bounds element, the Node store's extent then
+        covering every Node of the file
+        """
+        def read(stores):
+            if PBFReader.isPBF(fname):
+                return self._readPBF(fname, processes, stores)
+            return self._readXML(fname, True, processes if ranges else 1,
+                                 stores)
+
+        ways, relations = FeatureStore(Way), FeatureStore(Relation)
+        bounds = read((None, ways, relations))[0]
+
+        nodes = NodeStore(self._pruneFeatures(ways, relations))
+        read((nodes, None, None))
+
+        return bounds, nodes, ways, relations
+
+    def _scan(self, fname):
+        """
+        Private function used to ingest an OSM XML file with the memory mapped
+        scanner
+
+        Parameters:
+        -----------
+        fname : String
+            The (uncompressed) OSM file name
+
+        Returns:
+        --------
+        <value> : tuple | None
+            See _parse, or None if the scanner can't read the file
+        """
+        data = XMLScanner.read(fname)
+        if data is None:
+            print('* WARNING: "%s" is not laid out for the scanner; parsing '
+                  'it instead' % fname)
+
+        return data
+
+    def _freeze(self, bounds, nodes, ways, relations, prune=False):
+        """
+        Private function used to finish ingestion: the stores are converted to
+        arrays and their members resolved. Files without a bounds element are
+        bounded by all of their Nodes, pruned or not
+
+        Parameters:
+        -----------
+        See _parse's return values; the stores are not frozen yet
+        prune : boolean
+            True to drop what can't be drawn first (see _prune)
+
+        Returns:
+        --------
+        See _parse
+        """
+        if bounds is None:
+            bounds = nodes.extent()
+
+        if prune:
+            self._prune(nodes, ways, relations)
+
+        nodes.freeze()
+        ways.freeze(nodes)
+        relations.freeze(ways)
+
+        return bounds, nodes, ways, relations
+
+    def _prune(self, nodes, ways, relations):
+        """
+        Private function used to drop what can never be drawn from the stores
+        before they are frozen: the Relations and Ways without a tag of the
+        paint order that DATA_GROUPS has a style for, except for the Ways of
+        kept Relations, and then the Nodes no kept Way uses. Tag values
+        without a style are dropped silently rather than reported
+
+        This is for files read once, such as compressed ones: they list
+        their Nodes first and a Way may only turn out to be needed once the
+        Relations are read, so the file is ingested as a whole first.
+        Pruning before freezing means what is dropped is never sorted, copied
+        or resolved, which is where loading peaks otherwise
+
+        Parameters:
+        -----------
+        nodes : NodeStore
+            The Nodes being ingested
+        ways, relations : FeatureStore
+            The Ways and Relations being ingested
+
+        Returns:
+        --------
+        """
+        nodes.select(self._pruneFeatures(ways, relations))
+
+    def _pruneFeatures(self, ways, relations):
+        """
+        Private function used to drop the Relations and Ways that can never be
+        drawn from the stores being ingested (see _prune)
+
+        Parameters:
+        -----------
+        ways, relations : FeatureStore
+            The Ways and Relations being ingested
+
+        Returns:
+        --------
+        nids : ndarray
+            The IDs of the Nodes the kept Ways use, possibly repeated
+        """
+        members = relations.select(relations.tagged(
+                     {tag: c.DATA_GROUPS[tag] for tag in _RELATION_ORDER}))
+
+        keep = ways.tagged({tag: c.DATA_GROUPS[tag] for tag in _WAY_ORDER})
+        keep |= ways.isin(members)
+
+        return ways.select(keep)
+
+    def _classify(self, store, order):
+        """
+        Private function used to resolve the style of every feature of a
+        store, once, when the map is loaded. Tag values we have no style for
+        are reported here rather than on every paint
+
+        Parameters:
+        -----------
+        store : FeatureStore
+            The Ways or Relations being classified
+        order : list of Strings
+            The KEY strings classified, in paint order
+
+        Returns:
+        --------
+        classes : ndarray
+            An int32 array with a row per feature and a column per KEY holding
+            the index of the feature's style in self._styles, or -1 if the
+            feature isn't drawn for that KEY
+        """
+        styleIDs = {style: i for i, style in enumerate(self._styles)}
+        classes = np.full((len(store), len(order)), -1, dtype=np.int32)
+
+        for i, tag in enumerate(order):
+            codes = store.codes[:, store.keys.index(tag)]
+
+            # Lookup table from value code to style; the extra trailing entry
+            # is hit by the -1 code of features without the tag
+            lut = np.full(len(store.values) + 1, -1, dtype=np.int32)
+            for code in np.unique(codes[codes >= 0]).tolist():
+                value = store.values[code]
+                try:
+                    lut[code] = styleIDs[c.DATA_GROUPS[tag][value]]
+                except KeyError:
+                    # User will need to add by the following
+                    # 1) Create a unique VAL in constants.py
+                    # 2) Create a unique CONFIG_STYLE in constants.py
+                    # 3) Connect VAL and CONFIG_STYLE in the DATA_GROUPS data
+                    #    (constants.py file)
+                    # 4) Connect the CONFIG_STYLE to a QPen or QColor in
+                    #    configuration.py
+                    s = '* WARNING: tag="%s"; key="%s"' % (tag, value)
+                    s += ' will not render unless manually added!'
+                    print(s)
+
+            classes[:, i] = lut[codes]
+
+        return classes
+
+    def _buildQueue(self, classes, visible=None):
+        """
+        Private function used to construct the paint order for elements. This
+        will do very basic ordering, and it's recommended to implement a tool
+        in the GUI to perform ordering in the future. No tags are inspected;
+        the precomputed classes are masked by the currently enabled styles
+
+        Parameters:
+        -----------
+        classes : ndarray
+            The style classes of the features (see _classify), with a column
+            per KEY in paint order
+        visible : ndarray | None
+            The sorted indices of the features to consider; None for all of
+            them
+
+        Returns:
+        --------
+        queue : List of lists
+            For each KEY, the (feature index, CONFIG_STYLE) pairs to draw
+        """
+        enabled = self._enabled()
+
+        queue = []
+        for i in range(classes.shape[1]):
+            if visible is None:
+                idx = np.flatnonzero(enabled[classes[:, i]])
+            else:
+                idx = visible[enabled[classes[visible, i]]]
+            styles = [self._styles[s] for s in classes[idx, i].tolist()]
+            queue.append(list(zip(idx.tolist(), styles)))
+
+        return queue
+
+    def _paintLayer(self, p, layer, items, cancelled, level=None):
+        """
+        Private function used to paint a single draw order group
+
+        Parameters:
+        -----------
+        p : QPainter
+            The object with which we're drawing
+        layer : int
+            The group; Relation KEYs come first, then Way KEYs
+        items : list of tuples
+            The group's (feature index, CONFIG_STYLE) pairs (see _buildQueue)
+        cancelled : function
+            See draw
+        level : float | None
+            The tolerance of the simplified geometry drawn (see _LOD_LEVELS);
+            None for the full geometry
+
+        Returns:
+        --------
+        <value> : boolean
+            True if the whole group was painted; False if it was cancelled
+        """
+        if layer < len(_RELATION_ORDER):
+            for n, (j, styleKey) in enumerate(items):
+                if n % _CHECK_EVERY == 0 and cancelled():
+                    return False
+                self._renderRelation(p, j, styleKey, level)
+            return True
+
+        if self._batching:
+            batches = {}
+            for j, styleKey in items:
+                batches.setdefault(styleKey, []).append(j)
+
+            # The styles are drawn in a fixed order rather than in the order
+            # they are first met, which depends on the part being drawn
+            for styleKey in self._layerStyles[layer]:
+                indices = batches.get(styleKey, [])
+                for n in range(0, len(indices), _CHECK_EVERY):
+                    if cancelled():
+                        return False
+                    self._renderBatch(p, indices[n:n+_CHECK_EVERY], styleKey,
+                                      level)
+            return True
+
+        for n, (j, styleKey) in enumerate(items):
+            if n % _CHECK_EVERY == 0 and cancelled():
+                return False
+            self._render(p, j, styleKey, level)
+
+        return True
+
+    def _layerImage(self, layer, items, cancelled, level=None, smallest=0):
+        """
+        Private function used to get the raster of a draw order group for the
+        layered rendering mode. The raster is re-rendered only if the settings
+        of the group's enabled styles or the detail changed since it was last
+        rendered
+
+        Parameters:
+        -----------
+        See _paintLayer
+        smallest : float
+            The size in canvas pixels below which features were left out
+
+        Returns:
+        --------
+        done : boolean
+            False if rendering was cancelled
+        image : QImage | None
+            The group's premultiplied ARGB raster; None if nothing is enabled
+        """
+        if not items:
+            return True, None
+
+        # Everything the group's pixels depend on besides the transform and
+        # pen scale, which clear the layers when they change
+        config = self._config.getConfig()
+        signature = (self._batching, level, smallest) + tuple(
+                          (style, tuple(config[style][2:]))
+                          for style in self._layerStyles[layer]
+                          if self._config.getItemState(style))
+
+        cached = self._layers.get(layer)
+        if cached is not None and cached[0] == signature:
+            return True, cached[1]
+
+        t = self._transform
+        image = QImage(int(t.width), int(t.height),
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+
+        p = QPainter(image)
+        p.setRenderHint(p.Antialiasing)
+        done = self._paintLayer(p, layer, items, cancelled, level)
+        p.end()
+
+        if not done:
+            return False, None
+
+        self._layers[layer] = (signature, image)
+
+        return True, image
+
+    def _exportSize(self, max_dim):
+        """
+        Private function used to size an export
+
+        Parameters:
+        -----------
+        max_dim : float
+            The size of the image's longest side in pixels
+
+        Returns:
+        --------
+        width, height : int
+            The image size
+        scale : float
+            The pen width scale making the image look like this Map's canvas
+        """
+        # Compute the scale parameter
+        t = self._transform
+        w, h = t.width - 2*t.xOffset, t.height - 2*t.yOffset
+        # Clamp height
+        if w >= h:
+            scale = max_dim/h
+            width = max_dim
+            height = max_dim*h/w
+        # Clamp width
+        else:
+            scale = max_dim/w
+            height = max_dim
+            width = max_dim*w/h
+
+        return int(round(width)), int(round(height)), scale
+
+    def _paintBands(self, image, top, threads=None):
+        """
+        Private function used to draw the rows of the canvas starting at top
+        into an image. The image is split into horizontal bands painted by a
+        pool of threads; each band is a view of the image's own memory, so
+        nothing is stitched afterwards, and only the features crossing a band
+        are drawn into it
+
+        Parameters:
+        -----------
+        image : QImage
+            A Format_ARGB32_Premultiplied image as wide as the canvas
+        top : int
+            The canvas row of the image's first row
+        threads : int | None
+            The number of painting threads; defaults to one per core
+
+        Returns:
+        --------
+        """
+        width, height = image.width(), image.height()
+        fmt = image.format()
+
+        threads = threads or os.cpu_count() or 1
+        bands = 1 if threads == 1 else threads*_BANDS_PER_THREAD
+        step = -(-height//bands)
+        bits, bpl = int(image.bits()), image.bytesPerLine()
+
+        # Computed up front rather than by every thread at once; the bands
+        # are drawn unscaled, so at the Map's own level of detail
+        self._featureSizes()
+        level = _level(self._detail)
+        if level is not None:
+            self._simplify(level)
+
+        def paint(y):
+            rows = min(step, height - y)
+            band = QImage(sip.voidptr(bits + y*bpl), width, rows, bpl, fmt)
+
+            p = QPainter(band)
+            p.translate(0, -(top + y))
+            self.draw(p, rect=QRectF(0, top + y, width, rows))
+            p.end()
+
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(paint, range(0, height, step)))
+
+    def _enabled(self):
+        """
+        Private function used to look up which styles are enabled
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        enabled : ndarray
+            Boolean array indexed by a style's index in self._styles; the
+            extra trailing False is hit by the -1 class
+        """
+        enabled = np.zeros(len(self._styles) + 1, dtype=bool)
+        for i, style in enumerate(self._styles):
+            enabled[i] = self._config.getItemState(style)
+
+        return enabled
+
+    def _drawn(self):
+        """
+        Private function used to find the features drawn for at least one KEY
+        with the current settings
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        relations, ways : ndarray
+            Boolean masks of the drawn features
+        """
+        enabled = self._enabled()
+
+        return (enabled[self._relationClasses].any(axis=1),
+                enabled[self._wayClasses].any(axis=1))
+
+    def _margin(self):
+        """
+        Private function used to get how far the drawing of a feature may
+        reach beyond its bounding box. A stroke reaches half of its pen's
+        width; the full width of the widest pen in use plus a pixel of
+        antialiasing leaves room for miter joins
+        """
+        pens = [self._config.getValue(style) for style in self._styles]
+
+        return 1 + self._scale*max([pen.widthF() for pen in pens
+                                    if type(pen) == QPen], default=0)
+
+    def _featureExtents(self):
+        """
+        Private function used to get the bounding boxes of the features for
+        the current transform; computed on first use
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        relations, ways : ndarray
+            An Nx4 array of min x, min y, max x, max y per feature in canvas
+            coordinates; NaN for features without any Node in the file
+        """
+        if self._extents is None:
+            xy = np.column_stack((self._nodes.x, self._nodes.y))
+            ways = _extents(self._ways.offsets, self._ways.refs, xy, xy)
+            relations = _extents(self._relations.offsets,
+                                 self._relations.refs, ways[:, :2],
+                                 ways[:, 2:])
+            self._extents = (relations, ways)
+
+        return self._extents
+
+    def _visible(self, rect):
+        """
+        Private function used to find the features whose drawing may touch a
+        part of the canvas. The part is grown by the widest pen in use so
+        strokes of features just outside of it aren't cut off, and looked up
+        in the spatial indexes, so the cost follows the number of features
+        found rather than the size of the file
+
+        Parameters:
+        -----------
+        rect : QRectF
+            The part of the canvas
+
+        Returns:
+        --------
+        relations, ways : ndarray
+            The sorted indices of the visible features
+        """
+        margin = self._margin()
+
+        # Canvas y runs south, Mercator y north
+        x0, y1 = self._transform.canvasToMercator(rect.left() - margin,
+                                                  rect.top() - margin)
+        x1, y0 = self._transform.canvasToMercator(rect.right() + margin,
+                                                  rect.bottom() + margin)
+
+        return (self._relationIndex.query(x0, y0, x1, y1),
+                self._wayIndex.query(x0, y0, x1, y1))
+
+    def _large(self, relations, ways, smallest):
+        """
+        Private function used to leave out the features too small to be seen
+
+        Parameters:
+        -----------
+        relations, ways : ndarray | None
+            The sorted indices of the features considered; None for all of
+            them
+        smallest : float
+            The size in canvas pixels a feature's bounding box must reach in
+            either direction
+
+        Returns:
+        --------
+        relations, ways : ndarray
+            The sorted indices of the features large enough to be drawn
+        """
+        result = []
+        for sizes, idx in zip(self._featureSizes(), (relations, ways)):
+            if idx is None:
+                result.append(np.flatnonzero(sizes >= smallest))
+            else:
+                result.append(idx[sizes[idx] >= smallest])
+
+        return result
+
+    def _featureSizes(self):
+        """
+        Private function used to get the larger of the width and height of
+        the features' bounding boxes for the current transform; computed on
+        first use. Features without any Node in the file have a size of 0
+        """
+        if self._sizes is None:
+            sizes = []
+            for box in self._featureExtents():
+                size = np.fmax(box[:, 2] - box[:, 0], box[:, 3] - box[:, 1])
+                sizes.append(np.nan_to_num(size))
+            self._sizes = tuple(sizes)
+
+        return self._sizes
+
+    def _buildIndexes(self):
+        """
+        Private function used to build the spatial indexes of the Relations
+        and Ways from their bounding boxes in Mercator world coordinates
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        relations, ways : SpatialIndex
+            The indexes
+        """
+        t = self._transform
+        xy = np.column_stack((self._nodes.lon,
+                              t.mercatorLats(self._nodes.lat)))
+        ways = _extents(self._ways.offsets, self._ways.refs, xy, xy)
+        relations = _extents(self._relations.offsets, self._relations.refs,
+                             ways[:, :2], ways[:, 2:])
+
+        return SpatialIndex(relations), SpatialIndex(ways)
+
+    def _render(self, p, i, styleKey, level=None):
+        """
+        Private function used to render the Way passed in. Ways may be
+        filled or simply drawn, so the below code checks for a QPen (draw) vs.
+        a QColor (fill)
+
+        Parameters:
+        -----------
+        p : QPainter
+            The object with which we're drawing
+        i : int
+            The index of the Way in the Way store
+        styleKey : String
+            The CONFIG_STYLE the Way is drawn with
+        level : float | None
+            The simplified geometry drawn (see _paintLayer)
+
+        Returns:
+        --------
+        """
+        # Select the style
+        value = self._config.getValue(styleKey)
+
+        if type(value) == QPen:
+            value.setWidthF(self._scale*value.widthF())
+            polygon = self._wayPolygon(i, level=level)
+            if _dashed(value):
+                p.fillPath(self._outline(('way', i, level), polygon, value),
+                           value.brush())
+            else:
+                p.setPen(value)
+                p.drawPolyline(polygon)
+        elif type(value) == QColor:
+            p.setPen(Qt.NoPen)
+            p.setBrush(value)
+            p.drawPolygon(self._wayPolygon(i, True, level))
+
+    def _renderBatch(self, p, indices, styleKey, level=None):
+        """
+        Private function used to render every Way of a style in one go. The
+        style is looked up and the painter's state set once, then the cached
+        polygons are drawn back to back
+
+        Parameters:
+        -----------
+        p : QPainter
+            The object with which we're drawing
+        indices : list of ints
+            The indices of the Ways in the Way store
+        styleKey : String
+            The CONFIG_STYLE the Ways are drawn with
+        level : float | None
+            The simplified geometry drawn (see _paintLayer)
+
+        Returns:
+        --------
+        """
+        value = self._config.getValue(styleKey)
+
+        if type(value) == QPen and _dashed(value):
+            value.setWidthF(self._scale*value.widthF())
+            brush = value.brush()
+            for i in indices:
+                p.fillPath(self._outline(('way', i, level),
+                                         self._wayPolygon(i, level=level),
+                                         value), brush)
+        elif type(value) == QPen:
+            value.setWidthF(self._scale*value.widthF())
+            p.setPen(value)
+            p.setBrush(Qt.NoBrush)
+            for i in indices:
+                p.drawPolyline(self._wayPolygon(i, level=level))
+        elif type(value) == QColor:
+            p.setPen(Qt.NoPen)
+            p.setBrush(value)
+            for i in indices:
+                p.drawPolygon(self._wayPolygon(i, True, level))
+
+    def _renderRelation(self, p, i, styleKey, level=None):
+        """
+        Private function to render relations. Relations are just different from
+        ways that I constructed a separate function for them. Little bit of
+        code copy-paste, but not much
+
+        Parameters:
+        -----------
+        p : QPainter
+            The object with which we're drawing
+        i : int
+            The index of the Relation in the Relation store
+        styleKey : String
+            The CONFIG_STYLE the Relation is drawn with
+        level : float | None
+            The simplified geometry drawn (see _paintLayer)
+
+        Returns:
+        --------
+        """
+        # return if we don't have the data for this relation
+        path = self._relationPath(i, level)
+        if path is None:
+            return
+
+        # Select the style
+        value = self._config.getValue(styleKey)
+
+        # Draw the ways via the QPainter; drawPath would also fill the path
+        # with any brush left over from a filled Way
+        if type(value) == QPen:
+            value.setWidthF(self._scale*value.widthF())
+            if _dashed(value):
+                p.fillPath(self._outline(('relation', i, level), path, value),
+                           value.brush())
+            else:
+                p.setPen(value)
+                p.setBrush(Qt.NoBrush)
+                p.drawPath(path)
+        elif type(value) == QColor:
+            p.fillPath(path, value)
+
+    def _clearPaths(self):
+        """
+        Private function used to discard the cached geometry and layers. They
+        are in canvas coordinates, so this must be called whenever the
+        transform changes. Polygons and paths are cached per level of detail,
+        None being the full geometry
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        self._wayPolygons = {}
+        self._fillPolygons = {}
+        self._relationPaths = {}
+        self._outlines = {}
+        self._simplified = {}
+        self._simplifying = threading.Lock()
+        self._layers = {}
+        self._extents = None
+        self._sizes = None
+
+    def _wayPolygon(self, i, fill=False, level=None):
+        """
+        Private function used to get the polygon of a Way for the current
+        transform. Polygons are built on first use and cached, so restyling or
+        toggling layers redraws from ready-made geometry
+
+        Parameters:
+        -----------
+        i : int
+            The index of the Way in the Way store
+        fill : boolean
+            True for the outline of a fill, which leaves out the last Node as
+            the polygon closes itself. A closed Way's last Node repeats its
+            first, so its line polygon is reused
+        level : float | None
+            The tolerance of the simplified geometry (see _LOD_LEVELS); None
+            for the full geometry
+
+        Returns:
+        --------
+        polygon : QPolygonF
+            The Way's Nodes in canvas coordinates
+        """
+        if level is None:
+            members = self._ways.members(i)
+        else:
+            offsets, refs = self._simplify(level)
+            members = refs[offsets[i]:offsets[i+1]]
+
+        cache = self._wayPolygons.setdefault(level, {})
+        if fill and (len(members) < 2 or members[0] != members[-1]):
+            cache = self._fillPolygons.setdefault(level, {})
+            fill = True
+        else:
+            fill = False
+
+        polygon = cache.get(i)
+
+        if polygon is None:
+            points = self._nodes.coords(members)
+            if fill:
+                points = points[:-1]
+            polygon = cache[i] = _polygon(points)
+
+        return polygon
+
+    def _simplify(self, level):
+        """
+        Private function used to get the Ways simplified for a tolerance, in
+        the Way store's layout. Every Way is simplified at once: the Nodes
+        are snapped to a grid of tolerance sized cells, and a Node in the same
+        cell as the Node before it is dropped. A Way's first and last Nodes
+        are always kept, so closed Ways stay closed. Built on first use, by
+        one thread at a time, as a level costs several arrays the length of
+        the Way store
+
+        Parameters:
+        -----------
+        level : float
+            The tolerance in canvas pixels
+
+        Returns:
+        --------
+        offsets : ndarray
+            The start of each Way's Nodes, plus the end of the last one
+        refs : ndarray
+            The kept Nodes' indices in the Node store
+        """
+        with self._simplifying:
+            if level not in self._simplified:
+                self._simplified[level] = self._simplifyWays(level)
+
+        return self._simplified[level]
+
+    def _simplifyWays(self, level):
+        """
+        Private function used to build a level of simplified Ways (see
+        _simplify)
+        """
+        offsets, refs = self._ways.offsets, self._ways.refs
+        ways = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+        # Nodes missing from the file are never drawn
+        present = refs >= 0
+        refs, ways = refs[present], ways[present]
+
+        cx = np.floor(self._nodes.x[refs]/level)
+        cy = np.floor(self._nodes.y[refs]/level)
+
+        keep = np.ones(len(refs), dtype=bool)
+        keep[1:] = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+        keep[1:] |= ways[1:] != ways[:-1]
+        keep[:-1] |= ways[:-1] != ways[1:]
+        if len(keep):
+            keep[-1] = True
+
+        counts = np.bincount(ways[keep], minlength=len(offsets) - 1)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        return offsets, refs[keep]
+
+    def _relationPath(self, i, level=None):
+        """
+        Private function used to get the path of a Relation for the current
+        transform, tracing each of its Ways as a closed subpath. Paths are
+        built on first use and cached
+
+        Parameters:
+        -----------
+        i : int
+            The index of the Relation in the Relation store
+        level : float | None
+            The simplified geometry traced (see _wayPolygon)
+
+        Returns:
+        --------
+        path : QPainterPath | None
+            The Relation's path, or None if any of its Ways is missing
+        """
+        cache = self._relationPaths.setdefault(level, {})
+        if i in cache:
+            return cache[i]
+
+        # Note, some OSM files don't include all of the ways that are in
+        # relations... kinda annoying actually
+        path = None
+        wids = self._relations.members(i)
+
+        if not (wids < 0).any():
+            path = QPainterPath()
+
+            # Trace out the ways using a QPainterPath
+            for wid in wids.tolist():
+                polygon = self._wayPolygon(wid, level=level)
+                if polygon.isEmpty():
+                    continue
+
+                path.addPolygon(polygon)
+                path.closeSubpath()
+
+        cache[i] = path
+
+        return path
+
+    def _outline(self, key, shape, pen):
+        """
+        Private function used to get the outline of a dashed stroke for the
+        current transform. A dashed stroke is drawn by filling its outline,
+        which is stroked once over the whole canvas, so the dashes don't
+        restart where a band or tile of an image is clipped and every piece
+        of the image agrees with the others. Outlines are cached per feature
+        along with the pen they were stroked with
+
+        Parameters:
+        -----------
+        key : tuple
+            The kind of feature, its index and its level of detail
+        shape : QPolygonF | QPainterPath
+            The polyline of a Way or the path of a Relation
+        pen : QPen
+            The dashed pen, already scaled
+
+        Returns:
+        --------
+        outline : QPainterPath
+            The area covered by the stroke
+        """
+        style = (pen.widthF(), pen.style(), pen.capStyle(), pen.joinStyle(),
+                 pen.miterLimit(), pen.dashOffset(), tuple(pen.dashPattern()))
+
+        cached = self._outlines.get(key)
+        if cached is not None and cached[0] == style:
+            return cached[1]
+
+        if type(shape) == QPolygonF:
+            path = QPainterPath()
+            path.addPolygon(shape)
+            shape = path
+
+        outline = QPainterPathStroker(pen).createStroke(shape)
+        self._outlines[key] = (style, outline)
+
+        return outline
+
+
+def _never():
+    """
+    Function used in place of a draw's cancelled function when none is given
+    """
+    return False
+
+
+def _dashed(pen):
+    """
+    Function used to check whether a pen strokes dashes, which are drawn from
+    their outlines (see Map._outline). Cosmetic pens are always stroked by
+    the painter
+    """
+    return pen.style() not in (Qt.SolidLine, Qt.NoPen) and pen.widthF() > 0
+
+
+def _extents(offsets, refs, lo, hi):
+    """
+    Function used to compute the bounding boxes of features stored as slices
+    of a flat member array
+
+    Parameters:
+    -----------
+    offsets : ndarray
+        The start of each feature's members, plus the end of the last one
+    refs : ndarray
+        The members' indices into lo and hi; -1 marks missing members
+    lo, hi : ndarray
+        Mx2 arrays of the members' minimum and maximum x, y
+
+    Returns:
+    --------
+    box : ndarray
+        An Nx4 array of min x, min y, max x, max y per feature; NaN for
+        features without any member present
+    """
+    n = len(offsets) - 1
+    box = np.full((n, 4), np.nan)
+    if len(refs) == 0 or len(lo) == 0:
+        return box
+
+    # Missing members become NaN, which fmin and fmax skip. Points share
+    # one gathered copy for both
+    missing = refs < 0
+    lo, hi = (lo[refs], None) if lo is hi else (lo[refs], hi[refs])
+    lo[missing] = np.nan
+    if hi is None:
+        hi = lo
+    else:
+        hi[missing] = np.nan
+
+    starts = np.minimum(offsets[:-1], len(refs) - 1)
+    box[:, :2] = np.fmin.reduceat(lo, starts)
+    box[:, 2:] = np.fmax.reduceat(hi, starts)
+    box[offsets[1:] == offsets[:-1]] = np.nan
+
+    return box
+
+
+def _level(tolerance):
+    """
+    Function used to get the coarsest simplified level within a tolerance in
+    canvas pixels, or None to draw every Node
+    """
+    return max([tol for tol in _LOD_LEVELS if tol <= tolerance],
+               default=None)
+
+
+def _rgb(image):
+    """
+    Function used to get the pixels of an opaque image as RGB rows
+
+    Parameters:
+    -----------
+    image : QImage
+        The image
+
+    Returns:
+    --------
+    rows : ndarray
+        A uint8 array of shape (height, width, 3)
+    """
+    image = image.convertToFormat(QImage.Format_RGB888)
+    w, h, bpl = image.width(), image.height(), image.bytesPerLine()
+
+    ptr = image.constBits()
+    ptr.setsize(h*bpl)
+    rows = np.frombuffer(ptr, dtype=np.uint8).reshape(h, bpl)
+
+    return rows[:, :3*w].reshape(h, w, 3).copy()
+
+
+def _polygon(points):
+    """
+    Function used to convert an Nx2 array of points to a QPolygonF. The
+    coordinates are written straight into the polygon's memory rather than
+    creating a QPointF per point
+
+    Parameters:
+    -----------
+    points : ndarray
+        The Nx2 array of x, y coordinates
+
+    Returns:
+    --------
+    polygon : QPolygonF
+        The polygon
+    """
+    n = len(points)
+    polygon = QPolygonF(n)
+
+    if n:
+        ptr = polygon.data()
+        ptr.setsize(16*n)
+        np.frombuffer(ptr, dtype=np.float64).reshape(n, 2)[:] = points
+
+    return polygon
 
-        # Draw the ways via the QPainter
-        if type(value) == QPen:
-            value.setWidthF(self._scale*value.widthF())
-            p.setPen(value)
-            p.drawPath(path)
-        elif type(value) == QColor:
-            p.fillPath(path, value)
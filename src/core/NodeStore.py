@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage of the OSM Nodes. Rather than one Python object per Node, the
+IDs live in a sorted int64 array with the coordinates in parallel float64
+arrays, so an ID lookup is a binary search over the array and many IDs may be
+looked up with a single call. Nodes are stored by longitude and latitude and
+projected to pixels for a Transform in a single batched call.
+"""
+
+import copy
+from array import array
+
+import numpy as np
+
+
+# Nodes buffered between filterings when only some Nodes are wanted
+_FILTER_BATCH = 1 << 18
+
+
+def among(ids, wanted, ordered=False):
+    """
+    Function used to find which of some IDs are among others. The wanted IDs
+    are sorted and searched rather than hashed, which keeps the memory used
+    to a copy of them
+
+    Parameters:
+    -----------
+    ids : ndarray
+        The IDs being checked
+    wanted : ndarray
+        The IDs looked for; repeats are allowed
+    ordered : boolean
+        True if the wanted IDs are already sorted
+
+    Returns:
+    --------
+    <value> : ndarray
+        A boolean per ID, True for the IDs that are wanted
+    """
+    if not ordered:
+        wanted = np.sort(np.asarray(wanted, dtype=np.int64))
+    if not len(wanted):
+        return np.zeros(len(ids), dtype=bool)
+
+    idx = np.searchsorted(wanted, ids)
+
+    # IDs larger than every wanted ID land one past the end
+    idx[idx == len(wanted)] = 0
+
+    return wanted[idx] == ids
+
+
+def compact(buffer, keep, start=0):
+    """
+    Function used to drop items of an ingestion buffer in place, so no second
+    buffer is ever allocated
+
+    Parameters:
+    -----------
+    buffer : array
+        The buffer, which must not be viewed by any array
+    keep : ndarray
+        A boolean per item from start on, True for the items kept
+    start : int
+        The first item that may be dropped
+
+    Returns:
+    --------
+    """
+    view = np.frombuffer(buffer, dtype=buffer.typecode)[start:]
+    n = int(np.count_nonzero(keep))
+    view[:n] = view[keep]
+    del view
+
+    del buffer[start + n:]
+
+
+class Node:
+    def __init__(self, ID, x, y):
+        """
+        Constructor
+
+        A lightweight view of a single entry of the NodeStore
+        """
+        self._id = ID
+        self._x = x
+        self._y = y
+
+    """
+    ###########################################################################
+                                    Properties
+    ###########################################################################
+    """
+    @property
+    def ID(self):
+        return self._id
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+
+class NodeStore:
+    def __init__(self, wanted=None):
+        """
+        Constructor
+
+        The store is filled by append while the file is ingested, then freeze
+        must be called before any lookups are performed and project before
+        any coordinates are requested
+
+        Parameters:
+        -----------
+        wanted : ndarray | None
+            The IDs of the only Nodes kept, such as on the second pass over a
+            pruned file; the others are dropped in batches as they come in,
+            though the extent still covers them. Every Node is kept by default
+        """
+        # Growable buffers used during ingestion
+        self._bIDs = array('q')
+        self._bLon = array('d')
+        self._bLat = array('d')
+
+        # The wanted IDs, sorted, how many buffered Nodes have been filtered
+        # and the extent of every Node ingested
+        self._wanted = None
+        if wanted is not None:
+            self._wanted = np.sort(np.asarray(wanted, dtype=np.int64))
+        self._filtered = 0
+        self._extent = None
+
+        # Sorted arrays used once frozen
+        self._ids = None
+        self._lon = None
+        self._lat = None
+
+        # Pixel coordinates for the current Transform
+        self._x = None
+        self._y = None
+
+    """
+    ###########################################################################
+                                Built-In Functions
+    ###########################################################################
+    """
+    def __len__(self):
+        return len(self._ids) if self._ids is not None else len(self._bIDs)
+
+    def __contains__(self, nid):
+        return self.index([nid])[0] >= 0
+
+    def __getitem__(self, nid):
+        i = self.index([nid])[0]
+        if i < 0:
+            raise KeyError(nid)
+        return Node(int(self._ids[i]), float(self._x[i]), float(self._y[i]))
+
+    """
+    ###########################################################################
+                                    Properties
+    ###########################################################################
+    """
+    @property
+    def IDs(self):
+        return self._ids
+
+    @property
+    def lon(self):
+        return self._lon
+
+    @property
+    def lat(self):
+        return self._lat
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def append(self, nid, lon, lat):
+        """
+        Function used to add a Node during ingestion
+
+        Parameters:
+        -----------
+        nid : int
+            The Node ID
+        lon : float
+            The longitude of the Node
+        lat : float
+            The latitude of the Node
+
+        Returns:
+        --------
+        """
+        self._bIDs.append(nid)
+        self._bLon.append(lon)
+        self._bLat.append(lat)
+
+        if (self._wanted is not None and
+                len(self._bIDs) - self._filtered >= _FILTER_BATCH):
+            self._filter()
+
+    def extend(self, nids, lon, lat):
+        """
+        Function used to add many Nodes at once during ingestion
+
+        Parameters:
+        -----------
+        nids : ndarray
+            The Node IDs
+        lon : ndarray
+            The longitudes of the Nodes
+        lat : ndarray
+            The latitudes of the Nodes
+
+        Returns:
+        --------
+        """
+        self._bIDs.frombytes(np.asarray(nids, dtype=np.int64).tobytes())
+        self._bLon.frombytes(np.asarray(lon, dtype=np.float64).tobytes())
+        self._bLat.frombytes(np.asarray(lat, dtype=np.float64).tobytes())
+
+        if self._wanted is not None:
+            self._filter()
+
+    def merge(self, store):
+        """
+        Function used to add the Nodes of another store that is still being
+        ingested, such as one filled from another part of the file
+
+        Parameters:
+        -----------
+        store : NodeStore
+            The unfrozen store
+
+        Returns:
+        --------
+        """
+        self._bIDs.extend(store._bIDs)
+        self._bLon.extend(store._bLon)
+        self._bLat.extend(store._bLat)
+
+        if self._wanted is not None:
+            self._filter()
+
+    def clear(self):
+        """
+        Function used to drop every Node ingested so far, such as when a
+        reader gives up on a file part way through
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        self._bIDs, self._bLon, self._bLat = array('q'), array('d'), array('d')
+        self._filtered = 0
+        self._extent = None
+
+    def freeze(self):
+        """
+        Function used to convert the ingestion buffers into the sorted arrays
+        used for lookups. The buffers are released afterwards
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        if self._wanted is not None:
+            self._filter()
+            self._wanted = None
+
+        ids = np.frombuffer(self._bIDs, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+
+        self._ids = ids[order]
+        self._lon = np.frombuffer(self._bLon, dtype=np.float64)[order]
+        self._lat = np.frombuffer(self._bLat, dtype=np.float64)[order]
+
+        self._bIDs, self._bLon, self._bLat = array('q'), array('d'), array('d')
+
+    def getState(self):
+        """
+        Function used to get the arrays that fully describe a frozen store,
+        such as for writing to the geometry cache
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        arrays : dict
+            The numpy arrays keyed by name
+        """
+        return {'ids': self._ids, 'lon': self._lon, 'lat': self._lat}
+
+    def setState(self, arrays):
+        """
+        Function used to restore a frozen store from getState's output
+
+        Parameters:
+        -----------
+        arrays : dict
+            The numpy arrays keyed by name; these may be memory mapped
+
+        Returns:
+        --------
+        """
+        self._ids = arrays['ids']
+        self._lon = arrays['lon']
+        self._lat = arrays['lat']
+
+    def select(self, nids):
+        """
+        Function used to drop every Node but the given ones during ingestion,
+        before the store is frozen, so the dropped Nodes are never sorted or
+        copied. The buffers are compacted in place
+
+        Parameters:
+        -----------
+        nids : ndarray
+            The IDs of the Nodes kept; IDs that aren't in the store and
+            repeated IDs are allowed
+
+        Returns:
+        --------
+        """
+        keep = among(np.frombuffer(self._bIDs, dtype=np.int64), nids)
+
+        for buffer in (self._bIDs, self._bLon, self._bLat):
+            compact(buffer, keep)
+
+    def extent(self):
+        """
+        Function used to get the extent of the Nodes, also while ingesting.
+        While only some Nodes are wanted, this is the extent of every Node
+        ingested
+
+        Returns:
+        --------
+        <value> : tuple of floats
+            The minimum & maximum latitude and minimum & maximum longitude
+        """
+        if self._wanted is not None:
+            self._filter()
+            return tuple(self._extent)
+
+        if self._ids is None:
+            lon = np.frombuffer(self._bLon, dtype=np.float64)
+            lat = np.frombuffer(self._bLat, dtype=np.float64)
+        else:
+            lon, lat = self._lon, self._lat
+
+        return (float(lat.min()), float(lat.max()), float(lon.min()),
+                float(lon.max()))
+
+    def project(self, transform):
+        """
+        Function used to convert every Node to pixel coordinates at once
+
+        Parameters:
+        -----------
+        transform : Transform
+            The transform mapping longitude/latitude to the canvas
+
+        Returns:
+        --------
+        """
+        self._x = transform.convertLongs(self._lon)
+        self._y = transform.convertLats(self._lat)
+
+    def index(self, nids):
+        """
+        Function used to convert Node IDs into indices of the store's arrays
+
+        Parameters:
+        -----------
+        nids : list of ints | ndarray
+            The Node IDs being looked up
+
+        Returns:
+        --------
+        idx : ndarray
+            The int64 index of each ID, or -1 where the ID isn't in the store
+        """
+        nids = np.asarray(nids, dtype=np.int64)
+        idx = np.searchsorted(self._ids, nids)
+
+        # IDs larger than every stored ID land one past the end
+        idx[idx == len(self._ids)] = 0
+        found = self._ids[idx] == nids if len(self._ids) else idx < 0
+
+        return np.where(found, idx, -1)
+
+    def projected(self, transform):
+        """
+        Function used to get a store sharing this store's Nodes but projected
+        for a different Transform. Only the pixel coordinates are new
+
+        Parameters:
+        -----------
+        transform : Transform
+            The transform mapping longitude/latitude to the other canvas
+
+        Returns:
+        --------
+        store : NodeStore
+            The re-projected store
+        """
+        store = copy.copy(self)
+        store.project(transform)
+
+        return store
+
+    def coords(self, idx):
+        """
+        Function used to get the coordinates of a sequence of Nodes by their
+        indices in the store. Negative indices mark Nodes missing from the file
+        and are skipped
+
+        Parameters:
+        -----------
+        idx : ndarray
+            The Node indices, in drawing order
+
+        Returns:
+        --------
+        points : ndarray
+            An Nx2 array of the x, y coordinates
+        """
+        idx = idx[idx >= 0]
+
+        return np.column_stack((self._x[idx], self._y[idx]))
+
+    def xy(self, nids):
+        """
+        Function used to get the coordinates of a sequence of Nodes. Nodes
+        missing from the store are skipped; some OSM files don't include every
+        Node referenced by their Ways
+
+        Parameters:
+        -----------
+        nids : list of ints | ndarray
+            The Node IDs, in drawing order
+
+        Returns:
+        --------
+        points : ndarray
+            An Nx2 array of the x, y coordinates
+        """
+        return self.coords(self.index(nids))
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _filter(self):
+        """
+        Private function used to drop the Nodes buffered since the last
+        filtering that aren't wanted, after adding them to the extent
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        """
+        start = self._filtered
+        lon = np.frombuffer(self._bLon, dtype=np.float64)[start:]
+        lat = np.frombuffer(self._bLat, dtype=np.float64)[start:]
+
+        if len(lon):
+            extent = [lat.min(), lat.max(), lon.min(), lon.max()]
+            if self._extent is not None:
+                extent = [min(extent[0], self._extent[0]),
+                          max(extent[1], self._extent[1]),
+                          min(extent[2], self._extent[2]),
+                          max(extent[3], self._extent[3])]
+            self._extent = [float(value) for value in extent]
+        del lon, lat
+
+        keep = among(np.frombuffer(self._bIDs, dtype=np.int64)[start:],
+                     self._wanted, ordered=True)
+        for buffer in (self._bIDs, self._bLon, self._bLat):
+            compact(buffer, keep, start)
+
+        self._filtered = len(self._bIDs)
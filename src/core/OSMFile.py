@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Opening of OSM XML files that may be compressed (.osm.gz, .osm.bz2, .osm.xz).
+Compressed files are decompressed as a stream straight into the parser; no
+temporary file is written.
+
+Decompression runs on a read-ahead thread that keeps a few chunks ready, so
+it overlaps with parsing. zlib, bz2 and lzma release the GIL while they work,
+so the two really do run at the same time on separate cores.
+"""
+
+import io
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+
+# Openers of the compressed formats, by file extension
+CODECS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Size of the decompressed chunks and the number kept ready
+_CHUNK = 1024*1024
+_DEPTH = 8
+
+
+def codec(fname):
+    """
+    Function used to get the compression extension of a file name
+
+    Returns:
+    --------
+    <value> : String | None
+        The extension, such as '.gz', or None if the file isn't compressed
+    """
+    for ext in CODECS:
+        if fname.lower().endswith(ext):
+            return ext
+
+    return None
+
+
+def open(fname, readAhead=True):
+    """
+    Function used to open an OSM XML file for reading, decompressing it on
+    the fly if need be
+
+    Parameters:
+    -----------
+    fname : String
+        The OSM file name
+    readAhead : boolean
+        True to decompress on a separate thread, ahead of the reader
+
+    Returns:
+    --------
+    <value> : file
+        The binary file object of the XML
+    """
+    ext = codec(fname)
+    if ext is None:
+        return io.open(fname, 'rb')
+
+    f = CODECS[ext](fname, 'rb')
+    if not readAhead:
+        return f
+
+    return io.BufferedReader(ReadAhead(f), _CHUNK)
+
+
+class ReadAhead(io.RawIOBase):
+    def __init__(self, f):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        f : file
+            The file being read ahead of; it is closed along with this one
+        """
+        super(ReadAhead, self).__init__()
+
+        # Bind class variables
+        self._f = f
+        self._chunks = queue.Queue(_DEPTH)
+        self._chunk = memoryview(b'')
+        self._stop = threading.Event()
+        self._eof = False
+
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        """
+        Function used to copy the next decompressed bytes into a buffer
+
+        Parameters:
+        -----------
+        b : writable buffer
+            The buffer
+
+        Returns:
+        --------
+        n : int
+            The number of bytes copied; 0 at the end of the file
+        """
+        if not len(self._chunk):
+            if self._eof:
+                return 0
+
+            chunk = self._chunks.get()
+            if isinstance(chunk, BaseException):
+                self._eof = True
+                raise chunk
+            if not chunk:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(chunk)
+
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+
+        return n
+
+    def close(self):
+        """
+        Function used to stop reading ahead and close the underlying file
+        """
+        if self.closed:
+            return
+
+        self._stop.set()
+
+        # Unblock the thread if it is waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._chunks.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(0.01)
+
+        self._f.close()
+        super(ReadAhead, self).close()
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _fill(self):
+        """
+        Private function run by the read-ahead thread. The chunks are queued
+        for the reader, followed by an empty chunk at the end of the file or
+        the error that stopped reading
+        """
+        try:
+            while not self._stop.is_set():
+                chunk = self._f.read(_CHUNK)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        """
+        Private function used to queue an item, giving up once stopped
+        """
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+"""
+Reader of OpenStreetMap's binary .osm.pbf format, needing nothing beyond the
+standard library and NumPy. A .pbf file is a sequence of independently
+compressed blobs of protocol buffer messages: a header blob with the bounds,
+then data blobs (PrimitiveBlocks) of a few thousand Nodes, Ways or Relations
+each. The blobs are decoded in a process pool, in file order.
+
+Protocol buffers store their numbers as varints; the long packed runs of them
+(the dense Node IDs and coordinates, the Ways' Node IDs) are decoded with a
+handful of NumPy calls per block rather than byte by byte. They are also delta
+coded, which a cumulative sum undoes.
+
+See https://wiki.openstreetmap.org/wiki/PBF_Format
+"""
+
+import os
+import lzma
+import zlib
+import struct
+import multiprocessing as mp
+
+import numpy as np
+
+from NodeStore import NodeStore
+from FeatureStore import FeatureStore, Way, Relation
+
+import constants as c
+
+
+# Features the reader supports; files requiring any other are refused
+_FEATURES = {'OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation',
+             'Sort.Type_then_ID', 'Sort.Geographic'}
+
+# Largest blob header and blob allowed by the format
+_MAX_HEADER = 64*1024
+_MAX_BLOB = 32*1024*1024
+
+# Blobs decoded by a worker per task
+_CHUNK = 4
+
+# The Relation member type of Ways
+_MEMBER_WAY = 1
+
+# Protocol buffer wire types
+_VARINT, _FIXED64, _BYTES, _FIXED32 = 0, 1, 2, 5
+
+
+def isPBF(fname):
+    """
+    Function used to tell whether a file name is that of a .osm.pbf file
+    """
+    return fname.lower().endswith('.pbf')
+
+
+def read(fname, processes=None, stores=None):
+    """
+    Function used to read a .osm.pbf file into (unfrozen) stores
+
+    Parameters:
+    -----------
+    fname : String
+        The .osm.pbf file name
+    processes : int | None
+        The number of processes decoding blocks; defaults to one per core
+    stores : tuple | None
+        The NodeStore and the Way and Relation FeatureStores filled, any of
+        which may be None to skip those elements; new stores by default
+
+    Returns:
+    --------
+    bounds : tuple of floats | None
+        The minimum & maximum latitude and minimum & maximum longitude, if the
+        file has a bounding box
+    nodes : NodeStore
+        The Node IDs and coordinates
+    ways : FeatureStore
+        The Ways
+    relations : FeatureStore
+        The Relations
+    """
+    if stores is None:
+        stores = (NodeStore(), FeatureStore(Way), FeatureStore(Relation))
+    nodes, ways, relations = stores
+
+    processes = processes or os.cpu_count() or 1
+
+    # Pool workers are daemons, which can't have processes of their own
+    if mp.current_process().daemon:
+        processes = 1
+
+    with open(fname, 'rb') as f:
+        blobs = _blobs(f)
+
+        kind, blob = next(blobs, (None, None))
+        if kind != 'OSMHeader':
+            raise ValueError('%s is not an OSM PBF file' % fname)
+        bounds = _header(_inflate(blob))
+
+        data = (blob for kind, blob in blobs if kind == 'OSMData')
+        if processes > 1:
+            # Spawned rather than forked, as the caller may have threads
+            # running, such as Qt's
+            with mp.get_context('spawn').Pool(processes) as pool:
+                for block in pool.imap(_decode, data, _CHUNK):
+                    _store(block, nodes, ways, relations)
+        else:
+            for blob in data:
+                _store(_decode(blob), nodes, ways, relations)
+
+    return bounds, nodes, ways, relations
+
+
+def _blobs(f):
+    """
+    Function used to split a .osm.pbf file into its blobs. Each is preceded
+    by its length as a 4 byte big endian integer and a BlobHeader message
+
+    Parameters:
+    -----------
+    f : file
+        The file, opened in binary mode
+
+    Returns:
+    --------
+    <value> : generator of tuples
+        The type of each blob ('OSMHeader' or 'OSMData') and its still
+        compressed Blob message
+    """
+    while True:
+        size = f.read(4)
+        if not size:
+            return
+        if len(size) < 4:
+            raise ValueError('Truncated PBF file')
+
+        size, = struct.unpack('>I', size)
+        if size > _MAX_HEADER:
+            raise ValueError('PBF blob header too large')
+
+        kind, length = None, 0
+        for field, value in _fields(f.read(size)):
+            if field == 1:
+                kind = value.decode()
+            elif field == 3:
+                length = value
+
+        if length > _MAX_BLOB:
+            raise ValueError('PBF blob too large')
+
+        blob = f.read(length)
+        if len(blob) < length:
+            raise ValueError('Truncated PBF file')
+
+        yield kind, blob
+
+
+def _inflate(blob):
+    """
+    Function used to get the message held in a Blob, decompressing it
+    """
+    for field, value in _fields(blob):
+        if field == 1:
+            return value
+        if field == 3:
+            return zlib.decompress(value)
+        if field == 4:
+            return lzma.decompress(value)
+        if field >= 5:
+            raise ValueError('Unsupported PBF compression')
+
+    return b''
+
+
+def _header(data):
+    """
+    Function used to read a HeaderBlock
+
+    Parameters:
+    -----------
+    data : bytes
+        The HeaderBlock message
+
+    Returns:
+    --------
+    bounds : tuple of floats | None
+        See read
+    """
+    bounds = None
+
+    for field, value in _fields(data):
+        if field == 1:
+            # HeaderBBox edges are in nanodegrees
+            box = {f: _zigzag(v) for f, v in _fields(value)}
+            left, right, top, bottom = (box.get(i, 0) for i in range(1, 5))
+            bounds = (bottom/1e9, top/1e9, left/1e9, right/1e9)
+        elif field == 4:
+            feature = value.decode()
+            if feature not in _FEATURES:
+                raise ValueError('Unsupported PBF feature %s' % feature)
+
+    return bounds
+
+
+def _decode(blob):
+    """
+    Function used to decode a data blob (a PrimitiveBlock) into arrays. Runs
+    in the worker processes, so it only returns plain picklable data
+
+    Parameters:
+    -----------
+    blob : bytes
+        The compressed Blob message
+
+    Returns:
+    --------
+    block : dict
+        The 'nodes' as ID, longitude and latitude arrays, then the 'ways'
+        and 'relations' as ID, member count and member ID arrays plus a
+        list of each feature's kept tags
+    """
+    strings, groups = [], []
+    granularity, latOffset, lonOffset = 100, 0, 0
+
+    for field, value in _fields(_inflate(blob)):
+        if field == 1:
+            strings = [s.decode() for f, s in _fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            latOffset = _int64(value)
+        elif field == 20:
+            lonOffset = _int64(value)
+
+    # Only the tags of the keys we render are kept
+    kept = {i for i, s in enumerate(strings) if s in c.DATA_GROUPS}
+
+    nodes, ways, relations = ([], [], []), [], []
+    for group in groups:
+        for field, value in _fields(group):
+            if field == 1:
+                for a, b in zip(nodes, _node(value)):
+                    a.append(b)
+            elif field == 2:
+                for a, b in zip(nodes, _denseNodes(value)):
+                    a.append(b)
+            elif field == 3:
+                ways.append(value)
+            elif field == 4:
+                relations.append(value)
+
+    ids, lon, lat = (np.concatenate(a) if a else np.empty(0, dtype=np.int64)
+                     for a in nodes)
+
+    # Coordinates are integer multiples of granularity nanodegrees; a single
+    # division keeps them identical to the decimal degrees of the XML
+    block = {'nodes': (ids, (lonOffset + granularity*lon)/1e9,
+                       (latOffset + granularity*lat)/1e9),
+             'ways': _features(ways, 8, strings, kept),
+             'relations': _features(relations, 9, strings, kept, 10)}
+
+    return block
+
+
+def _node(data):
+    """
+    Function used to decode a plain (non-dense) Node
+
+    Returns:
+    --------
+    ids, lon, lat : ndarray
+        The Node's ID and its raw longitude and latitude, before granularity
+        and offsets are applied
+    """
+    values = dict(_fields(data))
+
+    return (np.array([_zigzag(values.get(1, 0))], dtype=np.int64),
+            np.array([_zigzag(values.get(9, 0))], dtype=np.int64),
+            np.array([_zigzag(values.get(8, 0))], dtype=np.int64))
+
+
+def _denseNodes(data):
+    """
+    Function used to decode a DenseNodes message, whose IDs and coordinates
+    are packed and delta coded. A packed field may be split over several
+    occurrences, which are joined
+
+    Returns:
+    --------
+    ids, lon, lat : ndarray
+        See _node
+    """
+    values = {1: [], 8: [], 9: []}
+    for field, value in _fields(data):
+        if field in values:
+            values[field].append(value)
+
+    ids, lat, lon = (np.cumsum(_signed(_varints(b''.join(values[f]))))
+                     for f in (1, 8, 9))
+
+    return ids, lon, lat
+
+
+def _features(messages, refsField, strings, kept, typesField=None):
+    """
+    Function used to decode the Way or Relation messages of a block. The
+    packed fields of every message are joined and decoded at once, as are
+    the occurrences of a packed field split within a message
+
+    Parameters:
+    -----------
+    messages : list of bytes
+        The Way or Relation messages
+    refsField : int
+        The field of the packed, delta coded member IDs
+    strings : list of Strings
+        The block's string table
+    kept : set of ints
+        The string table indices of the tag keys we render
+    typesField : int | None
+        The field of the Relations' member types; only Way members are kept
+
+    Returns:
+    --------
+    ids : ndarray
+        The feature IDs
+    counts : ndarray
+        The number of members of each feature
+    refs : ndarray
+        The member IDs, feature after feature
+    tags : list of dicts
+        The kept tags of each feature
+    """
+    ids = np.empty(len(messages), dtype=np.int64)
+    packed = {2: [], 3: [], refsField: []}
+    if typesField is not None:
+        packed[typesField] = []
+
+    for i, message in enumerate(messages):
+        fields = dict.fromkeys(packed, b'')
+        for field, value in _fields(message):
+            if field == 1:
+                ids[i] = _int64(value)
+            elif field in fields:
+                fields[field] += value
+
+        for field, value in fields.items():
+            packed[field].append(value)
+
+    # The deltas restart with every feature, so the running sum of each is
+    # the overall running sum less the total before it
+    deltas, counts = _packedRuns(packed[refsField])
+    total = np.cumsum(_signed(deltas))
+    before = np.concatenate(([0], total))[np.cumsum(counts) - counts]
+    refs = total - np.repeat(before, counts)
+
+    if typesField is not None:
+        way = _packedRuns(packed[typesField])[0] == _MEMBER_WAY
+        owner = np.repeat(np.arange(len(counts)), counts)
+        refs = refs[way]
+        counts = np.bincount(owner[way], minlength=len(counts))
+
+    # Keys and values are both string table indices; only the tags whose key
+    # we render are looked up
+    keys, perFeature = _packedRuns(packed[2])
+    values = _packedRuns(packed[3])[0]
+    owner = np.repeat(np.arange(len(messages)), perFeature)
+    hit = np.isin(keys, np.fromiter(kept, dtype=np.uint64, count=len(kept)))
+
+    tags = [{} for _ in messages]
+    for i, k, v in zip(owner[hit].tolist(), keys[hit].tolist(),
+                       values[hit].tolist()):
+        tags[i][strings[k]] = strings[v]
+
+    return ids, counts.astype(np.int64), refs, tags
+
+
+def _store(block, nodes, ways, relations):
+    """
+    Function used to add a decoded block to the stores that aren't None
+    """
+    if nodes is not None:
+        nodes.extend(*block['nodes'])
+    if ways is not None:
+        ways.extend(*block['ways'])
+    if relations is not None:
+        relations.extend(*block['relations'])
+
+
+def _fields(data):
+    """
+    Function used to iterate over the fields of a protocol buffer message
+
+    Parameters:
+    -----------
+    data : bytes
+        The message
+
+    Returns:
+    --------
+    <value> : generator of tuples
+        The number and value of each field; varints are ints, length
+        delimited fields bytes and fixed width fields their raw bytes
+    """
+    pos, end = 0, len(data)
+
+    while pos < end:
+        # Field keys are almost always a single byte
+        key = data[pos]
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = _varint(data, pos)
+        wire = key & 7
+
+        if wire == _VARINT:
+            value, pos = _varint(data, pos)
+        elif wire == _BYTES:
+            length, pos = _varint(data, pos)
+            value = data[pos:pos+length]
+            pos += length
+        elif wire == _FIXED64:
+            value = data[pos:pos+8]
+            pos += 8
+        elif wire == _FIXED32:
+            value = data[pos:pos+4]
+            pos += 4
+        else:
+            raise ValueError('Unsupported protocol buffer wire type %d' % wire)
+
+        yield key >> 3, value
+
+
+def _varint(data, pos):
+    """
+    Function used to read a single varint
+
+    Returns:
+    --------
+    value : int
+        The unsigned value
+    pos : int
+        The position following the varint
+    """
+    value = shift = 0
+
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _varints(data):
+    """
+    Function used to decode a packed run of varints at once. Each byte holds
+    7 bits of its number, low bits first; the last byte of a number is the
+    only one below 0x80
+
+    Parameters:
+    -----------
+    data : bytes
+        The packed varints
+
+    Returns:
+    --------
+    <value> : ndarray
+        The uint64 values
+    """
+    b = np.frombuffer(data, dtype=np.uint8)
+    if not len(b):
+        return np.empty(0, dtype=np.uint64)
+    if b[-1] >= 0x80:
+        raise ValueError('Truncated protocol buffer varint')
+
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    shifts = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    bits = (b & 0x7f).astype(np.uint64) << (7*shifts).astype(np.uint64)
+
+    return np.bitwise_or.reduceat(bits, starts)
+
+
+def _packedRuns(runs):
+    """
+    Function used to decode the packed varints of many messages at once
+
+    Parameters:
+    -----------
+    runs : list of bytes
+        The packed varints of each message
+
+    Returns:
+    --------
+    values : ndarray
+        The uint64 values, message after message
+    counts : ndarray
+        The number of values of each message
+    """
+    data = b''.join(runs)
+
+    # Every varint ends with the only one of its bytes below 0x80
+    lengths = np.fromiter(map(len, runs), dtype=np.int64, count=len(runs))
+    ends = np.concatenate(([0], np.cumsum(np.frombuffer(data, np.uint8) <
+                                          0x80)))
+    counts = np.diff(ends[np.concatenate(([0], np.cumsum(lengths)))])
+
+    return _varints(data), counts
+
+
+def _int64(value):
+    """
+    Function used to read a single varint as a (two's complement) int64
+    """
+    return value - (1 << 64) if value >> 63 else value
+
+
+def _zigzag(value):
+    """
+    Function used to decode a single zigzag coded signed varint
+    """
+    return (value >> 1) ^ -(value & 1)
+
+
+def _signed(values):
+    """
+    Function used to decode an array of zigzag coded signed varints
+    """
+    return ((values >> np.uint64(1)).astype(np.int64) ^
+            -(values & np.uint64(1)).astype(np.int64))
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+A static R-tree over bounding boxes, packed with the Sort-Tile-Recursive
+(STR) algorithm and held entirely in NumPy arrays. Every level of the tree is
+an array of node boxes plus the range of children each node covers in the
+level below, so a query is a handful of vectorized box tests, one per level,
+instead of a test of every box.
+
+The boxes are in Mercator world coordinates (longitude and Mercator y, both
+in degrees) rather than on a canvas, so one index serves every canvas size
+and every copy of a Map.
+"""
+
+import numpy as np
+
+
+# Children per node of the tree
+_FANOUT = 64
+
+# Hits are sorted when fewer than 1/_SORT_FRACTION of the items; otherwise they
+# are gathered through a mask
+_SORT_FRACTION = 64
+
+
+class SpatialIndex:
+    def __init__(self, boxes, fanout=_FANOUT):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        boxes : ndarray
+            An Nx4 array of min x, min y, max x, max y per item; items with a
+            NaN box are never found
+        fanout : int
+            The number of children per node
+        """
+        boxes = np.asarray(boxes, dtype=np.float64)
+        items = np.flatnonzero(~np.isnan(boxes).any(axis=1))
+
+        # Bind class variables
+        self._count = len(boxes)
+        self._fanout = fanout
+
+        # The items are the bottom level of the tree; each level above packs
+        # the one below into nodes of up to fanout children, kept as their
+        # boxes and the range of children they cover in the level below
+        order = self._pack(boxes[items])
+        self._items = items[order]
+        level = boxes[self._items]
+        levels = [[level, None, None]]
+
+        while len(level) > 1:
+            n = len(level)
+            starts = np.arange(0, n, fanout)
+            ends = np.minimum(starts + fanout, n)
+            parents = np.empty((len(starts), 4))
+            parents[:, :2] = np.minimum.reduceat(level[:, :2], starts)
+            parents[:, 2:] = np.maximum.reduceat(level[:, 2:], starts)
+
+            order = self._pack(parents)
+            level = parents[order]
+            levels.append([level, starts[order], ends[order]])
+
+        levels.reverse()
+
+        # Renumber the levels from the root down in depth first order, so the
+        # items below any node are a single run of self._items
+        for upper, lower in zip(levels[:-1], levels[1:]):
+            order = _ranges(upper[1], upper[2])
+            lengths = upper[2] - upper[1]
+            upper[1] = np.cumsum(lengths) - lengths
+            upper[2] = upper[1] + lengths
+            lower[:] = [None if a is None else a[order] for a in lower]
+            if lower is levels[-1]:
+                self._items = self._items[order]
+
+        # The run of items below each node
+        first = np.arange(len(self._items))
+        last = first + 1
+        for level in reversed(levels):
+            if level[1] is not None:
+                first, last = first[level[1]], last[level[2] - 1]
+            level.extend((first, last))
+
+        # Each level as its columns of min x, min y, max x, max y, then the
+        # children and the items below its nodes
+        self._levels = [tuple(np.ascontiguousarray(level[0].T)) +
+                        tuple(level[1:]) for level in levels]
+        self._all = np.sort(self._items)
+
+    """
+    ###########################################################################
+                                Properties
+    ###########################################################################
+    """
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def depth(self):
+        return len(self._levels)
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def query(self, x0, y0, x1, y1):
+        """
+        Function used to find the items whose boxes intersect a rectangle
+
+        Parameters:
+        -----------
+        x0, y0, x1, y1 : float
+            The minimum and maximum x and y of the rectangle
+
+        Returns:
+        --------
+        items : ndarray
+            The sorted indices of the intersecting items
+        """
+        # Nodes entirely inside the rectangle contribute their whole run of
+        # items; only the ones straddling its edge are opened up
+        firsts, lasts, nodes = [], [], None
+        for minX, minY, maxX, maxY, starts, ends, first, last in self._levels:
+            if nodes is not None:
+                minX, minY = minX[nodes], minY[nodes]
+                maxX, maxY = maxX[nodes], maxY[nodes]
+                first, last = first[nodes], last[nodes]
+
+            hit = (minX <= x1) & (maxX >= x0) & (minY <= y1) & (maxY >= y0)
+            if starts is None:
+                firsts.append(first[hit])
+                lasts.append(last[hit])
+                break
+
+            inside = (minX >= x0) & (maxX <= x1) & (minY >= y0) & (maxY <= y1)
+            firsts.append(first[inside])
+            lasts.append(last[inside])
+
+            straddling = np.flatnonzero(hit & ~inside)
+            if not len(straddling):
+                break
+            if nodes is not None:
+                straddling = nodes[straddling]
+            nodes = _ranges(starts[straddling], ends[straddling])
+
+        first, last = np.concatenate(firsts), np.concatenate(lasts)
+        if (last - first).sum() == len(self._items):
+            return self._all
+        items = self._items[_ranges(first, last)]
+
+        # Sorting many hits is slower than marking them in a mask over all of
+        # the items
+        if len(items)*_SORT_FRACTION < self._count:
+            return np.sort(items)
+
+        mask = np.zeros(self._count, dtype=bool)
+        mask[items] = True
+
+        return np.flatnonzero(mask)
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _pack(self, boxes):
+        """
+        Private function used to order boxes into STR tiles: the boxes are
+        sorted into vertical slices by their x center, and each slice by y
+        center, so every run of fanout boxes is spatially compact
+
+        Parameters:
+        -----------
+        boxes : ndarray
+            The Nx4 boxes being packed
+
+        Returns:
+        --------
+        order : ndarray
+            The packed order of the boxes
+        """
+        n = len(boxes)
+        nodes = -(-n//self._fanout)
+        slices = int(np.ceil(np.sqrt(nodes)))
+        per = max(slices*self._fanout, 1)
+
+        cx = boxes[:, 0] + boxes[:, 2]
+        cy = boxes[:, 1] + boxes[:, 3]
+
+        order = np.argsort(cx, kind='stable')
+        slab = np.arange(n)//per
+        order = order[np.lexsort((cy[order], slab))]
+
+        return order
+
+
+def _ranges(starts, ends):
+    """
+    Function used to concatenate the integer ranges [start, end)
+
+    Parameters:
+    -----------
+    starts, ends : ndarray
+        The bounds of each range
+
+    Returns:
+    --------
+    <value> : ndarray
+        The ranges' integers, one range after the other
+    """
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+
+    return (np.arange(int(lengths.sum())) +
+            np.repeat(starts - offsets, lengths))
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Web mercator (slippy map) tiles of a Map. At zoom z the world is 2**z tiles
+wide and tall, numbered from the north west corner, and tile z/x/y is the
+x-th column and y-th row.
+
+Every zoom level re-projects the Map once onto a canvas spanning the block of
+tiles that covers the OSM file; a tile is then just that canvas drawn with
+an offset, so its geometry is shared with every other tile of the level.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtGui import QImage, QPainter, QColor
+from PyQt5.QtCore import QRectF, QBuffer, QByteArray, QIODevice
+
+
+# Size of a tile in pixels
+TILE_SIZE = 256
+
+# Deepest zoom level tiles are drawn at
+MAX_ZOOM = 22
+
+# Number of zoom levels whose projected geometry is kept
+_LEVELS = 4
+
+
+def isTile(z, x, y):
+    """
+    Function used to check that z/x/y names a tile of the world at a zoom
+    level tiles are drawn at
+    """
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def tileX(lon, z):
+    """
+    Function used to convert a longitude to a (fractional) tile column
+    """
+    return (lon + 180)/360*2**z
+
+
+def tileY(lat, z):
+    """
+    Function used to convert a latitude to a (fractional) tile row
+    """
+    lat = math.radians(lat)
+    return (1 - math.log(math.tan(lat) + 1/math.cos(lat))/math.pi)/2*2**z
+
+
+def tileLong(x, z):
+    """
+    Function used to convert a tile column to the longitude of its west edge
+    """
+    return x/2**z*360 - 180
+
+
+def tileLat(y, z):
+    """
+    Function used to convert a tile row to the latitude of its north edge
+    """
+    return math.degrees(math.atan(math.sinh(math.pi*(1 - 2*y/2**z))))
+
+
+def encode(image, fmt='PNG'):
+    """
+    Function used to encode a tile in memory
+
+    Parameters:
+    -----------
+    image : QImage
+        The tile
+    fmt : String
+        The image format
+
+    Returns:
+    --------
+    <value> : bytes
+        The encoded tile
+    """
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, fmt)
+    buffer.close()
+
+    return bytes(data)
+
+
+def tileRange(bounds, z):
+    """
+    Function used to find the block of tiles covering an area
+
+    Parameters:
+    -----------
+    bounds : tuple of floats
+        The minimum & maximum latitude and minimum & maximum longitude
+    z : int
+        The zoom level
+
+    Returns:
+    --------
+    x0, x1, y0, y1 : int
+        The first and last tile column and row, inclusive
+    """
+    minLat, maxLat, minLong, maxLong = bounds
+    last = 2**z - 1
+
+    x0 = min(max(int(tileX(minLong, z)), 0), last)
+    x1 = min(max(int(tileX(maxLong, z)), 0), last)
+    y0 = min(max(int(tileY(maxLat, z)), 0), last)
+    y1 = min(max(int(tileY(minLat, z)), 0), last)
+
+    return x0, x1, y0, y1
+
+
+class TilePyramid:
+    def __init__(self, _map, size=TILE_SIZE):
+        """
+        Constructor
+
+        Pen widths are scaled with the zoom level, so that a level showing
+        the map at the size of the Map's own canvas looks like that canvas
+
+        Parameters:
+        -----------
+        _map : Map
+            The map the tiles are drawn from
+        size : int
+            The size of a tile in pixels
+        """
+        t = _map.getTransform()
+
+        # Bind class variables
+        self._map = _map
+        self._size = size
+        self._bounds = (t.minLat, t.maxLat, t.minLong, t.maxLong)
+        self._pixelsPerDegree = (t.width - 2*t.xOffset)/(t.maxLong -
+                                                         t.minLong)
+        self._levels = OrderedDict()
+        self._lock = threading.Lock()
+
+    """
+    ###########################################################################
+                                Properties
+    ###########################################################################
+    """
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def tileCount(self, z):
+        """
+        Function used to get the number of tiles covering the OSM file
+        """
+        x0, x1, y0, y1 = tileRange(self._bounds, z)
+
+        return (x1 - x0 + 1)*(y1 - y0 + 1)
+
+    def tiles(self, z):
+        """
+        Function used to go through the tiles of a zoom level that something
+        is drawn on with the current settings. Tiles only showing the
+        background are left out; this is decided from the features' bounding
+        boxes, not by drawing the tiles
+
+        Parameters:
+        -----------
+        z : int
+            The zoom level
+
+        Returns:
+        --------
+        <value> : generator of tuples
+            The (x, y) of the tiles, row by row
+        """
+        _map, x0, y0 = self._level(z)
+        for top, grid in _map.coverage(self._size):
+            rows, cols = grid.nonzero()
+            yield from zip((cols + x0).tolist(), (rows + top + y0).tolist())
+
+    def render(self, z, x, y):
+        """
+        Function used to draw a single tile. Safe to call from several threads
+        at once
+
+        Parameters:
+        -----------
+        z, x, y : int
+            The tile
+
+        Returns:
+        --------
+        image : QImage | None
+            The tile, or None if it doesn't cover the OSM file
+        """
+        x0, x1, y0, y1 = tileRange(self._bounds, z)
+        if not (x0 <= x <= x1 and y0 <= y <= y1):
+            return None
+
+        _map, x0, y0 = self._level(z)
+        left, top = (x - x0)*self._size, (y - y0)*self._size
+
+        image = QImage(self._size, self._size,
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(QColor(255, 255, 255))
+
+        p = QPainter(image)
+        p.translate(-left, -top)
+        _map.draw(p, rect=QRectF(left, top, self._size, self._size))
+        p.end()
+
+        return image
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _level(self, z):
+        """
+        Private function used to get the Map projected for a zoom level. Its
+        canvas spans the block of tiles covering the OSM file; the few most
+        recently used levels are kept
+
+        Parameters:
+        -----------
+        z : int
+            The zoom level
+
+        Returns:
+        --------
+        _map : Map
+            The projected Map
+        x0, y0 : int
+            The tile at the canvas' top left corner
+        """
+        with self._lock:
+            if z in self._levels:
+                self._levels.move_to_end(z)
+                return self._levels[z]
+
+            x0, x1, y0, y1 = tileRange(self._bounds, z)
+            cols, rows = x1 - x0 + 1, y1 - y0 + 1
+            bounds = (tileLat(y1 + 1, z), tileLat(y0, z), tileLong(x0, z),
+                      tileLong(x1 + 1, z))
+
+            # Tile pixels per degree of longitude relative to the canvas'
+            scale = self._size*2**z/360/self._pixelsPerDegree
+
+            _map = self._map.copy(cols*self._size, rows*self._size, scale,
+                                  bounds)
+            _map.setBatching(self._map.batching)
+
+            self._levels[z] = (_map, x0, y0)
+            if len(self._levels) > _LEVELS:
+                self._levels.popitem(last=False)
+
+            return self._levels[z]
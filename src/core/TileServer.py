@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+A small HTTP server handing out the slippy map tiles of a Map, rendered when
+first requested. Only the standard library is used and nothing is fetched
+from the network.
+
+Rendered tiles are kept in an in-memory LRU cache and, optionally, in a
+folder on disk. Both are keyed by a digest of the configuration and of the
+OSM file's path, size and modification time, so editing the configuration
+file (such as from the GUI) switches the server over to fresh tiles without
+serving any stale ones, and neither does a disk cache left by an older
+version of the OSM file.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from TilePyramid import TilePyramid, encode, isTile
+from configuration import Configuration
+
+
+class TileCache:
+    def __init__(self, size, folder=None):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        size : int
+            The number of tiles kept in memory
+        folder : String | None
+            The folder tiles are also kept in, if any
+        """
+        self._size = size
+        self._folder = folder
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def get(self, key):
+        """
+        Function used to look up a tile
+
+        Parameters:
+        -----------
+        key : tuple
+            The configuration and source digest and the tile's z, x, y
+
+        Returns:
+        --------
+        data : bytes | None
+            The encoded tile, or None if it isn't cached
+        """
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is not None:
+                self._tiles.move_to_end(key)
+                return data
+
+        if self._folder is None:
+            return None
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        self._remember(key, data)
+
+        return data
+
+    def put(self, key, data):
+        """
+        Function used to store a tile
+
+        Parameters:
+        -----------
+        key : tuple
+            See get
+        data : bytes
+            The encoded tile
+
+        Returns:
+        --------
+        """
+        self._remember(key, data)
+
+        if self._folder is None:
+            return
+
+        # Written under another name first so readers never see half a tile
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _remember(self, key, data):
+        """
+        Private function used to add a tile to the memory cache, evicting the
+        least recently used tiles beyond its size
+        """
+        with self._lock:
+            self._tiles[key] = data
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self._size:
+                self._tiles.popitem(last=False)
+
+    def _path(self, key):
+        """
+        Private function used to get the file of a tile in the disk cache
+        """
+        digest, z, x, y = key
+
+        return os.path.join(self._folder, digest, str(z), str(x), '%d.png' % y)
+
+
+class TileServer(ThreadingHTTPServer):
+    def __init__(self, address, _map, fname, threads=4, cache=4096,
+                 folder=None):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        address : tuple
+            The host and port served on, such as ('127.0.0.1', 8000)
+        _map : Map
+            The map the tiles are drawn from; its configuration is replaced
+            whenever the configuration file changes, once no tile is being
+            rendered
+        fname : String
+            The configuration file being watched
+        threads : int
+            The number of tiles rendered at the same time
+        cache : int
+            The number of tiles kept in memory
+        folder : String | None
+            The folder tiles are also cached in, if any
+        """
+        super(TileServer, self).__init__(address, _TileHandler)
+
+        # Bind class variables
+        self._map = _map
+        self._fname = fname
+        self._pyramid = TilePyramid(_map)
+        self._cache = TileCache(cache, folder)
+        self._renderers = threading.BoundedSemaphore(threads)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._busy = 0
+        self._pending = {}
+        self._source = _source(_map.fname)
+        self._stamp = None
+        self._digest = None
+
+        with self._lock:
+            self._reload()
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def digest(self):
+        """
+        Function used to get the digest tiles are currently drawn under,
+        which lets a request be answered from the client's cache without
+        rendering anything
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        digest : String
+            See tile
+        """
+        with self._lock:
+            return self._reload()
+
+    def tile(self, z, x, y):
+        """
+        Function used to get an encoded tile, rendering it if it isn't cached.
+        Concurrent requests for the same tile wait for a single rendering
+
+        Parameters:
+        -----------
+        z, x, y : int
+            The tile, which must pass isTile
+
+        Returns:
+        --------
+        digest : String
+            The digest of the configuration and source the tile was drawn with
+        data : bytes | None
+            The PNG tile, or None if it doesn't cover the OSM file
+        """
+        # The configuration can't change until this request is done with it
+        with self._lock:
+            digest = self._reload()
+            self._busy += 1
+
+        try:
+            return digest, self._tile((digest, z, x, y))
+        finally:
+            with self._lock:
+                self._busy -= 1
+                if not self._busy:
+                    self._idle.notify_all()
+
+    """
+    ###########################################################################
+                                Private Functions
+    ###########################################################################
+    """
+    def _tile(self, key):
+        """
+        Private function used to get an encoded tile under a configuration
+        that is held for the duration of the call
+
+        Parameters:
+        -----------
+        key : tuple
+            See TileCache.get
+
+        Returns:
+        --------
+        data : bytes | None
+            See tile
+        """
+
+        data = self._cache.get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            event = self._pending.get(key)
+            owner = event is None
+            if owner:
+                event = self._pending[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            return self._cache.get(key)
+
+        try:
+            with self._renderers:
+                image = self._pyramid.render(*key[1:])
+
+            if image is None:
+                return None
+
+            data = encode(image)
+            self._cache.put(key, data)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+        return data
+
+    def _reload(self):
+        """
+        Private function used to pick up changes to the configuration file,
+        called with the lock held. The map's configuration is only replaced
+        once the requests using the current one are done, so no tile is ever
+        drawn with a mix of settings; new requests wait for the change. A file
+        that can't be read, such as one the GUI is halfway through writing,
+        leaves the current configuration in place until the next request
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        digest : String
+            The digest of the current configuration and of the source
+        """
+        while True:
+            try:
+                st = os.stat(self._fname)
+                stamp = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamp = None
+
+            if stamp == self._stamp and self._digest is not None:
+                return self._digest
+
+            if not self._busy:
+                break
+
+            self._idle.wait()
+
+        try:
+            config = Configuration(self._fname, persist=False).getConfig()
+        except (OSError, ValueError):
+            if self._digest is None:
+                raise
+            return self._digest
+
+        self._map.getConfiguration().setConfig(config)
+
+        text = json.dumps([config, self._source], sort_keys=True)
+        self._digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+        self._stamp = stamp
+
+        return self._digest
+
+
+def _source(fname):
+    """
+    Function used to describe the version of the OSM file the tiles are drawn
+    from, the way the geometry cache does
+    """
+    stat = os.stat(fname)
+
+    return {'path': os.path.abspath(fname), 'size': stat.st_size,
+            'mtime': stat.st_mtime_ns}
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """
+    Serves /z/x/y.png; other paths are a 404 and tiles outside of the world
+    or beyond the deepest zoom level a 400
+    """
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+
+        try:
+            z, x = int(parts[0]), int(parts[1])
+            if len(parts) != 3 or not parts[2].endswith('.png'):
+                raise ValueError
+            y = int(parts[2][:-4])
+        except (ValueError, IndexError):
+            self.send_error(404, 'Tiles are served as /z/x/y.png')
+            return
+
+        if not isTile(z, x, y):
+            self.send_error(400, 'No such tile')
+            return
+
+        # A tile the client already has isn't rendered again
+        etag = '"%s-%d-%d-%d"' % (self.server.digest(), z, x, y)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        digest, data = self.server.tile(z, x, y)
+        if data is None:
+            self.send_error(404, 'Tile outside of the map')
+            return
+
+        etag = '"%s-%d-%d-%d"' % (digest, z, x, y)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code='-', size='-'):
+        # Tile requests come by the hundred; errors are still logged
+        pass
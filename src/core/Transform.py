@@ -7,6 +7,8 @@ Created on Sun Jun 21 16:39:56 2020
 
 import math
 
+import numpy as np
+
 
 class Transform:
     def __init__(self, minLat, maxLat, minLong, maxLong, width, height):
@@ -38,9 +40,12 @@ class Transform:
         self._xOffset = 0
         self._yOffset = 0
 
+        # The projected bounds are constant, so only compute them once
+        self._maxY, self._minY = self._lat2y(maxLat), self._lat2y(minLat)
+
         # Compute the offset values used to center mismatched dimensions that
         # may be experienced
-        _maxLat, _minLat = self._lat2y(maxLat), self._lat2y(minLat)
+        _maxLat, _minLat = self._maxY, self._minY
         if (maxLong-minLong)/(_maxLat-_minLat) >= width/height:
             h = width*(_maxLat - _minLat)/(maxLong - minLong)
             self._yOffset = (height - h)/2
@@ -95,8 +100,7 @@ class Transform:
         Used to convert a latitude to pixels
         """
         _lat = self._lat2y(lat)
-        _maxLat, _minLat = self._lat2y(self._maxLat), self._lat2y(self._minLat)
-        frac = (_lat - _minLat) / (_maxLat - _minLat)
+        frac = (_lat - self._minY) / (self._maxY - self._minY)
         h = self._height - 2*self._yOffset
         return h - self._yOffset - frac*h
 
@@ -108,6 +112,42 @@ class Transform:
         w = self._width - 2*self._xOffset
         return self._xOffset+frac*w
 
+    def convertLats(self, lats):
+        """
+        Used to convert an array of latitudes to pixels in one pass
+        """
+        _lats = self.mercatorLats(lats)
+        frac = (_lats - self._minY) / (self._maxY - self._minY)
+        h = self._height - 2*self._yOffset
+        return h - self._yOffset - frac*h
+
+    def convertLongs(self, longs):
+        """
+        Used to convert an array of longitudes to pixels in one pass
+        """
+        frac = (np.asarray(longs) - self._minLong) / (self._maxLong -
+                                                      self._minLong)
+        w = self._width - 2*self._xOffset
+        return self._xOffset+frac*w
+
+    def mercatorLats(self, lats):
+        """
+        Used to convert an array of latitudes to Mercator y, in degrees. The
+        canvas is a scaled and shifted copy of longitude and Mercator y
+        """
+        return 180/np.pi*np.log(np.tan(np.pi/4+np.asarray(lats)*np.pi/180/2))
+
+    def canvasToMercator(self, x, y):
+        """
+        Used to convert a canvas point back to longitude and Mercator y
+        """
+        w = self._width - 2*self._xOffset
+        h = self._height - 2*self._yOffset
+        long = self._minLong + (x - self._xOffset)/w*(self._maxLong -
+                                                       self._minLong)
+        _lat = self._minY + (h - self._yOffset - y)/h*(self._maxY - self._minY)
+        return long, _lat
+
     """
     ###########################################################################
                                 Private Functions
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of OSM XML elements into the NodeStore and FeatureStores, and the
+parallel ingestion of large XML files.
+
+Every top level element of an OSM file (bounds, node, way, relation) stands
+on its own, so a file may be cut into byte ranges at the starts of top level
+elements and each range parsed as a document of its own. The ranges are
+parsed by a process pool into their own stores, which are then merged in
+file order. Comments and CDATA sections between elements may hide what looks
+like an element start; a range cut inside one doesn't parse, and the file is
+then left to be parsed whole.
+"""
+
+import io
+import os
+import re
+import multiprocessing as mp
+import xml.etree.ElementTree as ET
+
+from NodeStore import NodeStore
+from FeatureStore import FeatureStore, Way, Relation
+
+
+# The top level elements we ingest
+_ELEMENTS = ('node', 'way', 'relation', 'bounds')
+
+# The start of a top level element. A '<' is always markup in OSM files (it
+# is escaped in attribute values), so this never matches inside an element,
+# but it may inside a comment or CDATA section
+_ELEMENT_START = re.compile(rb'<(?:bounds|node|way|relation)[\s/>]')
+
+# The end of an OSM document
+_DOCUMENT_END = b'</osm>'
+
+# Bytes searched at a time for an element start or the document end
+_WINDOW = 64*1024
+
+# Ranges parsed per process, so a slow range doesn't hold up the others
+_RANGES_PER_PROCESS = 4
+
+# Smallest range worth giving to a process
+_MIN_RANGE = 8*1024*1024
+
+
+def ingest(child, bounds, nodes, ways, relations):
+    """
+    Function used to convert a single top level OSM element into our own
+    storage
+
+    Parameters:
+    -----------
+    child : Element
+        The top level XML element (node, way, relation, bounds)
+    bounds : tuple of floats | None
+        The bounds, once they have been read
+    nodes : NodeStore | None
+        The store receiving converted Nodes; None skips them
+    ways, relations : FeatureStore | None
+        The stores receiving converted Ways and Relations; None skips them
+
+    Returns:
+    --------
+    bounds : tuple of floats | None
+        The (possibly newly read) bounds
+    """
+    if child.tag == 'node':
+        if nodes is not None:
+            attrib = child.attrib
+            nodes.append(int(attrib['id']), float(attrib['lon']),
+                         float(attrib['lat']))
+    elif child.tag == 'way':
+        if ways is not None:
+            ways.append(int(child.attrib['id']), *_children(child))
+    elif child.tag == 'relation':
+        if relations is not None:
+            relations.append(int(child.attrib['id']), *_children(child))
+    elif child.tag == 'bounds':
+        bounds = (float(child.attrib['minlat']),
+                  float(child.attrib['maxlat']),
+                  float(child.attrib['minlon']),
+                  float(child.attrib['maxlon']))
+
+    return bounds
+
+
+def stream(f, nodes, ways, relations):
+    """
+    Function used to ingest an OSM document one top level element at a time.
+    Each element is discarded as soon as it has been converted, so memory is
+    bounded by our own objects rather than the XML tree
+
+    Parameters:
+    -----------
+    f : file
+        The binary file object of the XML
+    nodes, ways, relations : NodeStore | FeatureStore | None
+        See ingest
+
+    Returns:
+    --------
+    bounds : tuple of floats | None
+        The bounds, if the document has any
+    """
+    bounds = None
+
+    context = ET.iterparse(f, events=('start', 'end'))
+    _, root = next(context)
+
+    for event, elem in context:
+        # Children (nd, tag, member) are consumed by their parent element
+        if event == 'start' or elem.tag not in _ELEMENTS:
+            continue
+
+        bounds = ingest(elem, bounds, nodes, ways, relations)
+
+        # Drop the consumed element and anything the root still holds
+        root.clear()
+
+    return bounds
+
+
+def split(fname, count):
+    """
+    Function used to cut an OSM file into byte ranges of roughly equal size,
+    each starting at a top level element. The header before the first element
+    and the closing tag of the document are left out
+
+    Parameters:
+    -----------
+    fname : String
+        The (uncompressed) OSM file name
+    count : int
+        The number of ranges wanted
+
+    Returns:
+    --------
+    ranges : list of tuples
+        The start and end offset of each range, in file order; there may be
+        fewer ranges than wanted
+    """
+    size = os.path.getsize(fname)
+
+    with open(fname, 'rb') as f:
+        # The document end is searched for backwards from the end of the file
+        f.seek(max(size - _WINDOW, 0))
+        tail = f.read()
+        end = tail.rfind(_DOCUMENT_END)
+        end = size if end < 0 else size - len(tail) + end
+
+        starts = []
+        for i in range(count):
+            start = _elementStart(f, size*i//count, end)
+            if start is not None and (not starts or start > starts[-1]):
+                starts.append(start)
+
+    return list(zip(starts, starts[1:] + [end]))
+
+
+def read(fname, processes=None, stores=None):
+    """
+    Function used to ingest an OSM XML file in ranges parsed by a pool of
+    processes
+
+    Parameters:
+    -----------
+    fname : String
+        The (uncompressed) OSM file name
+    processes : int | None
+        The number of processes parsing ranges; defaults to one per core
+    stores : tuple | None
+        The NodeStore and the Way and Relation FeatureStores filled, any of
+        which may be None to skip those elements; new stores by default
+
+    Returns:
+    --------
+    bounds : tuple of floats | None
+        The minimum & maximum latitude and minimum & maximum longitude, if the
+        file has a bounds element
+    nodes : NodeStore
+        The Node IDs and coordinates
+    ways : FeatureStore
+        The Ways
+    relations : FeatureStore
+        The Relations
+
+    or None if a range doesn't parse on its own, such as when it was cut
+    inside a comment; the stores are then emptied again
+    """
+    processes = processes or os.cpu_count() or 1
+
+    # Pool workers are daemons, which can't have processes of their own
+    if mp.current_process().daemon:
+        processes = 1
+
+    count = min(processes*_RANGES_PER_PROCESS,
+                os.path.getsize(fname)//_MIN_RANGE)
+    if stores is None:
+        stores = (NodeStore(), FeatureStore(Way), FeatureStore(Relation))
+    nodes, ways, relations = stores
+
+    # The workers only parse the kinds of elements that are kept
+    kinds = tuple(store is not None for store in stores)
+    jobs = [(fname, start, end, kinds)
+            for start, end in split(fname, max(count, 1))]
+
+    bounds = None
+
+    # Workers are spawned rather than forked, as the caller may have threads
+    # running, such as Qt's
+    pool = None
+    if processes > 1 and len(jobs) > 1:
+        pool = mp.get_context('spawn').Pool(min(processes, len(jobs)))
+
+    try:
+        parts = (pool.imap(_parseRange, jobs) if pool is not None else
+                 map(_parseRange, jobs))
+
+        # The ranges are merged in file order as they arrive, so the
+        # features keep the order they have in the file and no more than a
+        # part is held besides the merged stores
+        for part in parts:
+            if part is None:
+                for store in stores:
+                    if store is not None:
+                        store.clear()
+                return None
+
+            bounds = bounds or part[0]
+            for store, new in zip(stores, part[1:]):
+                if store is not None:
+                    store.merge(new)
+            del part, new
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return bounds, nodes, ways, relations
+
+
+def _parseRange(job):
+    """
+    Function used to parse a single byte range of an OSM file into stores of
+    its own. Runs in the worker processes
+
+    Parameters:
+    -----------
+    job : tuple
+        The OSM file name, the start and end offset of the range and whether
+        Nodes, Ways and Relations are kept
+
+    Returns:
+    --------
+    See read; the stores are not frozen, and None is returned if the range
+    doesn't parse
+    """
+    fname, start, end, kinds = job
+
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    nodes = NodeStore() if kinds[0] else None
+    ways = FeatureStore(Way) if kinds[1] else None
+    relations = FeatureStore(Relation) if kinds[2] else None
+
+    # The range is a run of top level elements; wrapped in a root element
+    # it is a document of its own
+    document = io.BytesIO(b'<osm>' + data + _DOCUMENT_END)
+    del data
+    try:
+        bounds = stream(document, nodes, ways, relations)
+    except ET.ParseError:
+        return None
+
+    return bounds, nodes, ways, relations
+
+
+def _elementStart(f, pos, end):
+    """
+    Function used to find the first top level element starting at or after
+    an offset
+
+    Parameters:
+    -----------
+    f : file
+        The OSM file, opened in binary mode
+    pos : int
+        The offset searched from
+    end : int
+        The offset searched up to
+
+    Returns:
+    --------
+    <value> : int | None
+        The offset of the element, or None if there is none before end
+    """
+    while pos < end:
+        # Windows overlap by a few bytes so an element start cut by the end
+        # of one window is found in the next
+        f.seek(pos)
+        window = f.read(min(_WINDOW, end - pos))
+        match = _ELEMENT_START.search(window)
+        if match:
+            return pos + match.start()
+        pos += max(len(window) - 16, 1)
+
+    return None
+
+
+def _children(parent):
+    """
+    Function used to read the members and tags of a Way or Relation element.
+    Ways list their Nodes (nd) and Relations their members, of which we only
+    keep the Ways
+
+    Parameters:
+    -----------
+    parent : Element
+        The way or relation XML element
+
+    Returns:
+    --------
+    refs : list of ints
+        The member IDs, in order
+    tags : dict
+        The element's tags
+    """
+    refs = []
+    tags = {}
+
+    for child in parent:
+        if child.tag == 'nd' or (child.tag == 'member' and
+                                 child.attrib['type'] == 'way'):
+            refs.append(int(child.attrib['ref']))
+        elif child.tag == 'tag':
+            tags[child.attrib['k']] = child.attrib['v']
+
+    return refs, tags
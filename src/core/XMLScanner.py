@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+A fast reader of OSM XML files written one element per line, as the OSM
+export and the Overpass API write them:
+
+    <node id="1" visible="true" version="1" lat="40.1" lon="-75.1"/>
+    <way id="2" visible="true" version="1">
+     <nd ref="1"/>
+     <tag k="highway" v="residential"/>
+    </way>
+
+The file is memory mapped and the attributes we need are pulled out of the
+bytes a window of the file at a time: the quotes of every attribute value are
+found with NumPy, the values of each attribute are picked by the bytes before
+their quotes and numbers are converted a column of digits at a time, straight
+into arrays. No XML element objects are built.
+
+The scanner is only correct for files of that layout: all of the Nodes, then
+all of the Ways, then all of the Relations, attributes in the usual order and
+quoted with double quotes, and no comments, CDATA or entity declarations.
+Anything else is detected (mostly by comparing how many values were found
+with how many element starts there are, and by looking for elements of the
+other sections in each section) and reported by returning None, so the
+caller can use the XML parser instead.
+"""
+
+import re
+import html
+import mmap
+
+import numpy as np
+
+from NodeStore import NodeStore
+from FeatureStore import FeatureStore, Way, Relation
+
+import constants as c
+
+
+# Bytes scanned at a time; windows end at an element start
+_WINDOW = 16*1024*1024
+
+# The start of comments, CDATA, DOCTYPE and entity declarations, which the
+# scanner doesn't understand anywhere in the file
+_UNSUPPORTED = b'<!'
+
+# Most digits of a number; more might not convert exactly
+_MAX_DIGITS = 15
+
+# Bytes the numbers are made of and the values are delimited by
+_QUOTE, _EQUALS, _MINUS, _DOT, _ZERO = b'"=-.0'
+
+# The starts of the top level elements, in the order of their sections. No
+# other OSM element starts with any of them
+_ELEMENTS = (b'<node', b'<way', b'<relation')
+
+# Bytes before a value compared to an attribute's name
+_PREFIX = 8
+
+# What precedes the values of a Node's ID, latitude and longitude
+_NODE_ATTRIBUTES = (b'<node id=', b' lat=', b' lon=')
+
+_ENCODING = re.compile(rb'<\?xml[^>]*encoding="([^"]*)"')
+_BOUND = re.compile(rb'\b(minlat|maxlat|minlon|maxlon)="([^"]*)"')
+_RELATION = re.compile(rb'<relation id="(-?\d+)"')
+_MEMBER = re.compile(rb'<member type="(\w+)" ref="(-?\d+)"')
+
+# Only the tags of the keys we render are read
+_TAG = re.compile(rb'<tag k="(' + b'|'.join(re.escape(key.encode()) for key
+                                            in c.DATA_GROUPS) +
+                  rb')" v="([^"]*)"')
+
+
+def read(fname):
+    """
+    Function used to read an OSM XML file into (unfrozen) stores
+
+    Parameters:
+    -----------
+    fname : String
+        The (uncompressed) OSM file name
+
+    Returns:
+    --------
+    <value> : tuple | None
+        The bounds (or None), NodeStore, Way FeatureStore and Relation
+        FeatureStore of the file, or None if the file isn't laid out the
+        way the scanner expects
+    """
+    with open(fname, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            return None
+
+    try:
+        return _scan(mm)
+    finally:
+        mm.close()
+
+
+def _scan(mm):
+    """
+    Function used to read the memory mapped file
+
+    Parameters:
+    -----------
+    mm : mmap
+        The OSM file
+
+    Returns:
+    --------
+    See read
+    """
+    if mm.find(_UNSUPPORTED) >= 0:
+        return None
+
+    encoding = _ENCODING.match(mm[:1024])
+    if encoding and encoding.group(1).lower() not in (b'utf-8', b'utf8'):
+        return None
+
+    start, end = mm.find(b'<osm'), mm.rfind(b'</osm>')
+    if start < 0 or end < start:
+        return None
+
+    # The sections of each element type must follow one another
+    sections = []
+    for marker in _ELEMENTS:
+        pos = mm.find(marker, start, end)
+        sections.append(end if pos < 0 else pos)
+    if sections != sorted(sections):
+        return None
+
+    bounds = _bounds(mm[start:sections[0]])
+    nodes = NodeStore()
+    ways = FeatureStore(Way)
+    relations = FeatureStore(Relation)
+
+    limits = sections + [end]
+    readers = ((_nodes, nodes), (_ways, ways), (_relations, relations))
+    for k, (reader, store) in enumerate(readers):
+        others = _ELEMENTS[:k] + _ELEMENTS[k + 1:]
+        for s, e in _windows(mm, limits[k], limits[k + 1], _ELEMENTS[k]):
+            data = mm[s:e]
+
+            # An element of another type within a section, such as a Node
+            # after the first Way, means the sections are interleaved
+            if any(other in data for other in others):
+                return None
+            if not reader(data, store):
+                return None
+
+    return bounds, nodes, ways, relations
+
+
+def _windows(mm, start, end, marker):
+    """
+    Function used to cut a section of the file into windows of about
+    _WINDOW bytes, each ending where an element starts
+
+    Parameters:
+    -----------
+    mm : mmap
+        The OSM file
+    start, end : int
+        The section's offsets
+    marker : bytes
+        The start of the section's elements
+
+    Returns:
+    --------
+    <value> : generator of tuples
+        The start and end offset of each window
+    """
+    pos = start
+    while pos < end:
+        cut = mm.find(marker, min(pos + _WINDOW, end), end)
+        if cut < 0:
+            cut = end
+        yield pos, cut
+        pos = cut
+
+
+def _bounds(data):
+    """
+    Function used to read the bounds element of the file's header, if any
+
+    Returns:
+    --------
+    <value> : tuple of floats | None
+        The minimum & maximum latitude and minimum & maximum longitude
+    """
+    pos = data.find(b'<bounds')
+    if pos < 0:
+        return None
+
+    element = data[pos:data.find(b'>', pos)]
+    values = {k.decode(): float(v) for k, v in _BOUND.findall(element)}
+    if len(values) != 4:
+        return None
+
+    return (values['minlat'], values['maxlat'], values['minlon'],
+            values['maxlon'])
+
+
+def _nodes(data, nodes):
+    """
+    Function used to read a window of Nodes
+
+    Parameters:
+    -----------
+    data : bytes
+        The window
+    nodes : NodeStore
+        The store receiving the Nodes
+
+    Returns:
+    --------
+    <value> : boolean
+        False if the window holds a Node the scanner can't read
+    """
+    a = np.frombuffer(data, dtype=np.uint8)
+    values = _values(a)
+    if values is None:
+        return False
+
+    count = data.count(b'<node')
+    found = [_attribute(values, name) for name in _NODE_ATTRIBUTES]
+    if any(len(opens) != count for opens, _ in found):
+        return False
+
+    # Every Node must have its own id, lat and lon, in that order
+    (ids, _), (lat, _), (lon, _) = found
+    if not ((ids < lat).all() and (lat < lon).all() and
+            (lon[:-1] < ids[1:]).all()):
+        return False
+
+    ids, lat, lon = (_number(a, opens, closes, integer=name == b'<node id=')
+                     for (opens, closes), name in zip(found,
+                                                      _NODE_ATTRIBUTES))
+    if ids is None or lat is None or lon is None:
+        return False
+
+    nodes.extend(ids, lon, lat)
+
+    return True
+
+
+def _ways(data, ways):
+    """
+    Function used to read a window of Ways
+
+    Parameters:
+    -----------
+    data : bytes
+        The window
+    ways : FeatureStore
+        The store receiving the Ways
+
+    Returns:
+    --------
+    <value> : boolean
+        False if the window holds a Way the scanner can't read
+    """
+    a = np.frombuffer(data, dtype=np.uint8)
+    values = _values(a)
+    if values is None:
+        return False
+
+    starts, ends = _attribute(values, b'<way id=')
+    opens, closes = _attribute(values, b'<nd ref=')
+    if (len(starts) != data.count(b'<way') or
+            len(opens) != data.count(b'<nd') or
+            data.count(b'<tag') != data.count(b'<tag k="')):
+        return False
+
+    ids = _number(a, starts, ends, integer=True)
+    refs = _number(a, opens, closes, integer=True)
+    if ids is None or refs is None:
+        return False
+
+    # Each Node ID belongs to the last Way started before it
+    counts = np.bincount(np.searchsorted(starts, opens) - 1,
+                         minlength=len(starts))
+
+    ways.extend(ids, counts, refs, _tags(data, starts))
+
+    return True
+
+
+def _relations(data, relations):
+    """
+    Function used to read a window of Relations. Relations are few, so they
+    are simply matched with regular expressions
+
+    Parameters:
+    -----------
+    data : bytes
+        The window
+    relations : FeatureStore
+        The store receiving the Relations
+
+    Returns:
+    --------
+    <value> : boolean
+        False if the window holds a Relation the scanner can't read
+    """
+    features = list(_RELATION.finditer(data))
+    members = list(_MEMBER.finditer(data))
+    # The XML parser would take Node references for members as well
+    if (len(features) != data.count(b'<relation') or
+            len(members) != data.count(b'<member') or
+            data.count(b'<tag') != data.count(b'<tag k="') or
+            b'<nd' in data):
+        return False
+
+    starts = np.array([m.start() for m in features], dtype=np.int64)
+    ids = np.array([int(m.group(1)) for m in features], dtype=np.int64)
+
+    # Only the Way members are kept
+    members = [m for m in members if m.group(1) == b'way']
+    refs = np.array([int(m.group(2)) for m in members], dtype=np.int64)
+    owners = np.searchsorted(starts, [m.start() for m in members]) - 1
+    counts = np.bincount(owners.astype(np.int64), minlength=len(starts))
+
+    relations.extend(ids, counts, refs, _tags(data, starts))
+
+    return True
+
+
+def _tags(data, starts):
+    """
+    Function used to read the kept tags of a window of Ways or Relations
+
+    Parameters:
+    -----------
+    data : bytes
+        The window
+    starts : ndarray
+        Where each feature starts in the window
+
+    Returns:
+    --------
+    tags : list of dicts
+        The kept tags of each feature
+    """
+    found = list(_TAG.finditer(data))
+    owners = np.searchsorted(starts, [m.start() for m in found]) - 1
+
+    tags = [{} for _ in range(len(starts))]
+    for i, m in zip(owners.tolist(), found):
+        value = m.group(2).decode()
+        if '&' in value:
+            value = html.unescape(value)
+        tags[i][m.group(1).decode()] = value
+
+    return tags
+
+
+def _values(a):
+    """
+    Function used to find every attribute value of a window. Values are
+    quoted with double quotes, which can't appear inside them (they are
+    escaped), so the quotes simply alternate between opening and closing
+
+    Parameters:
+    -----------
+    a : ndarray
+        The window's bytes
+
+    Returns:
+    --------
+    <value> : tuple of ndarrays | None
+        The positions of the opening and closing quotes and the _PREFIX bytes
+        before each opening quote as a little endian integer (0 if the value
+        is too close to the start of the window), or None if the quotes don't
+        pair up as attribute values
+    """
+    quotes = np.flatnonzero(a == _QUOTE)
+    if len(quotes) % 2:
+        return None
+
+    opens, closes = quotes[0::2], quotes[1::2]
+    if len(opens) and (opens[0] == 0 or (a[opens - 1] != _EQUALS).any()):
+        return None
+
+    # Every run of _PREFIX bytes of the window, read as one integer, so the
+    # bytes before all of the values are gathered at once
+    prefixes = np.zeros(len(opens), dtype=np.uint64)
+    if len(a) >= _PREFIX:
+        runs = np.ndarray(len(a) - _PREFIX + 1, dtype='<u8', buffer=a,
+                          strides=(1,))
+        first = np.searchsorted(opens, _PREFIX)
+        prefixes[first:] = runs[opens[first:] - _PREFIX]
+
+    return opens, closes, prefixes
+
+
+def _attribute(values, name):
+    """
+    Function used to pick the values of one attribute out of a window's
+    values
+
+    Parameters:
+    -----------
+    values : tuple of ndarrays
+        The opening and closing quotes and the prefixes of every value
+    name : bytes
+        What must precede the opening quote, such as b' lat='; only its last
+        _PREFIX bytes are compared
+
+    Returns:
+    --------
+    opens, closes : ndarray
+        The opening and closing quotes of the attribute's values
+    """
+    opens, closes, prefixes = values
+    name = name[-_PREFIX:]
+
+    # The last byte before the quote is the most significant one, so the
+    # bytes of a shorter name are the top of the prefix
+    shift = np.uint64(8*(_PREFIX - len(name)))
+    match = (prefixes >> shift) == np.uint64(int.from_bytes(name, 'little'))
+
+    return opens[match], closes[match]
+
+
+def _number(a, opens, closes, integer=False):
+    """
+    Function used to convert quoted decimal numbers to an array at once, a
+    column of digits at a time
+
+    Floats are converted exactly like float() does: the digits form an
+    integer below 2**53 and the power of ten is exact, so their quotient is
+    the correctly rounded value of the decimal
+
+    Parameters:
+    -----------
+    a : ndarray
+        The window's bytes
+    opens, closes : ndarray
+        The opening and closing quotes of the numbers
+    integer : boolean
+        True for int64 IDs, False for float64 coordinates
+
+    Returns:
+    --------
+    <value> : ndarray | None
+        The numbers, or None if one of them can't be converted this way
+    """
+    widths = closes - opens - 1
+    if not len(widths):
+        return np.empty(0, dtype=np.int64 if integer else np.float64)
+    if widths.min() < 1 or widths.max() > _MAX_DIGITS + 2:
+        return None
+
+    columns = np.arange(widths.max())
+    chars = a[np.minimum(opens[:, None] + 1 + columns, len(a) - 1)]
+    chars = np.where(columns < widths[:, None], chars, 0)
+
+    negative = chars[:, 0] == _MINUS
+    chars[negative, 0] = 0
+    digits = (chars >= _ZERO) & (chars <= _ZERO + 9)
+    dots = chars == _DOT
+
+    count = digits.sum(axis=1)
+    if (not (digits | dots | (chars == 0)).all() or
+            dots.sum(axis=1).max() > (0 if integer else 1) or
+            count.min() < 1 or count.max() > _MAX_DIGITS):
+        return None
+
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    for column in range(len(columns)):
+        digit = digits[:, column]
+        mantissa = np.where(digit, mantissa*10 + chars[:, column] - _ZERO,
+                            mantissa)
+    mantissa[negative] *= -1
+
+    if integer:
+        return mantissa
+
+    decimals = (digits & (np.cumsum(dots, axis=1) > 0)).sum(axis=1)
+
+    return mantissa/10.0**decimals
@@ -18,11 +18,21 @@ import constants as c
 
 
 class Configuration:
-    def __init__(self, fname=c.FILE_CONFIG):
+    def __init__(self, fname=c.FILE_CONFIG, persist=True):
         """
         Constructor for the user configuration file initialization
+
+        Parameters:
+        -----------
+        fname : String
+            The configuration file
+        persist : boolean
+            False to never write the file back, such as when many renderers
+            read the same configuration at once; changes then only live in
+            this instance
         """
         self._fname = fname
+        self._persist = persist
 
         if os.path.exists(fname):
             # When reading the config, we read the objects into the init fields
@@ -928,6 +938,9 @@ class Configuration:
         Returns:
         --------
         """
+        if not self._persist:
+            return
+
         # Write to file
         with open(self._fname, 'w') as outfile:
             json.dump(self._config, outfile)
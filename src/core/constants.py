@@ -26,6 +26,7 @@ FOLDER_DATA = 'data'
 FOLDER_OUTPUT = 'output'
 FOLDER_CONFIGS = 'configs'
 FOLDER_USER_CONFIGS = 'configs/user'
+FOLDER_CACHE = 'cache'
 FILE_ICON = 'src/resources/icon.png'
 FILE_CONFIG = 'user.config'
 
@@ -44,6 +45,11 @@ DICT_QPEN_JOIN = {Qt.BevelJoin:         'Bevel Join',
                   Qt.RoundJoin:         'Round Join'}
 
 
+# Geometry cache; bump the version whenever the parser, the stored layout or
+# what a load keeps changes, so snapshots written by older code are rebuilt
+CACHE_VERSION = 2
+
+
 # OSM File Features
 COPYRIGHT = 'OpenStreetMap and contributors'
 ATTRIBUTION = 'http://www.openstreetmap.org/copyright'
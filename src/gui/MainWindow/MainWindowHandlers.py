@@ -80,6 +80,7 @@ class MainWindowHandlers(QMainWindow):
         # the map widget
         self._setButtonColor(self._btn_bg_color, color)
         self._config.setValue(c.CONFIG_BG_COLOR, color)
+        self._map.redraw()
 
     def lineColorBtnClicked(self):
         """
@@ -95,10 +96,11 @@ class MainWindowHandlers(QMainWindow):
         if not color.isValid():
             return
 
-        # Update the config file, button color
+        # Update the config file, button color, and the map
         pen.setColor(color)
         self._setButtonColor(self._btn_line, color)
         self._config.setValue(c.DATA_GROUPS[ptext][text], pen)
+        self._map.redraw()
 
     def lineWidthChanged(self, value):
         """
@@ -111,7 +113,7 @@ class MainWindowHandlers(QMainWindow):
         # Update the pen, map, and the config file
         pen.setWidthF(value)
         self._config.setValue(c.DATA_GROUPS[ptext][text], pen)
-        self._map.update()
+        self._map.redraw()
 
     def lineComboChanged(self, value):
         """
@@ -126,7 +128,7 @@ class MainWindowHandlers(QMainWindow):
                                  list(c.DICT_QPEN_STYLE.values()).index(value)]
         pen.setStyle(lStyle)
         self._config.setValue(c.DATA_GROUPS[ptext][text], pen)
-        self._map.update()
+        self._map.redraw()
 
     def capComboChanged(self, value):
         """
@@ -141,7 +143,7 @@ class MainWindowHandlers(QMainWindow):
                                    list(c.DICT_QPEN_CAP.values()).index(value)]
         pen.setCapStyle(cStyle)
         self._config.setValue(c.DATA_GROUPS[ptext][text], pen)
-        self._map.update()
+        self._map.redraw()
 
     def joinComboChanged(self, value):
         """
@@ -151,11 +153,12 @@ class MainWindowHandlers(QMainWindow):
         text, ptext = item.text(0), item.parent().text(0)
         pen = self._config.getValue(c.DATA_GROUPS[ptext][text])
 
-        # Update the pen and the config file
+        # Update the pen, map, and the config file
         jStyle = list(c.DICT_QPEN_JOIN.keys())[
                                   list(c.DICT_QPEN_JOIN.values()).index(value)]
         pen.setJoinStyle(jStyle)
         self._config.setValue(c.DATA_GROUPS[ptext][text], pen)
+        self._map.redraw()
 
     def fillColorBtnClicked(self):
         """
@@ -170,9 +173,10 @@ class MainWindowHandlers(QMainWindow):
         if not color.isValid():
             return
 
-        # Update the config file, button color
+        # Update the config file, button color, and the map
         self._setButtonColor(self._btn_fill, color)
         self._config.setValue(c.DATA_GROUPS[ptext][text], color)
+        self._map.redraw()
 
     def checkboxChanged(self, item, idx):
         """
@@ -187,14 +191,16 @@ class MainWindowHandlers(QMainWindow):
             self._config.setItemState(c.DATA_GROUPS[ptext][text], state)
 
             # Update the map
-            self._map.update()
+            self._map.redraw()
 
     def loadOSMFile(self):
         """
         The user has clicked the button to load an OSM file
         """
         fileName, _ = QFileDialog.getOpenFileName(
-                  self, 'Open OSM File', 'data', 'OpenStreetMap Files (*.osm)')
+                  self, 'Open OSM File', 'data',
+                  'OpenStreetMap Files (*.osm *.osm.pbf *.osm.gz *.osm.bz2 '
+                  '*.osm.xz)')
 
         if not fileName:
             return
@@ -221,7 +227,7 @@ class MainWindowHandlers(QMainWindow):
         self.fillSelChanged()
 
         # Update the map
-        self._map.update()
+        self._map.redraw()
 
     def saveImage(self):
         """
@@ -255,7 +261,7 @@ class MainWindowHandlers(QMainWindow):
         self.fillSelChanged()
 
         # Update the map
-        self._map.update()
+        self._map.redraw()
 
     def loadSettingsClicked(self):
         """
@@ -280,7 +286,7 @@ class MainWindowHandlers(QMainWindow):
             self.fillSelChanged()
 
             # Update the map
-            self._map.update()
+            self._map.redraw()
 
     def lineSelChanged(self):
         """
@@ -7,11 +7,31 @@ Created on Tue Jun 23 18:44:56 2020
 
 
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QPainter
+from PyQt5.QtGui import QPainter, QTransform, QColor
+from PyQt5.QtCore import Qt, QThreadPool, QPointF, QTimer
 
 import constants as c
 from Map import Map
-from painter import Painter
+from rendertask import RenderTask
+
+
+# Zoom factor of one notch of the mouse wheel
+_WHEEL_ZOOM = 1.25
+
+# Deepest zoom into the map, relative to showing all of it
+_MAX_ZOOM = 256
+
+# Seconds a draft frame may take while the map is being edited or moved
+_FRAME_BUDGET = 0.030
+
+# Milliseconds without new edits after which the full quality frame is drawn
+_SETTLE_MS = 300
+
+# The detail of the first draft, and the range the detail is tuned within:
+# the simplification tolerance and smallest feature drawn, in pixels
+_DRAFT_DETAIL = (1, 1)
+_DRAFT_MIN = (0.25, 0.25)
+_DRAFT_MAX = (16, 64)
 
 
 class MapWidget(QWidget):
@@ -25,6 +45,30 @@ class MapWidget(QWidget):
         self._config = None
         self._map = None
 
+        # Frames are rendered one at a time off the GUI thread; the latest
+        # completed frame is what gets painted
+        self._frame = None
+        self._frameView = QTransform()
+        self._generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+        # The zoom and pan, mapping the map's canvas onto the widget, and the
+        # mouse position and view a drag started from
+        self._view = QTransform()
+        self._drag = None
+
+        # While edits keep coming, draft frames are drawn with a detail tuned
+        # to fit the frame budget; once they settle, the full quality frame
+        self._adaptive = True
+        self._draft = _DRAFT_DETAIL
+        self._drafting = None
+        self._deferred = False
+        self._settle = QTimer(self)
+        self._settle.setSingleShot(True)
+        self._settle.setInterval(_SETTLE_MS)
+        self._settle.timeout.connect(self._refine)
+
     """
     ###########################################################################
                                 Built-In Functions
@@ -39,11 +83,66 @@ class MapWidget(QWidget):
         p = QPainter()
         p.begin(self)
 
-        # Draw the map only if a map instance exists
-        if self._map is not None:
-            self._map.draw(p)
-        else:
+        # Draw the map only if a map instance exists; until its first frame
+        # is ready, let the user know it's on its way
+        if self._map is None:
             self._drawPreloadScreen(p)
+        elif self._frame is None:
+            self._drawPreloadScreen(p, 'Rendering...')
+        else:
+            # Until the frame for the current view arrives, the last frame is
+            # moved and scaled to where its contents now are
+            if self._frameView != self._view:
+                p.fillRect(self.rect(), QColor(255, 255, 255))
+                p.setRenderHint(p.SmoothPixmapTransform)
+                p.setTransform(self._frameView.inverted()[0]*self._view)
+            p.drawImage(0, 0, self._frame)
+
+    def wheelEvent(self, event):
+        """
+        Zoom in or out around the mouse cursor
+        """
+        zoom = self._view.m11()
+        newZoom = zoom*_WHEEL_ZOOM**(event.angleDelta().y()/120)
+        newZoom = min(max(newZoom, 1), _MAX_ZOOM)
+
+        # Keep the canvas point under the cursor where it is
+        pos = QPointF(event.pos())
+        point = self._view.inverted()[0].map(pos)
+        self._setView(newZoom, pos.x() - newZoom*point.x(),
+                      pos.y() - newZoom*point.y())
+
+    def mousePressEvent(self, event):
+        """
+        Start dragging the map around
+        """
+        if event.button() == Qt.LeftButton:
+            self._drag = (QPointF(event.pos()), QTransform(self._view))
+
+    def mouseMoveEvent(self, event):
+        """
+        Pan the map with the mouse
+        """
+        if self._drag is None:
+            return
+
+        start, view = self._drag
+        delta = QPointF(event.pos()) - start
+        self._setView(view.m11(), view.dx() + delta.x(),
+                      view.dy() + delta.y())
+
+    def mouseReleaseEvent(self, event):
+        """
+        Stop dragging the map around
+        """
+        if event.button() == Qt.LeftButton:
+            self._drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        """
+        Show the whole map again
+        """
+        self._setView(1, 0, 0)
 
     """
     ###########################################################################
@@ -78,47 +177,217 @@ class MapWidget(QWidget):
         --------
         """
         self._map = Map(self.width(), self.height(), fname, self._config)
-        self.update()
+        self._map.setLayered(True)
+        self._frame = None
+        self._view = QTransform()
 
-    def saveImage(self, max_dim, fname):
+        # Nothing is being edited yet, so there's no point in a draft
+        self._render()
+
+    def redraw(self):
         """
+        Public function used to request a new frame after the map or its
+        settings or the view have changed. The frame is rendered on a worker
+        thread while the previous frame stays on screen; a frame still being
+        rendered for older settings is cancelled, so rapid edits never queue
+        up stale work
+
+        In the adaptive mode a quick draft is rendered first, and the full
+        quality frame only once no new frame has been requested for a moment,
+        so dragging a spinbox or the map stays responsive
+
+        Parameters:
+        -----------
+        Returns:
+        --------
         """
-        # Compute the scale parameter
-        t = self._map.getTransform()
-        w, h = t.width - 2*t.xOffset, t.height - 2*t.yOffset
-        # Clamp height
-        if w >= h:
-            scale = max_dim/h
-            width = max_dim
-            height = max_dim*h/w
-        # Clamp width
+        if self._map is None:
+            self.update()
+            return
+
+        if self._adaptive:
+            self._deferred = False
+            self._settle.start()
+            self._render(self._draft)
         else:
-            scale = max_dim/w
-            height = max_dim
-            width = max_dim*w/h
+            self._render()
 
-        # Instantiate the independent painter object on which we will draw the
-        # image
-        p = Painter(width, height)
+    def setAdaptive(self, state):
+        """
+        Public function used to select the adaptive mode (see redraw)
+
+        Parameters:
+        -----------
+        state : boolean
+            True to render drafts while the map is being edited; False to
+            always render full quality frames
 
-        # Create a new map object from which we'll draw this image
-        _map = Map(width, height, self._map.fname, self._config, scale=scale)
+        Returns:
+        --------
+        """
+        self._adaptive = state
+        if not state and self._settle.isActive():
+            self._settle.stop()
+            self._refine()
 
-        # Actually draw the map
-        _map.draw(p)
+    def saveImage(self, max_dim, fname):
+        """
+        Public function used to save the map as an image. The image is drawn
+        from the geometry that's already loaded; the OSM file isn't re-read
 
-        # Save the resulting image
-        p.saveImage(fname, fname[-3:], 100)
+        Parameters:
+        -----------
+        max_dim : float
+            The size of the image's longest side in pixels
+        fname : String
+            The image file name
 
-        # Delete the map object
-        del _map
+        Returns:
+        --------
+        """
+        image = self._map.export(max_dim)
+
+        # Save the resulting image
+        image.save(fname, fname[-3:], 100)
 
     """
     ###########################################################################
                                 Private Functions
     ###########################################################################
     """
-    def _drawPreloadScreen(self, p):
+    def _render(self, draft=None):
+        """
+        Private function used to start rendering a frame for the current
+        settings and view, cancelling any frame still being rendered
+
+        Parameters:
+        -----------
+        draft : tuple | None
+            The detail of a draft frame; None for a full quality frame
+
+        Returns:
+        --------
+        """
+        self._generation += 1
+        self._drafting = None if draft is None else self._generation
+
+        task = RenderTask(self._map, self._generation, self._currentGeneration,
+                          self._view, draft)
+        task.signals.finished.connect(self._frameFinished)
+        task.signals.timed.connect(self._frameTimed)
+        self._pool.start(task)
+
+    def _refine(self):
+        """
+        Private slot rendering the full quality frame once the edits settle.
+        A draft still being rendered is let finish first, rather than leaving
+        the screen without any frame of the latest settings
+        """
+        if self._map is None:
+            return
+
+        if self._drafting == self._generation:
+            self._deferred = True
+        else:
+            self._render()
+
+    def _frameTimed(self, generation, draft, done, seconds):
+        """
+        Private slot tuning the detail of the drafts to the frame budget. The
+        detail is scaled by how far the last draft was off the budget; a draft
+        cancelled after overrunning it still shows it was too detailed
+
+        Parameters:
+        -----------
+        generation : int
+            The generation the frame was rendered for
+        draft : boolean
+            Whether the frame was a draft
+        done : boolean
+            Whether the frame was completed
+        seconds : float
+            The time spent drawing the frame
+
+        Returns:
+        --------
+        """
+        if generation == self._drafting:
+            self._drafting = None
+            if self._deferred:
+                self._deferred = False
+                self._render()
+
+        if not draft or (not done and seconds < _FRAME_BUDGET):
+            return
+
+        factor = min(max(seconds/_FRAME_BUDGET, 0.5), 4)
+        self._draft = tuple(min(max(value*factor, low), high)
+                            for value, low, high in zip(self._draft,
+                                                        _DRAFT_MIN,
+                                                        _DRAFT_MAX))
+
+    def _currentGeneration(self):
+        """
+        Private function used by render tasks to check whether they are stale
+        """
+        return self._generation
+
+    def _setView(self, zoom, dx, dy):
+        """
+        Private function used to zoom and pan the map. The view is kept on
+        the canvas, so no empty space is ever shown, and a frame is requested
+        for it; nothing is re-projected, only the visible features are drawn
+
+        Parameters:
+        -----------
+        zoom : float
+            The scale of the canvas
+        dx, dy : float
+            Where the canvas' top left corner is on the widget
+
+        Returns:
+        --------
+        """
+        if self._map is None:
+            return
+
+        t = self._map.getTransform()
+        dx = min(max(dx, t.width*(1 - zoom)), 0)
+        dy = min(max(dy, t.height*(1 - zoom)), 0)
+
+        view = QTransform(zoom, 0, 0, zoom, dx, dy)
+        if view == self._view:
+            return
+
+        self._view = view
+        self.update()
+        self.redraw()
+
+    def _frameFinished(self, generation, image, view):
+        """
+        Private slot receiving frames from the render tasks
+
+        Parameters:
+        -----------
+        generation : int
+            The generation the frame was rendered for
+        image : QImage
+            The frame
+        view : QTransform
+            The view the frame was rendered for
+
+        Returns:
+        --------
+        """
+        # A newer frame was requested while this one was being delivered
+        if generation != self._generation:
+            return
+
+        self._frame = image
+        self._frameView = view
+        self.update()
+
+    def _drawPreloadScreen(self, p, text='Load an OSM file to begin!'):
         """
         Private function used to draw the text centered on the screen
         instructing the user to load an OSM file to begin
@@ -126,6 +395,8 @@ class MapWidget(QWidget):
         Parameters:
         -----------
         p : QPainter
+        text : String
+            The text shown
 
         Returns:
         --------
@@ -133,7 +404,6 @@ class MapWidget(QWidget):
         p.fillRect(0, 0, self.width(), self.height(),
                    self._config.getValue(c.CONFIG_BG_COLOR))
 
-        text = 'Load an OSM file to begin!'
         fm = p.fontMetrics()
         w, h = fm.width(text), fm.height()
-        p.drawText(self.width()/2-w/2, self.height()/2+h/2, text)
+        p.drawText(QPointF(self.width()/2-w/2, self.height()/2+h/2), text)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Rendering of a Map into a QImage off the GUI thread. Every task is stamped
+with the generation of the settings it was started for; as soon as a newer
+generation is requested the task stops drawing and its frame is discarded.
+"""
+
+import time
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter, QTransform
+
+
+class RenderSignals(QObject):
+    # The generation of the frame, the frame itself and its view
+    finished = pyqtSignal(int, QImage, QTransform)
+
+    # The generation of the frame, whether it is a draft, whether it was
+    # completed and the seconds spent drawing it; also sent for cancelled
+    # frames
+    timed = pyqtSignal(int, bool, bool, float)
+
+
+class RenderTask(QRunnable):
+    def __init__(self, _map, generation, current, view=None, draft=None):
+        """
+        Constructor
+
+        Parameters:
+        -----------
+        _map : Map
+            The map being rendered
+        generation : int
+            The generation of the settings this frame is rendered for
+        current : function
+            Returns the latest generation requested; the task is cancelled
+            once this no longer matches its own generation
+        view : QTransform | None
+            The zoom and pan of the frame, mapping the map's canvas onto the
+            frame; None shows the whole canvas
+        draft : tuple | None
+            The detail of a draft frame (see Map.draw); None renders the
+            frame at full quality
+        """
+        super(RenderTask, self).__init__()
+
+        # Bind class variables
+        self._map = _map
+        self._generation = generation
+        self._current = current
+        self._view = QTransform() if view is None else QTransform(view)
+        self._draft = draft
+
+        # Must be created here, on the GUI thread, so the frame is delivered
+        # to the GUI thread
+        self.signals = RenderSignals()
+
+    """
+    ###########################################################################
+                                Built-In Functions
+    ###########################################################################
+    """
+    def run(self):
+        """
+        Render the frame; called on a thread of the pool
+        """
+        # Superseded before we even started
+        if self.cancelled():
+            return
+
+        t = self._map.getTransform()
+        image = QImage(int(t.width), int(t.height),
+                       QImage.Format_ARGB32_Premultiplied)
+
+        p = QPainter(image)
+        p.setTransform(self._view)
+        t0 = time.perf_counter()
+        done = self._map.draw(p, self.cancelled, draft=self._draft)
+        seconds = time.perf_counter() - t0
+        p.end()
+
+        self.signals.timed.emit(self._generation, self._draft is not None,
+                                done, seconds)
+        if done and not self.cancelled():
+            self.signals.finished.emit(self._generation, image, self._view)
+
+    """
+    ###########################################################################
+                                Public Functions
+    ###########################################################################
+    """
+    def cancelled(self):
+        """
+        Function used to check whether a newer frame has been requested
+
+        Parameters:
+        -----------
+        Returns:
+        --------
+        <value> : boolean
+            True if this frame is stale
+        """
+        return self._generation != self._current()
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Test setup: the source folders are put on the path the way main.py does it,
+and Qt is told it has no display.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Simplify our imports from other files
+for subdir, dirs, files in os.walk(os.path.join(ROOT, 'src')):
+    for directory in dirs:
+        if directory != '__pycache__':
+            sys.path.append(os.path.join(subdir, directory))
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Functions shared by the tests: the reference ingestion of an OSM file and
+the comparison of the stores it produces.
+"""
+
+import os
+
+import numpy as np
+
+from NodeStore import NodeStore
+from FeatureStore import FeatureStore, Way, Relation
+import XMLReader
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+
+
+def fixture(name):
+    """
+    Function used to get the path of a file in the fixtures folder
+    """
+    return os.path.join(FIXTURES, name)
+
+
+def parse(fname):
+    """
+    Function used to read an OSM XML file with the XML parser, the reference
+    every other reader is compared with
+
+    Returns:
+    --------
+    <value> : tuple
+        The bounds and the frozen NodeStore, Way and Relation FeatureStores
+    """
+    nodes = NodeStore()
+    ways = FeatureStore(Way)
+    relations = FeatureStore(Relation)
+
+    with open(fname, 'rb') as f:
+        bounds = XMLReader.stream(f, nodes, ways, relations)
+
+    return freeze(bounds, nodes, ways, relations)
+
+
+def freeze(bounds, nodes, ways, relations):
+    """
+    Function used to freeze the stores of a reader, like Map does
+    """
+    nodes.freeze()
+    ways.freeze(nodes)
+    relations.freeze(ways)
+
+    return bounds, nodes, ways, relations
+
+
+def assertSameData(a, b):
+    """
+    Function used to check that two readers produced the same bounds and
+    stores, array for array
+    """
+    assert a[0] == b[0]
+
+    for x, y in zip(a[1:], b[1:]):
+        sx, sy = x.getState(), y.getState()
+        if isinstance(sx, tuple):
+            assert sx[1] == sy[1]
+            sx, sy = sx[0], sy[0]
+
+        assert sx.keys() == sy.keys()
+        for key in sx:
+            assert np.array_equal(sx[key], sy[key]), key
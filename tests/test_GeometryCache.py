@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the geometry cache's snapshots and their invalidation.
+"""
+
+import os
+import shutil
+
+import constants as c
+from GeometryCache import GeometryCache
+
+from helpers import fixture, parse, assertSameData
+
+
+def _copy(tmp_path):
+    fname = str(tmp_path/'sample.osm')
+    shutil.copy(fixture('sample.osm'), fname)
+    return fname
+
+
+def test_round_trip(tmp_path):
+    fname = _copy(tmp_path)
+    cache = GeometryCache(str(tmp_path/'cache'))
+    data = parse(fname)
+
+    assert cache.load(fname) is None
+    cache.save(fname, *data)
+
+    assertSameData(cache.load(fname), data)
+
+
+def test_removed_snapshot_is_gone(tmp_path):
+    fname = _copy(tmp_path)
+    cache = GeometryCache(str(tmp_path/'cache'))
+    pruned = GeometryCache(str(tmp_path/'cache'), pruned=True)
+    cache.save(fname, *parse(fname))
+    pruned.save(fname, *parse(fname))
+
+    # Removing a snapshot twice is harmless
+    cache.remove(fname)
+    cache.remove(fname)
+
+    assert cache.load(fname) is None
+    assert pruned.load(fname) is not None
+
+
+def test_modified_file_is_stale(tmp_path):
+    fname = _copy(tmp_path)
+    cache = GeometryCache(str(tmp_path/'cache'))
+    cache.save(fname, *parse(fname))
+
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert cache.load(fname) is None
+
+
+def test_version_is_stamped(tmp_path, monkeypatch):
+    fname = _copy(tmp_path)
+    cache = GeometryCache(str(tmp_path/'cache'))
+    cache.save(fname, *parse(fname))
+
+    monkeypatch.setattr(c, 'CACHE_VERSION', c.CACHE_VERSION + 1)
+
+    assert cache.load(fname) is None
+
+
+def test_pruned_snapshots_are_separate(tmp_path):
+    fname = _copy(tmp_path)
+    folder = str(tmp_path/'cache')
+    GeometryCache(folder).save(fname, *parse(fname))
+
+    assert GeometryCache(folder, pruned=True).load(fname) is None
+
+
+def test_styled_values_are_stamped(tmp_path, monkeypatch):
+    fname = _copy(tmp_path)
+    folder = str(tmp_path/'cache')
+    data = parse(fname)
+    GeometryCache(folder).save(fname, *data)
+    GeometryCache(folder, pruned=True).save(fname, *data)
+
+    # Styling a new value changes what a pruned load keeps, but not what a
+    # complete one stores
+    groups = {key: dict(values) for key, values in c.DATA_GROUPS.items()}
+    groups[c.KEY_HIGHWAY]['newvalue'] = c.CONFIG_STYLE_ROAD
+    monkeypatch.setattr(c, 'DATA_GROUPS', groups)
+
+    assert GeometryCache(folder).load(fname) is not None
+    assert GeometryCache(folder, pruned=True).load(fname) is None
+
+    # A new key changes what both store
+    groups['newkey'] = {'yes': c.CONFIG_STYLE_ROAD}
+
+    assert GeometryCache(folder).load(fname) is None
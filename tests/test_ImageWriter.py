@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the streamed PNG and TIFF writers, read back with Qt.
+"""
+
+import os
+
+import numpy as np
+import pytest
+from PyQt5.QtGui import QImage
+
+import ImageWriter
+
+
+def _pixels(fname):
+    image = QImage(fname)
+    assert not image.isNull()
+
+    image = image.convertToFormat(QImage.Format_RGB888)
+    data = np.frombuffer(image.constBits().asstring(image.sizeInBytes()),
+                         dtype=np.uint8)
+
+    # Qt pads each row to 4 bytes
+    return data.reshape(image.height(), -1)[:, :3*image.width()].reshape(
+        image.height(), image.width(), 3)
+
+
+@pytest.mark.parametrize('ext', ['.png', '.tif'])
+def test_round_trip(tmp_path, ext):
+    fname = str(tmp_path/('image' + ext))
+    pixels = np.random.default_rng(0).integers(0, 256, (45, 37, 3),
+                                               dtype=np.uint8)
+
+    # Strips of the same size except for the last
+    writer = ImageWriter.create(fname, 37, 45)
+    for top in range(0, 45, 10):
+        writer.write(pixels[top:top + 10])
+    writer.close()
+
+    assert np.array_equal(_pixels(fname), pixels)
+
+
+@pytest.mark.parametrize('ext', ['.png', '.tif'])
+def test_abort_removes_the_file(tmp_path, ext):
+    fname = str(tmp_path/('image' + ext))
+
+    writer = ImageWriter.create(fname, 8, 8)
+    writer.write(np.zeros((4, 8, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
+    writer.abort()
+
+    assert not os.path.exists(fname)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the MBTiles writer's rows and its deduplicated images.
+"""
+
+import sqlite3
+
+from MBTiles import MBTiles
+
+
+def _tiles(fname):
+    db = sqlite3.connect(fname)
+    try:
+        return {row[:3]: row[3] for row in db.execute(
+            'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles')}
+    finally:
+        db.close()
+
+
+def test_rows_are_flipped(tmp_path):
+    fname = str(tmp_path/'tiles.mbtiles')
+    tiles = MBTiles(fname, {'format': 'png', 'minzoom': 0, 'maxzoom': 3})
+    tiles.write(0, 0, 0, b'a')
+    tiles.write(3, 5, 0, b'b')
+    tiles.write(3, 5, 7, b'c')
+    tiles.write(3, 2, 1, b'd')
+    tiles.close()
+
+    # Slippy map rows count from the north, TMS rows from the south
+    assert _tiles(fname) == {(0, 0, 0): b'a', (3, 5, 7): b'b',
+                             (3, 5, 0): b'c', (3, 2, 6): b'd'}
+
+
+def test_repeated_images_are_stored_once(tmp_path):
+    fname = str(tmp_path/'tiles.mbtiles')
+    tiles = MBTiles(fname)
+    for x in range(4):
+        tiles.write(2, x, 0, b'sea')
+    tiles.write(2, 0, 1, b'land')
+    tiles.close()
+
+    assert (tiles.tiles, tiles.images) == (5, 2)
+    assert len(_tiles(fname)) == 5
+
+    # Reopening keeps the images already stored
+    tiles = MBTiles(fname)
+    tiles.write(2, 1, 1, b'sea')
+    tiles.close()
+
+    assert tiles.images == 2
+    assert _tiles(fname)[(2, 1, 2)] == b'sea'
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of what a Map keeps of a file when it is pruned.
+"""
+
+import constants as c
+from Map import Map, _RELATION_ORDER, _WAY_ORDER
+
+from helpers import fixture, parse, assertSameData
+from test_PBFReader import _encode
+
+
+def _drawn(feature, order):
+    tags = feature.tags
+    return any(tags.get(key) in c.DATA_GROUPS[key] for key in order)
+
+
+def test_prune_matches_brute_force():
+    bounds, nodes, ways, relations = parse(fixture('sample.osm'))
+    m = Map(800, 600, fixture('sample.osm'), None, cache=False, prune=True,
+            processes=1)
+
+    keptRelations = {r.ID: r for r in relations
+                     if _drawn(r, _RELATION_ORDER)}
+    members = {wid for r in keptRelations.values() for wid in r.WIDs}
+    keptWays = {w.ID: w for w in ways
+                if _drawn(w, _WAY_ORDER) or w.ID in members}
+    keptNodes = {nid for w in keptWays.values() for nid in w.NIDs}
+
+    assert 0 < len(keptWays) < len(ways)
+    assert {r.ID for r in m._relations} == set(keptRelations)
+    assert {w.ID for w in m._ways} == set(keptWays)
+    assert set(m._nodes.getState()['ids'].tolist()) == \
+        keptNodes & set(nodes.getState()['ids'].tolist())
+
+    # Members are still resolved to the same features
+    for w in m._ways:
+        assert list(w.NIDs) == list(keptWays[w.ID].NIDs)
+    for r in m._relations:
+        assert list(r.WIDs) == list(keptRelations[r.ID].WIDs)
+
+
+def test_prune_keeps_the_bounds_of_every_node(tmp_path):
+    # Without a bounds element the file is bounded by its Nodes, including
+    # the ones the pruning drops
+    with open(fixture('sample.osm'), 'rb') as f:
+        lines = [line for line in f if b'<bounds' not in line]
+    fname = str(tmp_path/'unbounded.osm')
+    with open(fname, 'wb') as f:
+        f.writelines(lines)
+
+    nodes = parse(fname)[1]
+    m = Map(800, 600, fname, None, cache=False, prune=True, processes=1)
+
+    assert len(m._nodes) < len(nodes)
+    assert (m._transform.minLat, m._transform.maxLat, m._transform.minLong,
+            m._transform.maxLong) == nodes.extent()
+
+
+def test_two_passes_match_pruning_once_read(tmp_path):
+    # Without streaming, the file is read whole and then pruned
+    once = Map(800, 600, fixture('sample.osm'), None, streaming=False,
+               cache=False, prune=True, processes=1)
+    pbf = str(tmp_path/'sample.osm.pbf')
+    _encode(fixture('sample.osm'), pbf)
+
+    for fname in (fixture('sample.osm'), pbf):
+        m = Map(800, 600, fname, None, cache=False, prune=True, processes=1)
+        assertSameData((None, m._nodes, m._ways, m._relations),
+                       (None, once._nodes, once._ways, once._relations))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the PBF reader against the XML parser. The PBF file is encoded
+from the XML fixture here, with every packed field split in two the way
+the format allows, so both readers see the same extract.
+"""
+
+import zlib
+import struct
+import xml.etree.ElementTree as ET
+
+import PBFReader
+
+from helpers import fixture, parse, freeze, assertSameData
+
+
+_MEMBER_TYPES = {'node': 0, 'way': 1, 'relation': 2}
+
+
+def _varint(value):
+    """
+    Function used to encode an unsigned (or two's complement) varint
+    """
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _number(field, value):
+    return _varint(field << 3) + _varint(value)
+
+
+def _bytes(field, data):
+    return _varint(field << 3 | 2) + _varint(len(data)) + data
+
+
+def _packed(field, values):
+    """
+    Function used to encode a packed field as two occurrences, which readers
+    must join
+    """
+    half = len(values)//2
+    return b''.join(_bytes(field, b''.join(_varint(v) for v in part))
+                    for part in (values[:half], values[half:]))
+
+
+def _deltas(values):
+    return [_zigzag(b - a) for a, b in zip([0] + values, values)]
+
+
+def _blob(kind, data):
+    blob = _number(2, len(data)) + _bytes(3, zlib.compress(data))
+    header = _bytes(1, kind.encode()) + _number(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def _block(strings, group):
+    table = b''.join(_bytes(1, s.encode()) for s in strings)
+    return _bytes(1, table) + _bytes(2, group)
+
+
+def _tags(element, strings):
+    tags = [(t.get('k'), t.get('v')) for t in element if t.tag == 'tag']
+    for k, v in tags:
+        for s in (k, v):
+            if s not in strings:
+                strings.append(s)
+    return ([strings.index(k) for k, v in tags],
+            [strings.index(v) for k, v in tags])
+
+
+def _encode(src, dst):
+    """
+    Function used to write an OSM XML file as a PBF file: a plain Node, the
+    other Nodes as DenseNodes, then a block of Ways and one of Relations
+    """
+    root = ET.parse(src).getroot()
+    b = root.find('bounds')
+    box = [float(b.get(k)) for k in ('minlon', 'maxlon', 'maxlat', 'minlat')]
+    header = _bytes(1, b''.join(_number(i + 1, _zigzag(round(v*1e9)))
+                                for i, v in enumerate(box)))
+
+    nodes = [(int(n.get('id')), round(float(n.get('lat'))*1e7),
+              round(float(n.get('lon'))*1e7)) for n in root.iter('node')]
+    plain = _bytes(1, b''.join(_number(f, _zigzag(v))
+                               for f, v in zip((1, 8, 9), nodes[0])))
+    dense = b''.join(_packed(f, _deltas([n[i] for n in nodes[1:]]))
+                     for f, i in ((1, 0), (8, 1), (9, 2)))
+
+    strings, ways = [''], b''
+    for w in root.iter('way'):
+        keys, values = _tags(w, strings)
+        refs = [int(nd.get('ref')) for nd in w if nd.tag == 'nd']
+        ways += _bytes(3, _number(1, int(w.get('id'))) + _packed(2, keys) +
+                       _packed(3, values) + _packed(8, _deltas(refs)))
+    wayBlock = _block(strings, ways)
+
+    strings, relations = [''], b''
+    for r in root.iter('relation'):
+        keys, values = _tags(r, strings)
+        members = [m for m in r if m.tag == 'member']
+        refs = [int(m.get('ref')) for m in members]
+        types = [_MEMBER_TYPES[m.get('type')] for m in members]
+        relations += _bytes(4, _number(1, int(r.get('id'))) +
+                            _packed(2, keys) + _packed(3, values) +
+                            _packed(9, _deltas(refs)) + _packed(10, types))
+
+    with open(dst, 'wb') as f:
+        f.write(_blob('OSMHeader', header))
+        f.write(_blob('OSMData', _block([''], plain)))
+        f.write(_blob('OSMData', _block([''], _bytes(2, dense))))
+        f.write(_blob('OSMData', wayBlock))
+        f.write(_blob('OSMData', _block(strings, relations)))
+
+
+def test_matches_parser(tmp_path):
+    fname = str(tmp_path/'sample.osm.pbf')
+    _encode(fixture('sample.osm'), fname)
+
+    assert PBFReader.isPBF(fname)
+    assertSameData(freeze(*PBFReader.read(fname, 1)),
+                   parse(fixture('sample.osm')))
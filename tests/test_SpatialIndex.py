@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the R-tree's queries against testing every box.
+"""
+
+import numpy as np
+import pytest
+
+from SpatialIndex import SpatialIndex
+
+
+def _boxes(rng, count):
+    lo = rng.uniform(-100, 100, (count, 2))
+    boxes = np.hstack((lo, lo + rng.exponential(2, (count, 2))))
+
+    # Points, and items that have no box
+    boxes[::7, 2:] = boxes[::7, :2]
+    boxes[::11] = np.nan
+
+    return boxes
+
+
+def _bruteForce(boxes, x0, y0, x1, y1):
+    with np.errstate(invalid='ignore'):
+        hit = ((boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) &
+               (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0))
+    return np.flatnonzero(hit)
+
+
+@pytest.mark.parametrize('count, fanout', [(0, 64), (1, 64), (500, 4),
+                                           (5000, 16), (20000, 64)])
+def test_matches_brute_force(count, fanout):
+    rng = np.random.default_rng(count)
+    boxes = _boxes(rng, count)
+    index = SpatialIndex(boxes, fanout)
+
+    # Rectangles from empty and tiny through to ones covering everything
+    for size in (0, 0.5, 5, 50, 500):
+        for _ in range(20):
+            x0, y0 = rng.uniform(-120, 120, 2)
+            rect = (x0, y0, x0 + size, y0 + size)
+            assert np.array_equal(index.query(*rect),
+                                  _bruteForce(boxes, *rect))
+
+    rect = (-1000, -1000, 1000, 1000)
+    assert np.array_equal(index.query(*rect), _bruteForce(boxes, *rect))
+    assert index.count == count
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the slippy map tile numbering and of the tiles drawn of a Map.
+"""
+
+import pytest
+from PyQt5.QtGui import QGuiApplication
+
+import Map as M
+from Map import Map
+from configuration import Configuration
+from TilePyramid import (TilePyramid, tileX, tileY, tileLong, tileLat,
+                         tileRange)
+
+from helpers import fixture
+
+
+# Tiles are drawn with Qt, which needs an application to outlive them
+_app = QGuiApplication.instance() or QGuiApplication([])
+
+
+@pytest.mark.parametrize('z', [0, 1, 5, 12, 18])
+def test_edges_invert_numbering(z):
+    for i in range(0, 2**z, max(2**z//7, 1)):
+        assert tileX(tileLong(i, z), z) == pytest.approx(i, abs=1e-6)
+        assert tileY(tileLat(i, z), z) == pytest.approx(i, abs=1e-6)
+
+    # Zoom 1 splits the world at the meridian and the equator
+    assert (tileLong(1, 1), tileLat(1, 1)) == (0, 0)
+
+
+def test_range_covers_bounds():
+    bounds = (40.0, 40.05, -75.05, -75.0)
+    x0, x1, y0, y1 = tileRange(bounds, 14)
+
+    assert x0 <= tileX(-75.05, 14) and tileX(-75.0, 14) < x1 + 1
+    assert y0 <= tileY(40.05, 14) and tileY(40.0, 14) < y1 + 1
+
+
+def test_tiles_outside_the_file_are_empty(tmp_path):
+    config = Configuration(str(tmp_path/'user.config'), persist=False)
+    pyramid = TilePyramid(Map(1000, 1000, fixture('sample.osm'), config,
+                              cache=False))
+    x0, x1, y0, y1 = tileRange(pyramid.bounds, 14)
+
+    image = pyramid.render(14, x0, y0)
+    assert (image.width(), image.height()) == (256, 256)
+    assert pyramid.render(14, x1 + 1, y0) is None
+    assert pyramid.render(14, x0, y0 - 1) is None
+    assert pyramid.tileCount(14) == (x1 - x0 + 1)*(y1 - y0 + 1)
+
+
+def test_tiles_are_the_same_in_bands(monkeypatch, tmp_path):
+    config = Configuration(str(tmp_path/'user.config'), persist=False)
+    pyramid = TilePyramid(Map(1000, 1000, fixture('sample.osm'), config,
+                              cache=False))
+    tiles = list(pyramid.tiles(16))
+
+    # Bands of a single row of cells each
+    monkeypatch.setattr(M, '_COVERAGE_CELLS', 1)
+
+    assert len(tiles) > 1
+    assert list(pyramid.tiles(16)) == tiles
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the tile server's cache keys and of the tiles it accepts.
+"""
+
+import os
+import shutil
+
+from PyQt5.QtGui import QGuiApplication
+
+import constants as c
+from Map import Map
+from TileServer import TileServer
+from TilePyramid import MAX_ZOOM, isTile
+from configuration import Configuration
+
+from helpers import fixture
+
+
+# Tiles are drawn with Qt, which needs an application to outlive them
+_app = QGuiApplication.instance() or QGuiApplication([])
+
+
+def _server(fname, config):
+    _map = Map(1000, 1000, fname, Configuration(config, persist=False),
+               cache=False)
+    server = TileServer(('127.0.0.1', 0), _map, config)
+    server.server_close()
+    return server
+
+
+def test_digest_follows_the_source(tmp_path):
+    fname, config = str(tmp_path/'sample.osm'), str(tmp_path/'user.config')
+    shutil.copy(fixture('sample.osm'), fname)
+    Configuration(config)
+
+    digest = _server(fname, config).tile(0, 0, 0)[0]
+    assert _server(fname, config).tile(0, 0, 0)[0] == digest
+
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert _server(fname, config).tile(0, 0, 0)[0] != digest
+
+
+def test_unreadable_config_keeps_the_last_one(tmp_path):
+    config = str(tmp_path/'user.config')
+    Configuration(config)
+    server = _server(fixture('sample.osm'), config)
+    digest = server.digest()
+    with open(config) as f:
+        text = f.read()
+
+    # As if read while the GUI is rewriting the file
+    with open(config, 'w') as f:
+        f.write('{"')
+    assert server.digest() == digest
+
+    # The next request retries once the file is whole again
+    with open(config, 'w') as f:
+        f.write(text)
+    Configuration(config).setItemState(c.CONFIG_STYLE_MOTORWAY, False)
+    assert server.digest() != digest
+
+def test_tiles_are_in_the_world():
+    assert isTile(0, 0, 0)
+    assert isTile(3, 7, 7)
+    assert not isTile(3, 8, 0)
+    assert not isTile(3, 0, -1)
+    assert not isTile(-1, 0, 0)
+    assert not isTile(MAX_ZOOM + 1, 0, 0)
+    assert not isTile(5000, 0, 0)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the XML reader's byte ranges against parsing the file whole.
+"""
+
+import pytest
+
+import Map as M
+import XMLReader
+
+from helpers import fixture, parse, freeze, assertSameData
+
+
+@pytest.mark.parametrize('count', [1, 2, 7, 40, 1000])
+def test_ranges_start_at_elements(count):
+    fname = fixture('sample.osm')
+    ranges = XMLReader.split(fname, count)
+
+    with open(fname, 'rb') as f:
+        data = f.read()
+
+    assert 1 <= len(ranges) <= count
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert data.rfind(b'</osm>') == ranges[-1][1]
+    for start, end in ranges:
+        assert data[start:start + 5] in (b'<boun', b'<node', b'<way ',
+                                         b'<rela')
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_ranges_match_parser(monkeypatch, processes):
+    # Ranges are normally no smaller than 8 MB
+    monkeypatch.setattr(XMLReader, '_MIN_RANGE', 200)
+
+    data = XMLReader.read(fixture('sample.osm'), processes)
+
+    assertSameData(freeze(*data), parse(fixture('sample.osm')))
+
+
+def _commented(tmp_path):
+    # Elements commented out after the bounds, making up most of the file
+    with open(fixture('sample.osm'), 'rb') as f:
+        lines = f.readlines()
+    hidden = [b'<node id="%d" lat="40.01" lon="-75.01"/>\n' % (900 + i)
+              for i in range(200)]
+    fname = str(tmp_path/'commented.osm')
+    with open(fname, 'wb') as f:
+        f.writelines(lines[:3] + [b'<!--\n'] + hidden + [b'-->\n'] +
+                     lines[3:])
+    return fname
+
+
+def test_ranges_cut_in_comments_fail(monkeypatch, tmp_path):
+    monkeypatch.setattr(XMLReader, '_MIN_RANGE', 200)
+
+    assert XMLReader.read(_commented(tmp_path), 1) is None
+
+
+def test_map_falls_back_to_parser(monkeypatch, tmp_path):
+    monkeypatch.setattr(XMLReader, '_MIN_RANGE', 200)
+    monkeypatch.setattr(M, '_PARALLEL_SIZE', 0)
+    fname = _commented(tmp_path)
+
+    _map = M.Map(800, 600, fname, None, cache=False, processes=2,
+                 ranges=True)
+
+    assert len(_map._nodes) == len(parse(fixture('sample.osm'))[1])
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the memory mapped XML scanner against the XML parser.
+"""
+
+import shutil
+
+import numpy as np
+
+import XMLScanner
+from Map import Map
+
+from helpers import fixture, parse, freeze, assertSameData
+
+
+def test_matches_parser():
+    data = XMLScanner.read(fixture('sample.osm'))
+
+    assert data is not None
+    assertSameData(freeze(*data), parse(fixture('sample.osm')))
+
+
+def test_interleaved_sections_fall_back():
+    # A Node after the first Way and a Way after the first Relation
+    assert XMLScanner.read(fixture('interleaved.osm')) is None
+
+
+def test_map_falls_back_to_parser():
+    fname = fixture('interleaved.osm')
+    _map = Map(800, 600, fname, None, cache=False, scan=True)
+    bounds, nodes, ways, relations = parse(fname)
+
+    assertSameData((bounds, _map._nodes, _map._ways, _map._relations),
+                   (bounds, nodes, ways, relations))
+    assert np.array_equal(nodes.getState()['ids'], [1, 2, 3])
+    assert ways.view(ways.index([11])[0]).tags == {'building': 'yes'}
+    assert relations.view(0).tags == {'natural': 'water'}
+
+
+def test_unsupported_layouts_fall_back(tmp_path):
+    with open(fixture('sample.osm'), encoding='utf-8') as f:
+        text = f.read()
+
+    layouts = {'comment': text.replace('<osm ', '<!-- note -->\n<osm ', 1),
+               'single quotes': text.replace('"', "'"),
+               'lon before lat': text.replace(' lat="40.', ' xlat="40.')}
+    for name, layout in layouts.items():
+        fname = tmp_path/'layout.osm'
+        fname.write_text(layout, encoding='utf-8')
+        assert XMLScanner.read(str(fname)) is None, name
+
+
+def test_empty_file(tmp_path):
+    fname = tmp_path/'empty.osm'
+    fname.write_bytes(b'')
+
+    assert XMLScanner.read(str(fname)) is None
+
+
+def test_small_windows(monkeypatch, tmp_path):
+    # Windows much smaller than the file must still end at element starts
+    monkeypatch.setattr(XMLScanner, '_WINDOW', 512)
+    fname = tmp_path/'sample.osm'
+    shutil.copy(fixture('sample.osm'), fname)
+
+    data = XMLScanner.read(str(fname))
+
+    assert data is not None
+    assertSameData(freeze(*data), parse(fixture('sample.osm')))